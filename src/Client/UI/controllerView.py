@@ -1,3 +1,4 @@
+import time
 import tkinter as tk
 
 from typing import Optional, Literal, Union
@@ -5,13 +6,18 @@ from pathlib import Path
 from PIL import Image, ImageTk
 from tkinter import ttk
 
-from src.Client.eventBus import CHANGED_CWD, IMAGE_SAVED
+from src.Client.eventBus import CHANGED_CWD, IMAGE_SAVED, CAPTURE_TIMING
 from src.logs import INFO, ERROR
 from src.Client.imagerClient import ImagerClient
+from src.Client.imagerClientConnection import CaptureTiming
 from src.Client.imagerApp import ImagerApp
+from src.Client.UI.imageDisplay import decode_scaled
+from src.Client.pyCOLONY.image_processing import DISH_ROI
+
+DISPLAY_SIZE = (400, 300)
 
 # black square default image
-DEFAULT_IMAGE = Image.new('RGB', (400, 300), color='black')
+DEFAULT_IMAGE = Image.new('RGB', DISPLAY_SIZE, color='black')
 
 """
 Class describes UI and behaviour of the imager control pane
@@ -24,7 +30,12 @@ class ControllerView:
 
         self.save_dir: Optional[Path] = None
 
-        self.imagerClient = ImagerClient(self.__log)
+        self.stream_frame: Optional[bytearray] = None   # newest live preview frame not yet shown
+        self.stream_frame_scheduled = False
+
+        self.capture_timing: Optional[CaptureTiming] = None   # timing of the last capture, until its decode is added
+
+        self.imagerClient = ImagerClient(self.__log, self.__on_capture_timing)
 
         self.app.event_bus.register(CHANGED_CWD, self.id, self.__setup_ui)
 
@@ -52,14 +63,72 @@ class ControllerView:
 
         self.app.task_frontend(lambda: self._switch_discover_btn("Shutdown"))
 
+    def _start_live_preview(self) -> None:
+        """backend method for starting the live preview stream"""
+        if not self.imagerClient.start_preview_stream(self.__on_stream_frame, self.fps_var.get()):
+            return
+
+        self.app.task_frontend(lambda: self._switch_live_btn(streaming=True))
+
+    def _stop_live_preview(self) -> None:
+        """backend method for stopping the live preview stream"""
+        if self.imagerClient.is_streaming():
+            self.imagerClient.stop_preview_stream()
+            self.__log(INFO, "stopped live preview")
+
+        self.app.task_frontend(lambda: self._switch_live_btn(streaming=False))
+
+    def __on_stream_frame(self, frame: bytearray) -> None:
+        """
+        Receives live preview frames (connection thread)
+
+        Only the newest frame is kept; a frontend update is only scheduled when none is pending,
+        so frames are dropped instead of queued when the display falls behind
+        """
+        self.stream_frame = frame
+
+        if not self.stream_frame_scheduled:
+            self.stream_frame_scheduled = True
+            self.app.task_frontend(self._show_stream_frame)
+
+    def _show_stream_frame(self) -> None:
+        """frontend method showing the newest live preview frame"""
+        self.stream_frame_scheduled = False
+        frame, self.stream_frame = self.stream_frame, None
+
+        if frame is None or not self.imagerClient.is_streaming():
+            return
+
+        self._display_image(decode_scaled(frame, DISPLAY_SIZE, fit=False))
+
+    def __on_capture_timing(self, timing: CaptureTiming) -> None:
+        """Receives the latency breakdown of a capture (capturing thread)"""
+        self.capture_timing = timing
+
+    def __decode_capture(self, source: Union[bytes, Path]) -> Image.Image:
+        """Decodes a captured image for display, emits the capture's timing completed with the decode time"""
+        started = time.monotonic()
+        image = decode_scaled(source, DISPLAY_SIZE, fit=False)
+
+        timing, self.capture_timing = self.capture_timing, None
+        if timing is not None:
+            timing.decode = time.monotonic() - started
+            self.app.emit(CAPTURE_TIMING, timing=timing)
+
+        return image
+
     def _capture_preview(self) -> None:
         """backend method for captring a preview (lower resolution) image"""
         try:
-            preview_image = self.imagerClient.capture_preview()
+            self._stop_live_preview()
+
+            preview = self.imagerClient.capture_preview()
 
-            if preview_image is None:
+            if preview is None:
+                self.app.task_frontend(lambda: self._set_capture_buttons(disabled=False))
                 return
 
+            preview_image = self.__decode_capture(preview)
             self.app.task_frontend(lambda: self._complete_capture(preview_image))
         except Exception as e:
             self.app.task_frontend(lambda: self._set_capture_buttons(disabled=False))
@@ -68,6 +137,8 @@ class ControllerView:
     def _capture_main(self) -> None:
         """backend method for captring a preview (higher resolution) image"""
         try:
+            self._stop_live_preview()
+
             if self.save_dir is None:
                 self.__log(ERROR, "please select a directory")
                 self.app.task_frontend(lambda: self._set_capture_buttons(disabled=False))
@@ -82,20 +153,41 @@ class ControllerView:
             
             fpath = self.save_dir / Path(fname)
 
-            main_image = self.imagerClient.capture_main(fpath)
+            options = {"roi": DISH_ROI} if self.crop_var.get() else None
+            if self.gray_var.get():
+                options = {**(options or {}), "gray": True}
+                fpath = fpath.with_suffix(".png")
 
-            if main_image is None:
+            if self.early_preview_var.get():
+                preview, main = self.imagerClient.capture_main_with_preview(fpath, options)
+                preview.add_done_callback(lambda future: self.__show_capture_preview(future.result()))
+                saved = main.result()
+            else:
+                saved = self.imagerClient.capture_main(fpath, options)
+
+            if saved is None:
                 self.app.task_frontend(lambda: self._set_capture_buttons(disabled=False))
                 return
 
             self.app.emit(IMAGE_SAVED, path=fpath)
 
+            main_image = self.__decode_capture(fpath)
+
             self.app.task_frontend(lambda: self._complete_capture(main_image))
 
         except Exception as e:
             self.app.task_frontend(lambda: self._set_capture_buttons(disabled=False))
             raise e
 
+    def __show_capture_preview(self, preview: Optional[bytes]) -> None:
+        """Shows the preview of a main capture while the main image is still transferring (connection thread)"""
+        if preview is None:
+            return
+
+        preview_image = decode_scaled(preview, DISPLAY_SIZE, fit=False)
+        self.app.task_frontend(lambda: self._display_image(preview_image))
+        self.__log(INFO, "showing preview of new image, main image still transferring")
+
     def _start_capture(self, preview: bool) -> None:
         """
         Frontend wrapper for starting a capture
@@ -115,8 +207,54 @@ class ControllerView:
         self.__log(INFO, "showing new image")
         self._set_capture_buttons(disabled=False)
 
+    def _start_series(self) -> None:
+        """backend method for starting a time-lapse series into the save directory"""
+        if self.save_dir is None:
+            self.__log(ERROR, "please select a directory")
+            return
+
+        try:
+            interval = self.series_interval_var.get()
+            count = self.series_count_var.get()
+        except tk.TclError:
+            self.__log(ERROR, "please enter a valid interval and count")
+            return
+
+        self._stop_live_preview()
+        options = {"roi": DISH_ROI} if self.crop_var.get() and not self.series_preview_var.get() else None
+        self.imagerClient.capture_series(self.save_dir, interval, count, self.series_preview_var.get(), self.__on_series_frame, options)
+
+    def _sync_spool(self) -> None:
+        """backend method pulling the captures spooled on the imager into the save directory"""
+        if self.save_dir is None:
+            self.__log(ERROR, "please select a directory")
+            return
+
+        if self.imagerClient.sync_spool(self.save_dir) is None:
+            self.__log(ERROR, "imager has no capture spool")
+
+    def __on_series_frame(self, path: Path) -> None:
+        """Receives the path of every saved series frame (connection thread)"""
+        self.__log(INFO, f"stored series frame at {path}")
+        self.app.emit(IMAGE_SAVED, path=path)
+
+    def _toggle_calibration(self) -> None:
+        """backend method locking or unlocking focus and exposure on the imager"""
+        if not self.lock_var.get():
+            self.imagerClient.unlock_calibration()
+            return
+
+        calibration = self.imagerClient.lock_calibration()
+        if calibration is None:
+            self.app.task_frontend(lambda: self.lock_var.set(False))
+            return
+
+        self.__log(INFO, f"locked lens position {calibration['lens_position']}, exposure {calibration['exposure_time']} us, "
+                         f"gain {calibration['analogue_gain']:.2f}")
+
     def _power_off(self) -> None:
         try:
+            self._stop_live_preview()
             self.imagerClient.power_off()
             self.__log(INFO, f"powering off RPI (wait a moment before unplugging)")
         except:
@@ -132,18 +270,33 @@ class ControllerView:
         top_frame = ttk.Frame(self.frame, padding="10")
         top_frame.grid(row=0, column=0, sticky=tk.W + tk.E)
         
-        # Address input
+        # Address input, lists the imagers found by service browsing
         self.address_var = tk.StringVar(value="raspberrypi.local")
-        self.address_entry = ttk.Entry(top_frame, textvariable=self.address_var, width=30)
+        self.address_entry = ttk.Combobox(top_frame, textvariable=self.address_var, width=30,
+                                          postcommand=lambda: self.address_entry.configure(values=self.imagerClient.known_imagers()))
         self.address_entry.grid(row=0, column=0, padx=(0, 10), sticky=tk.W + tk.E)
         
         # Discover button
         self.discover_btn = ttk.Button(top_frame, text="Discover", command=lambda: self.app.task_backend(self._discover))
         self.discover_btn.grid(row=0, column=1, sticky=tk.W)
         
+        # Preview frame for preview capture and live preview controls
+        preview_frame = ttk.Frame(self.frame)
+        preview_frame.grid(row=1, column=0, padx=10, pady=10, sticky=tk.W + tk.E)
+
         # Preview capture button
-        self.preview_btn = ttk.Button(self.frame, text="Capture Preview", command=lambda: self._start_capture(preview=True))
-        self.preview_btn.grid(row=1, column=0, padx=10, pady=10, sticky=tk.W + tk.E)
+        self.preview_btn = ttk.Button(preview_frame, text="Capture Preview", command=lambda: self._start_capture(preview=True))
+        self.preview_btn.grid(row=0, column=0, sticky=tk.W + tk.E)
+
+        # Live preview button
+        self.live_btn = ttk.Button(preview_frame, text="Start Live Preview", command=lambda: self.app.task_backend(self._start_live_preview))
+        self.live_btn.grid(row=0, column=1, padx=(10, 0), sticky=tk.W + tk.E)
+
+        # Live preview frame rate
+        self.fps_var = tk.DoubleVar(value=5)
+        self.fps_spinbox = ttk.Spinbox(preview_frame, from_=1, to=30, increment=1, width=4, textvariable=self.fps_var)
+        self.fps_spinbox.grid(row=0, column=2, padx=(5, 0))
+        ttk.Label(preview_frame, text="fps").grid(row=0, column=3, padx=(2, 0))
         
         # Image display area
         self.image_tk = ImageTk.PhotoImage(DEFAULT_IMAGE)
@@ -151,12 +304,54 @@ class ControllerView:
         self.image_label.grid(row=2, column=0, padx=10, pady=10)
         
         # Main capture button
-        self.main_btn = ttk.Button(self.frame, text="Capture Main", command=lambda: self._start_capture(preview=False))
-        self.main_btn.grid(row=3, column=0, padx=10, pady=10, sticky=tk.W + tk.E)
+        main_frame = ttk.Frame(self.frame)
+        main_frame.grid(row=3, column=0, padx=10, pady=10, sticky=tk.W + tk.E)
+
+        self.main_btn = ttk.Button(main_frame, text="Capture Main", command=lambda: self._start_capture(preview=False))
+        self.main_btn.grid(row=0, column=0, sticky=tk.W + tk.E)
+
+        # Crop main captures to the petri dish on the imager, saves transfer and decode time
+        self.crop_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(main_frame, text="crop to dish on imager", variable=self.crop_var).grid(row=0, column=1, padx=(10, 0))
+
+        # Luma only as lossless PNG, all pyCOLONY analysis uses; no colour on the wire or to decode
+        self.gray_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(main_frame, text="gray for analysis", variable=self.gray_var).grid(row=0, column=2, padx=(10, 0))
+
+        # Focus and meter once, then every capture (series frames too) reuses it and skips autofocus
+        self.lock_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(main_frame, text="lock focus and exposure", variable=self.lock_var,
+                        command=lambda: self.app.task_backend(self._toggle_calibration)).grid(row=0, column=3, padx=(10, 0))
+
+        # Show a preview of the same exposure while the main image transfers; only the picamera2 backend
+        # makes it without waiting for the main image, on rpicam imagers it only adds a decode
+        self.early_preview_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(main_frame, text="early preview", variable=self.early_preview_var).grid(row=0, column=4, padx=(10, 0))
         
+        # Series frame for time-lapse captures
+        series_frame = ttk.Frame(self.frame)
+        series_frame.grid(row=4, column=0, padx=10, sticky=tk.W + tk.E)
+
+        self.series_btn = ttk.Button(series_frame, text="Start Series", command=lambda: self.app.task_backend(self._start_series))
+        self.series_btn.grid(row=0, column=0, sticky=tk.W + tk.E)
+
+        # Series interval and number of captures
+        self.series_interval_var = tk.DoubleVar(value=60)
+        ttk.Label(series_frame, text="every").grid(row=0, column=1, padx=(10, 2))
+        ttk.Spinbox(series_frame, from_=1, to=86400, increment=10, width=6, textvariable=self.series_interval_var).grid(row=0, column=2)
+        ttk.Label(series_frame, text="s, count").grid(row=0, column=3, padx=(2, 2))
+        self.series_count_var = tk.IntVar(value=10)
+        ttk.Spinbox(series_frame, from_=1, to=10000, increment=1, width=6, textvariable=self.series_count_var).grid(row=0, column=4)
+
+        self.series_preview_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(series_frame, text="previews", variable=self.series_preview_var).grid(row=0, column=5, padx=(10, 0))
+
+        # Pulls what the imager spooled while disconnected, afterwards again on every reconnect
+        ttk.Button(series_frame, text="Pull Spool", command=lambda: self.app.task_backend(self._sync_spool)).grid(row=0, column=6, padx=(10, 0))
+
         # Directory selection frame
         dir_frame = ttk.Frame(self.frame, padding="10")
-        dir_frame.grid(row=4, column=0, sticky=tk.W + tk.E, pady=10)
+        dir_frame.grid(row=5, column=0, sticky=tk.W + tk.E, pady=10)
         
         # Directory path display
         self.save_dir = path
@@ -172,6 +367,10 @@ class ControllerView:
         # Configure grid weights for resizing
         self.frame.columnconfigure(0, weight=1)
         top_frame.columnconfigure(0, weight=1)
+        preview_frame.columnconfigure(0, weight=1)
+        preview_frame.columnconfigure(1, weight=1)
+        main_frame.columnconfigure(0, weight=1)
+        series_frame.columnconfigure(0, weight=1)
         dir_frame.columnconfigure(0, weight=1)
         self.frame.rowconfigure(2, weight=1)
 
@@ -190,8 +389,8 @@ class ControllerView:
 
     def _display_image(self, image: Image.Image):
         """Update the image display with a new image"""
-        if image.size != (400, 300):
-            image = image.resize((400, 300), Image.Resampling.LANCZOS)
+        if image.size != DISPLAY_SIZE:
+            image = image.resize(DISPLAY_SIZE, Image.Resampling.LANCZOS)
 
         self.image_tk = ImageTk.PhotoImage(image)
         self.image_label.configure(image=self.image_tk)
@@ -202,6 +401,12 @@ class ControllerView:
         else:
             self.discover_btn.configure(text="Shutdown", command=lambda: self.app.task_backend(self._power_off))
 
+    def _switch_live_btn(self, streaming: bool) -> None:
+        if streaming:
+            self.live_btn.configure(text="Stop Live Preview", command=lambda: self.app.task_backend(self._stop_live_preview))
+        else:
+            self.live_btn.configure(text="Start Live Preview", command=lambda: self.app.task_backend(self._start_live_preview))
+
     def _set_capture_buttons(self, disabled: bool) -> None:
         state = "disabled" if disabled else "enabled"
         self.main_btn.configure(state=state)
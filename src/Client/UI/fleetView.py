@@ -0,0 +1,202 @@
+import tkinter as tk
+
+from typing import Optional
+from pathlib import Path
+from tkinter import ttk
+
+from src.Client.eventBus import IMAGE_SAVED
+from src.logs import INFO, ERROR
+from src.Client.imagerFleet import ImagerFleet
+from src.Client.imagerApp import ImagerApp
+from src.Client.pyCOLONY.image_processing import DISH_ROI
+
+"""
+Class describes UI and behaviour of the fleet control pane, which drives several imagers at once
+"""
+class FleetView:
+    def __init__(self, app: ImagerApp, frame: tk.Frame) -> None:
+        self.app = app
+        self.frame = frame
+        self.id = self.app.event_bus.getId()
+
+        self.fleet = ImagerFleet(self.__log)
+
+        self.__setup_ui()
+
+    def __log(self, type: str, msg: str) -> None:
+        """
+        Logs under ImagerFleet name
+        """
+        self.app.log(type, msg, "ImagerFleet")
+
+    def __directory(self) -> Optional[Path]:
+        if self.app.state.CWD is None:
+            self.__log(ERROR, "please select a working directory")
+        return self.app.state.CWD
+
+    def __selected(self) -> Optional[list[str]]:
+        """Names of the selected devices, None (all devices) if nothing is selected"""
+        selection = self.device_tree.selection()
+        return list(selection) if selection else None
+
+    def _add_device(self) -> None:
+        """backend method connecting to the device in the address entry"""
+        address = self.address_var.get()
+
+        if address == "":
+            self.__log(ERROR, "no address provided")
+            return
+
+        if self.fleet.add(address) is not None:
+            self.__log(INFO, f"added {address} to the fleet")
+
+        self.app.task_frontend(self._refresh_devices)
+
+    def _remove_devices(self, names: Optional[list[str]]) -> None:
+        """backend method disconnecting from the given devices"""
+        for name in names or []:
+            self.fleet.remove(name)
+
+        self.app.task_frontend(self._refresh_devices)
+
+    def _capture(self, names: Optional[list[str]], preview: bool) -> None:
+        """backend method capturing on the given devices in parallel"""
+        directory = self.__directory()
+
+        if directory is None:
+            return
+
+        options = {"roi": DISH_ROI} if self.crop_var.get() and not preview else None
+        results = self.fleet.capture(directory, names, preview, options)
+
+        for path in results.values():
+            if path is not None:
+                self.app.emit(IMAGE_SAVED, path=path)
+
+        failed = [name for name, path in results.items() if path is None]
+        if failed:
+            self.__log(ERROR, f"capture failed on {', '.join(failed)}")
+
+        self.app.task_frontend(self._refresh_devices)
+
+    def _start_series(self, names: Optional[list[str]]) -> None:
+        """backend method starting a time-lapse series on the given devices"""
+        directory = self.__directory()
+
+        if directory is None:
+            return
+
+        try:
+            interval = self.series_interval_var.get()
+            count = self.series_count_var.get()
+        except tk.TclError:
+            self.__log(ERROR, "please enter a valid interval and count")
+            return
+
+        preview = self.series_preview_var.get()
+        options = {"roi": DISH_ROI} if self.crop_var.get() and not preview else None
+        self.fleet.capture_series(directory, interval, count, preview, self.__on_series_frame, names, options)
+
+        self.app.task_frontend(self._refresh_devices)
+
+    def __on_series_frame(self, path: Path) -> None:
+        """Receives the path of every saved series frame (connection thread)"""
+        self.app.emit(IMAGE_SAVED, path=path)
+
+    def __power_off_selected(self) -> None:
+        """frontend method powering off the selected devices, never all of them by default"""
+        names = self.__selected()
+        if names is None:
+            self.__log(ERROR, "please select the devices to power off")
+            return
+
+        self.app.task_backend(lambda: self._power_off(names))
+
+    def _power_off(self, names: list[str]) -> None:
+        """backend method powering off the given devices"""
+        self.fleet.power_off(names)
+        self.__log(INFO, f"powering off {', '.join(names)}")
+
+        self.app.task_frontend(self._refresh_devices)
+
+    def __setup_ui(self) -> None:
+        """
+        Set up the user interface elements
+        """
+        # Top frame for adding and removing devices, lists the imagers found by service browsing
+        top_frame = ttk.Frame(self.frame, padding="10")
+        top_frame.grid(row=0, column=0, sticky=tk.W + tk.E)
+
+        self.address_var = tk.StringVar(value="raspberrypi.local")
+        self.address_entry = ttk.Combobox(top_frame, textvariable=self.address_var, width=30,
+                                          postcommand=lambda: self.address_entry.configure(values=self.fleet.known_imagers()))
+        self.address_entry.grid(row=0, column=0, padx=(0, 10), sticky=tk.W + tk.E)
+
+        ttk.Button(top_frame, text="Add", command=lambda: self.app.task_backend(self._add_device)).grid(row=0, column=1)
+        ttk.Button(top_frame, text="Remove",
+                   command=lambda: self.app.task_backend(lambda names=self.__selected(): self._remove_devices(names))).grid(row=0, column=2, padx=(5, 0))
+
+        # Device list with status and latency of the last capture
+        self.device_tree = ttk.Treeview(self.frame, columns=("status", "latency"), selectmode="extended", height=8)
+        self.device_tree.heading("#0", text="Device")
+        self.device_tree.heading("status", text="Status")
+        self.device_tree.heading("latency", text="Last capture")
+        self.device_tree.column("status", width=100)
+        self.device_tree.column("latency", width=100)
+        self.device_tree.grid(row=1, column=0, padx=10, sticky=tk.W + tk.E + tk.N + tk.S)
+
+        # Capture buttons, act on the selected devices or on all if none are selected
+        capture_frame = ttk.Frame(self.frame, padding="10")
+        capture_frame.grid(row=2, column=0, sticky=tk.W + tk.E)
+
+        ttk.Button(capture_frame, text="Capture Main",
+                   command=lambda: self.app.task_backend(lambda names=self.__selected(): self._capture(names, preview=False))).grid(row=0, column=0, sticky=tk.W + tk.E)
+        ttk.Button(capture_frame, text="Capture Preview",
+                   command=lambda: self.app.task_backend(lambda names=self.__selected(): self._capture(names, preview=True))).grid(row=0, column=1, padx=(10, 0), sticky=tk.W + tk.E)
+
+        self.crop_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(capture_frame, text="crop to dish on imager", variable=self.crop_var).grid(row=0, column=2, padx=(10, 0))
+
+        # Series controls
+        series_frame = ttk.Frame(self.frame, padding="10")
+        series_frame.grid(row=3, column=0, sticky=tk.W + tk.E)
+
+        ttk.Button(series_frame, text="Start Series",
+                   command=lambda: self.app.task_backend(lambda names=self.__selected(): self._start_series(names))).grid(row=0, column=0, sticky=tk.W + tk.E)
+
+        self.series_interval_var = tk.DoubleVar(value=60)
+        ttk.Label(series_frame, text="every").grid(row=0, column=1, padx=(10, 2))
+        ttk.Spinbox(series_frame, from_=1, to=86400, increment=10, width=6, textvariable=self.series_interval_var).grid(row=0, column=2)
+        ttk.Label(series_frame, text="s, count").grid(row=0, column=3, padx=(2, 2))
+        self.series_count_var = tk.IntVar(value=10)
+        ttk.Spinbox(series_frame, from_=1, to=10000, increment=1, width=6, textvariable=self.series_count_var).grid(row=0, column=4)
+
+        self.series_preview_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(series_frame, text="previews", variable=self.series_preview_var).grid(row=0, column=5, padx=(10, 0))
+
+        # Power off button, acts on the selected devices only
+        ttk.Button(self.frame, text="Power Off", command=self.__power_off_selected).grid(row=4, column=0, padx=10, pady=10, sticky=tk.W + tk.E)
+
+        # Configure grid weights for resizing
+        self.frame.columnconfigure(0, weight=1)
+        self.frame.rowconfigure(1, weight=1)
+        top_frame.columnconfigure(0, weight=1)
+        capture_frame.columnconfigure(0, weight=1)
+        capture_frame.columnconfigure(1, weight=1)
+        series_frame.columnconfigure(0, weight=1)
+
+    def _refresh_devices(self) -> None:
+        """frontend method showing the current devices, their status and latency"""
+        devices = self.fleet.select()
+        names = {device.name for device in devices}
+
+        for item in self.device_tree.get_children():
+            if item not in names:
+                self.device_tree.delete(item)
+
+        for device in devices:
+            latency = "" if device.latency is None else f"{device.latency:.2f}s"
+            if self.device_tree.exists(device.name):
+                self.device_tree.item(device.name, values=(device.status, latency))
+            else:
+                self.device_tree.insert("", tk.END, iid=device.name, text=device.name, values=(device.status, latency))
@@ -0,0 +1,30 @@
+import io
+
+from typing import Union
+from pathlib import Path
+from PIL import Image
+
+REDUCING_GAP = 2.0  # images still this many times larger than the target are box-reduced before resampling
+
+def decode_scaled(source: Union[bytes, bytearray, Path], size: tuple[float, float], fit: bool = True) -> Image.Image:
+    """
+    Decodes an encoded image for display at size, without decoding it at full resolution
+
+    JPEGs are decoded at the smallest DCT scale (1/2, 1/4 or 1/8) still covering size (draft mode),
+    then whatever is left is box-reduced by an integer factor and LANCZOS-resampled to size
+
+    source: encoded image bytes or path of an image file
+    size: (width, height) to display at
+    fit: keep the aspect ratio and fit within size without enlarging (like Image.thumbnail),
+         False resizes to exactly size
+    """
+    size = (max(1, int(size[0])), max(1, int(size[1])))
+
+    with Image.open(io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source) as image:
+        image.draft("RGB", size)
+
+        if fit:
+            ratio = min(1, size[0] / image.width, size[1] / image.height)
+            size = (max(1, round(image.width * ratio)), max(1, round(image.height * ratio)))
+
+        return image.resize(size, Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
@@ -2,12 +2,13 @@ import tkinter as tk
 
 from typing import Optional
 from pathlib import Path
-from tkinter import filedialog
+from tkinter import ttk, filedialog
 
 from src.logs import INFO, ERROR
 from src.Client.UI.pyCOLONYView import PyCOLONYView
 from src.Client.UI.logView import LogView
 from src.Client.UI.controllerView import ControllerView
+from src.Client.UI.fleetView import FleetView
 from src.Client.imagerApp import ImagerApp
 from src.Client.eventBus import CHANGED_CWD, SAVE_ANALYZED, SAVE_FINISHED
 
@@ -72,9 +73,19 @@ class ImagerAppUI:
         self.left_pane.add(self.pycolony_frame, height="560")
         self.left_pane.add(self.logging_frame, height="40")
 
-        # imager control frame
+        # imager control frame, one tab for a single imager and one for the fleet
         self.imager_frame = tk.Frame(self.main_pane)
-        self.controller_view = ControllerView(self.app, self.imager_frame)
+        self.imager_tabs = ttk.Notebook(self.imager_frame)
+        self.imager_tabs.pack(expand=True, fill=tk.BOTH)
+
+        self.controller_frame = tk.Frame(self.imager_tabs)
+        self.controller_view = ControllerView(self.app, self.controller_frame)
+        self.imager_tabs.add(self.controller_frame, text="Imager")
+
+        self.fleet_frame = tk.Frame(self.imager_tabs)
+        self.fleet_view = FleetView(self.app, self.fleet_frame)
+        self.imager_tabs.add(self.fleet_frame, text="Fleet")
+
         self.imager_frame.pack(expand=True, fill=tk.BOTH, padx=10, pady=10)
 
         self.main_pane.add(self.left_pane, width="800")
@@ -5,7 +5,7 @@ import numpy as np
 
 from dataclasses import dataclass
 from pathlib import Path
-from PIL import Image, ImageTk
+from PIL import ImageTk
 from typing import Optional
 from tkinter import ttk
 
@@ -14,6 +14,7 @@ from src.Client.imagerApp import ImagerApp
 from src.Client.eventBus import CHANGED_CWD, FINISHED_ANALYSIS, SAVE_ANALYZED, SAVE_FINISHED, IMAGE_SAVED
 from src.Client.pyCOLONY.file_io import find_images, write_properties_to_file
 from src.Client.pyCOLONY.image_processing import process1, label2rgboverlay
+from src.Client.UI.imageDisplay import decode_scaled
 
 import gc
 import matplotlib
@@ -28,6 +29,8 @@ import matplotlib.figure as mfig
 from matplotlib.text import Annotation
 from matplotlib.image import AxesImage
 
+THUMBNAIL_SIZE = (120, 90)
+
 #===========--- Helper classes for displaying analyzed image ---================
 @dataclass
 class AnalysisFigureRegion:
@@ -230,11 +233,9 @@ class PyCOLONYView:
         container = tk.Frame(self.inner_frame, padx=5, pady=5)
         container.pack(side=tk.LEFT, padx=5, pady=5)
 
-        with Image.open(path) as img:
-            img.thumbnail((120, 90), Image.Resampling.LANCZOS)
-            thumbnail = ImageTk.PhotoImage(img)
-            img_label = tk.Label(container, image=thumbnail, cursor="hand2")
-            img_label.image = thumbnail # anti-garbage collection # type: ignore
+        thumbnail = ImageTk.PhotoImage(decode_scaled(path, THUMBNAIL_SIZE))
+        img_label = tk.Label(container, image=thumbnail, cursor="hand2")
+        img_label.image = thumbnail # anti-garbage collection # type: ignore
 
         img_label.pack()
 
@@ -270,14 +271,12 @@ class PyCOLONYView:
             widget.place(x=0, y=0, anchor="nw", relwidth=1, relheight=1)
         else:
             # Setting up image in large_frame
-            with Image.open(path) as img:
-                frame_width = self.large_frame.winfo_width()
-                frame_height = self.large_frame.winfo_height()
-                img.thumbnail((frame_width*.97, frame_height*.97), Image.Resampling.LANCZOS)
-                large_image = ImageTk.PhotoImage(img)
-                large_image_label = tk.Label(self.large_frame, image=large_image, bg="lightgray")
-                large_image_label.image = large_image # else image gets garbage collected # type: ignore
-                large_image_label.pack(fill=tk.BOTH, expand=True)
+            frame_width = self.large_frame.winfo_width()
+            frame_height = self.large_frame.winfo_height()
+            large_image = ImageTk.PhotoImage(decode_scaled(path, (frame_width*.97, frame_height*.97)))
+            large_image_label = tk.Label(self.large_frame, image=large_image, bg="lightgray")
+            large_image_label.image = large_image # else image gets garbage collected # type: ignore
+            large_image_label.pack(fill=tk.BOTH, expand=True)
 
         # Un-highlighting image in gallery
         if not self.current_selected is None:
@@ -473,7 +472,7 @@ class PyCOLONYView:
         fig, ax = plt.subplots()
         fig.patch.set_alpha(1)
         axim_overlay = ax.imshow(image_label_overlay)
-        axim_original = ax.imshow(original)
+        axim_original = ax.imshow(original, cmap="gray")   # colour captures ignore the colormap
         axim_original.set_visible(False)
 
         for region in region_properties:
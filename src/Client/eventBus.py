@@ -15,6 +15,8 @@ SAVE_FINISHED = "<Save-Finished>" # (path: Path)
 
 IMAGE_SAVED = "<Image-Saved>" # (path: Path)
 
+CAPTURE_TIMING = "<Capture-Timing>" # (timing: CaptureTiming)
+
 #===============================================================================
 
 """
@@ -0,0 +1,154 @@
+import time
+import threading
+
+from typing import Optional
+from dataclasses import dataclass
+
+from src.connections import SERVICE_TYPE
+
+DISCOVERY_TTL = 120         # seconds a resolved imager is trusted without being resolved again
+RESOLVE_TIMEOUT = 3000      # milliseconds to wait for the records of a service
+BROWSER_RETRY_DELAY = 30    # seconds before starting the browser again after it failed, doubled after every failure
+MAX_BROWSER_RETRY_DELAY = 600
+
+@dataclass
+class ImagerRecord:
+    name: str           # service instance name, e.g. "raspberrypi"
+    server: str         # hostname of the imager, e.g. "raspberrypi.local"
+    address: str
+    port: int
+    resolved_at: float
+
+    def matches(self, hostname: str) -> bool:
+        """True if hostname refers to this imager (instance name or hostname, with or without .local)"""
+        hostname = hostname.rstrip(".").lower()
+        return hostname in [self.name.lower(), f"{self.name.lower()}.local", self.server.lower()]
+
+class ImagerBrowser:
+    def __init__(self, ttl: float = DISCOVERY_TTL) -> None:
+        """
+        Browses for imagers advertising SERVICE_TYPE in the background and caches where they are
+
+        Records are re-resolved every ttl / 2 and dropped when the service goes away or has not
+        been resolved for ttl seconds, so lookups are answered from memory
+
+        ttl: seconds a resolved record stays valid
+        """
+        self.ttl = ttl
+        self.records : dict[str, ImagerRecord] = {}     # by full service name
+        self.changed = threading.Condition()
+        self.stopped = threading.Event()
+
+        self.zeroconf = None
+        self.browser = None
+
+    def start(self) -> None:
+        """Starts browsing, raises if zeroconf is unavailable"""
+        from zeroconf import Zeroconf, ServiceBrowser, IPVersion
+
+        self.zeroconf = Zeroconf(ip_version=IPVersion.V4Only)
+        self.browser = ServiceBrowser(self.zeroconf, SERVICE_TYPE, handlers=[self.__on_service_state_change])
+        threading.Thread(target=self.__refresh, daemon=True).start()
+
+    def close(self) -> None:
+        self.stopped.set()
+        if self.zeroconf is not None:
+            self.zeroconf.close()
+            self.zeroconf = None
+
+    def __on_service_state_change(self, zeroconf, service_type: str, name: str, state_change) -> None:
+        """Called by the browser, which must not be blocked, so services are resolved on their own thread"""
+        from zeroconf import ServiceStateChange
+
+        if state_change is ServiceStateChange.Removed:
+            with self.changed:
+                self.records.pop(name, None)
+            return
+
+        threading.Thread(target=self.__resolve, args=(name,), daemon=True).start()
+
+    def __resolve(self, name: str) -> None:
+        from zeroconf import IPVersion
+
+        zeroconf = self.zeroconf
+        if zeroconf is None:
+            return
+
+        info = zeroconf.get_service_info(SERVICE_TYPE, name, timeout=RESOLVE_TIMEOUT)
+        if info is None or info.port is None:
+            return
+
+        addresses = info.parsed_addresses(IPVersion.V4Only)
+        if not addresses:
+            return
+
+        record = ImagerRecord(name[:-len(SERVICE_TYPE) - 1], (info.server or "").rstrip("."), addresses[0], info.port, time.monotonic())
+        with self.changed:
+            self.records[name] = record
+            self.changed.notify_all()
+
+    def __refresh(self) -> None:
+        """Re-resolves known imagers, so records stay fresh while their services are up"""
+        while not self.stopped.wait(self.ttl / 2):
+            with self.changed:
+                names = list(self.records)
+            for name in names:
+                self.__resolve(name)
+
+    def __valid(self) -> list[ImagerRecord]:
+        now = time.monotonic()
+        return [record for record in self.records.values() if now - record.resolved_at < self.ttl]
+
+    def imagers(self) -> list[ImagerRecord]:
+        """Imagers currently known, by instance name"""
+        with self.changed:
+            return sorted(self.__valid(), key=lambda record: record.name)
+
+    def lookup(self, hostname: str, timeout: float = 0) -> Optional[ImagerRecord]:
+        """
+        Cached record of the imager called hostname
+
+        timeout: seconds to wait for it to be found if it is not known yet
+        """
+        deadline = time.monotonic() + timeout
+        with self.changed:
+            while True:
+                for record in self.__valid():
+                    if record.matches(hostname):
+                        return record
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.changed.wait(remaining)
+
+shared_browser_lock = threading.Lock()
+shared_browser : Optional[ImagerBrowser] = None
+browser_retry_at = 0.0                  # monotonic time before which a failed browser is not started again
+browser_retry_delay = BROWSER_RETRY_DELAY
+
+def get_browser() -> Optional[ImagerBrowser]:
+    """
+    The browser shared by all connections of this process, started on first use; None if zeroconf is unavailable
+
+    A browser that failed to start is only tried again after a backoff, callers use it on every lookup and reconnect
+    """
+    global shared_browser, browser_retry_at, browser_retry_delay
+
+    with shared_browser_lock:
+        if shared_browser is None:
+            if time.monotonic() < browser_retry_at:
+                return None
+
+            browser = ImagerBrowser()
+            try:
+                browser.start()
+            except Exception:
+                browser.close()
+                browser_retry_at = time.monotonic() + browser_retry_delay
+                browser_retry_delay = min(browser_retry_delay * 2, MAX_BROWSER_RETRY_DELAY)
+                return None
+            shared_browser = browser
+            browser_retry_delay = BROWSER_RETRY_DELAY
+
+        return shared_browser
@@ -1,79 +1,344 @@
+import json
+import datetime
+import threading
+
 from pathlib import Path
 from typing import Optional, Callable
-from PIL import Image
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from src.logs import INFO, ERROR
-from src.Client.imagerClientConnection import ImagerClientConnection
+from src.connections import Status, sha256_file, decode_json
+from src.Client.imagerClientConnection import ImagerClientConnection, SeriesDownload, CaptureTiming
+from src.Client.imagerBrowser import get_browser
 
 TEST = Path("preview.jpg")
+SPOOL_PULLS = 3                             # spooled captures fetched at once
+SPOOL_MANIFEST = ".spool_manifest.json"     # sha256 -> file name of the spooled captures stored in a directory
+SERIES_RETRY_DELAY = 1                      # seconds before re-attaching to a series the imager did not hand over
+MAX_SERIES_RETRIES = 5                      # refused re-attach attempts before waiting for the next reconnect
 
 class ImagerClient:
-    def __init__(self, log: Callable[[str, str], None]) -> None:
+    def __init__(self, log: Callable[[str, str], None], on_timing: Optional[Callable[[CaptureTiming], None]] = None) -> None:
         """
         Constructs an imager client which handles user inputs
+
+        on_timing: called with the latency breakdown of every capture (see ImagerClientConnection)
         """
 
         self.__log = log
-        self.imagerConnection = ImagerClientConnection(log)
+        self.imagerConnection = ImagerClientConnection(log, self.__resume_series, on_timing)
+        self.series : Optional[SeriesDownload] = None   # series that has not been fully downloaded yet
+        self.series_future : Optional[Future] = None    # request currently downloading the series
+        self.spool_dir : Optional[Path] = None          # directory spooled captures are pulled into, again on reconnect
+        self.spool_lock = threading.Lock()              # one sync at a time
 
     def connection_repr(self) -> str:
         return str(self.imagerConnection)
 
-    def discover(self, hostname: str) -> Optional[str]:
+    def known_imagers(self) -> list[str]:
+        """Names of the imagers found by service browsing"""
+        browser = get_browser()
+        return [] if browser is None else [record.name for record in browser.imagers()]
+
+    def discover(self, hostname: str, port: Optional[int] = None) -> Optional[str]:
         """
-        Looks for IP address of Raspberry Pi using mDNS and tries to connect on protocol port
+        Looks for IP address of Raspberry Pi using mDNS and tries to connect to it
 
-        hostname: string that represents the canonical hostname (raspberrypi.local)
+        hostname: string that represents the canonical hostname (raspberrypi.local) or advertised name
+        port: port the imager listens on, by default the advertised one (or the protocol port)
         """
         self.__log(INFO, f"looking for {hostname}")
 
-        ip = self.imagerConnection.discover(hostname)
+        found = self.imagerConnection.discover(hostname)
 
-        if ip is None:
+        if found is None:
             return
 
-        self.__log(INFO, f"found hostname at {ip}, attempting connection")
-        
-        if self.imagerConnection.connect(ip) is None:
+        ip, found_port = found
+        port = found_port if port is None else port
+
+        self.__log(INFO, f"found hostname at {ip}:{port}, attempting connection")
+
+        if self.imagerConnection.connect(ip, port) is None:
             return
 
         self.__log(INFO, f"connected successfully to {self.imagerConnection}")
 
+        self.__resume_series()
+
         return ip
     
-    def capture_preview(self) -> Optional[Image.Image]:
-        """Captures a preview image"""
+    def capture_preview(self) -> Optional[bytes]:
+        """Captures a preview image, returns its JPEG bytes (decoded only by whoever displays it)"""
         self.__log(INFO, "attempting capture of preview")
 
-        image = self.imagerConnection.capture(preview=True)
+        return self.imagerConnection.capture(preview=True)
+    
+    def start_preview_stream(self, on_frame: Callable[[bytearray], None], fps: float) -> bool:
+        """
+        Starts live preview, on_frame receives every JPEG frame
+
+        return: True if the stream started
+        """
+        self.__log(INFO, f"starting live preview at {fps} fps")
+
+        return self.imagerConnection.start_preview_stream(on_frame, fps) is not None
 
-        if image is None:
+    def stop_preview_stream(self) -> None:
+        """Stops live preview"""
+        self.imagerConnection.stop_preview_stream()
+
+    def is_streaming(self) -> bool:
+        """True while a live preview stream is running"""
+        return self.imagerConnection.preview_stream_id is not None
+
+    def capture_main(self, filepath: Path, options: Optional[dict] = None, parallel: int = 1,
+                     on_preview: Optional[Callable[[bytes], None]] = None) -> Optional[Path]:
+        """
+        Captures a main image, its bytes are stored in filepath as received, without decoding
+
+        options: crop, size and JPEG quality to apply on the imager (see ImagerClientConnection.capture_to_file)
+        parallel: connections the image is fetched over at once (see ImagerClientConnection.capture_to_file)
+        on_preview: called with a small JPEG of the same exposure before the image arrives (see ImagerClientConnection.capture_to_file)
+        """
+        if filepath.exists():
+            self.__log(ERROR, f"path {filepath} already exists; aborting")
             return
 
-        return image
-    
-    def capture_main(self, filepath: Path) -> Optional[Image.Image]:
-        """Captures a main image"""
+        self.__log(INFO, "attempting capture of main" + (" with preview" if on_preview is not None else ""))
+
+        if self.imagerConnection.capture_to_file(filepath, preview=False, options=options, parallel=parallel, on_preview=on_preview) is None:
+            return
+
+        self.__log(INFO, f"stored main capture at {filepath}")
+
+        return filepath
+
+    def capture_main_with_preview(self, filepath: Path, options: Optional[dict] = None, parallel: int = 1) -> tuple[Future, Future]:
+        """
+        Captures a main image and a small preview of the same exposure in one shot, without waiting for either
+
+        The preview future resolves to the preview's JPEG bytes as soon as the imager has made it, while the main
+        image may still be encoded and transferred, or to None if the imager sent none (e.g. older imagers).
+        The main future resolves like capture_main, to filepath or None
+
+        options: crop, size and JPEG quality to apply on the imager, "preview": [width, height] the preview fits within
+        return: (preview future, main future)
+        """
+        preview : Future = Future()
+        main : Future = Future()
+
+        def capture() -> None:
+            try:
+                main.set_result(self.capture_main(filepath, options, parallel,
+                                                  on_preview=lambda image: preview.done() or preview.set_result(image)))
+            except Exception as e:
+                main.set_exception(e)
+            finally:
+                if not preview.done():
+                    preview.set_result(None)
+
+        threading.Thread(target=capture, daemon=True).start()
+        return preview, main
+
+    def capture_to_file(self, filepath: Path, preview: bool, options: Optional[dict] = None) -> Optional[Path]:
+        """
+        Captures an image straight into filepath without decoding it
+
+        return: filepath on success, else None
+        """
         if filepath.exists():
             self.__log(ERROR, f"path {filepath} already exists; aborting")
             return
 
-        self.__log(INFO, "attempting capture of main")
+        return self.imagerConnection.capture_to_file(filepath, preview, options)
 
-        image = self.imagerConnection.capture(preview=False)
+    def recent_captures(self) -> list[dict]:
+        """Recent captures the imager keeps, oldest first (see ImagerClientConnection.list_captures)"""
+        return self.imagerConnection.list_captures() or []
 
-        if image is None:
+    def fetch_capture(self, capture_id: int, filepath: Path, size: Optional[tuple[int, int]] = None) -> Optional[Path]:
+        """
+        Fetches a recent capture again into filepath without taking a new image
+
+        size: fetch a downscaled variant fitting within (width, height) instead of the full image
+        return: filepath on success, else None
+        """
+        if filepath.exists():
+            self.__log(ERROR, f"path {filepath} already exists; aborting")
             return
 
-        self.__log(INFO, "received main image")
+        self.__log(INFO, f"fetching capture {capture_id}")
 
-        image.save(filepath)
+        return self.imagerConnection.fetch_capture(capture_id, filepath, size)
 
-        self.__log(INFO, f"stored main capture at {filepath}")
+    def lock_calibration(self) -> Optional[dict]:
+        """Focuses and meters once, later captures reuse it until unlock_calibration (see ImagerClientConnection.calibrate)"""
+        self.__log(INFO, "locking focus and exposure")
+        return self.imagerConnection.calibrate()
 
-        return image
+    def unlock_calibration(self) -> bool:
+        """Captures focus and meter on their own again"""
+        self.__log(INFO, "unlocking focus and exposure")
+        return self.imagerConnection.invalidate_calibration()
+
+    def capture_series(self, directory: Path, interval: float, count: int, preview: bool,
+                       on_saved: Callable[[Path], None], options: Optional[dict] = None) -> bool:
+        """
+        Starts a time-lapse series, frames are saved into directory with sequential names as they arrive
+
+        If the connection drops the imager keeps capturing, the download resumes on the next discover
+
+        interval: seconds between captures
+        count: number of captures
+        preview: True captures previews, False captures mains
+        on_saved: called (from the connection reader thread) with the path of every saved frame
+        options: crop, size and JPEG quality to apply on the imager
+        return: True if the series started
+        """
+        if self.is_series_running():
+            self.__log(ERROR, "a series is already running")
+            return False
+
+        prefix = f"series_{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        self.__log(INFO, f"starting series of {count} captures every {interval}s as {prefix}_*")
+
+        series = SeriesDownload(directory, prefix, on_saved)
+        if not self.__run_series(series, interval, count, preview, options):
+            return False
+
+        self.series = series
+        return True
+
+    def sync_spool(self, directory: Path, parallel: int = SPOOL_PULLS) -> Optional[int]:
+        """
+        Pulls the captures spooled on the imager that are not in directory yet, then lets the imager delete them
+
+        The imager's manifest is compared by SHA-256 with the one kept in directory, missing captures are
+        fetched several at a time and checked against their hash before being acknowledged. After this,
+        the directory is synced again whenever the connection is re-established
+
+        parallel: number of captures fetched at once
+        return: number of captures pulled, None if the imager has no spool or the manifest is unavailable
+        """
+        self.spool_dir = directory
+        if not self.spool_lock.acquire(blocking=False):
+            self.__log(INFO, "spool sync already running")
+            return 0
+
+        try:
+            spool = self.imagerConnection.list_spool()
+            if spool is None:
+                return
+
+            manifest_path = directory / SPOOL_MANIFEST
+            try:
+                local = json.loads(manifest_path.read_text())
+            except (OSError, ValueError):
+                local = {}
+
+            stored = [entry for entry in spool["captures"] if entry["sha256"] in local and (directory / local[entry["sha256"]]).is_file()]
+            missing = [entry for entry in spool["captures"] if entry not in stored]
+            self.__log(INFO, f"imager spools {len(spool['captures'])} capture(s), {len(missing)} to pull")
+
+            with ThreadPoolExecutor(max_workers=parallel) as executor:
+                pulled = [entry for entry in executor.map(lambda entry: self.__pull_spooled(directory, entry), missing) if entry is not None]
+
+            for entry in pulled:
+                local[entry["sha256"]] = self.__spooled_name(entry)
+            manifest_path.write_text(json.dumps(local, indent=1))
+
+            acked = self.imagerConnection.ack_spooled([entry["spool_id"] for entry in stored + pulled])
+            if acked is None:
+                self.__log(ERROR, "could not acknowledge the pulled captures, they stay spooled on the imager")
+
+            self.__log(INFO, f"pulled {len(pulled)}/{len(missing)} spooled capture(s) into {directory}")
+            return len(pulled)
+        finally:
+            self.spool_lock.release()
+
+    def __spooled_name(self, entry: dict) -> str:
+        captured_at = datetime.datetime.fromtimestamp(entry["captured_at"]).strftime("%Y%m%d-%H%M%S")
+        return f"spooled_{captured_at}_{entry['spool_id']:08d}{Path(entry['name']).suffix}"
+
+    def __pull_spooled(self, directory: Path, entry: dict) -> Optional[dict]:
+        """Fetches one spooled capture and checks its hash, returns entry if it is stored intact"""
+        path = directory / self.__spooled_name(entry)
+        if self.imagerConnection.fetch_spooled(entry["spool_id"], path) is None:
+            return
+
+        if sha256_file(path) != entry["sha256"]:
+            self.__log(ERROR, f"spooled capture {entry['spool_id']} does not match its hash, discarded")
+            path.unlink(missing_ok=True)
+            return
+
+        return entry
+
+    def __resume_series(self) -> None:
+        """Continues downloading a series the imager kept capturing while the connection was down, syncs the spool"""
+        if self.spool_dir is not None:
+            threading.Thread(target=self.sync_spool, args=(self.spool_dir,), daemon=True).start()
+
+        series = self.series
+        if self.series_future is not None and not self.series_future.done():
+            return
+
+        if series is not None and series.series_id is not None:
+            self.__log(INFO, f"resuming download of series {series.series_id}")
+            self.__run_series(series)
+
+    def __run_series(self, series: SeriesDownload, interval: float = 0, count: int = 0, preview: bool = False,
+                     options: Optional[dict] = None) -> bool:
+        future = self.imagerConnection.capture_series(series, interval, count, preview, options)
+
+        if future is None:
+            return False
+
+        self.series_future = future
+        future.add_done_callback(lambda future: self.__series_done(series, future))
+        return True
+
+    def __series_done(self, series: SeriesDownload, future: Future) -> None:
+        """
+        Forgets the series once it was downloaded completely or the imager no longer knows it, keeps it for resuming otherwise
+
+        A re-attach the imager refused for another reason is retried a few times, then left to the next reconnect
+        """
+        if future.exception() is not None:
+            self.__log(ERROR, f"connection lost during series {series.series_id}, {series.saved} frame(s) saved so far")
+            return
+
+        response = future.result()
+        if response.status == Status.OK:
+            self.__log(INFO, f"series {series.series_id} complete, {series.saved} frame(s) saved")
+        elif response.status == Status.FAILED and decode_json(response.body).get("reason") == "unknown":
+            self.__log(ERROR, f"imager no longer holds series {series.series_id}")
+        else:
+            if series.retries < MAX_SERIES_RETRIES:
+                series.retries += 1
+                self.__log(INFO, f"imager did not hand over series {series.series_id}, retrying in {SERIES_RETRY_DELAY}s")
+                timer = threading.Timer(SERIES_RETRY_DELAY, self.__retry_series, args=(series,))
+                timer.daemon = True
+                timer.start()
+            else:
+                self.__log(ERROR, f"imager did not hand over series {series.series_id}, resuming on the next reconnect")
+            return
+
+        if self.series is series:
+            self.series = None
+
+    def __retry_series(self, series: SeriesDownload) -> None:
+        if self.series is series and (self.series_future is None or self.series_future.done()):
+            self.__run_series(series)
+
+    def is_series_running(self) -> bool:
+        """True while a series has frames left to download"""
+        return self.series is not None
+
+    def close(self) -> None:
+        """Closes the connection without powering off the imager"""
+        self.imagerConnection.close()
 
-    
     def power_off(self) -> None:
         """Sends power off signal"""        
         self.imagerConnection.power_off()
\ No newline at end of file
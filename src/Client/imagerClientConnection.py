@@ -1,62 +1,751 @@
-import io
+import os
+import time
 import socket
+import ipaddress
+import itertools
+import threading
 
 from typing import Optional, Callable
-from PIL import Image
+from pathlib import Path
+from dataclasses import dataclass, field
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as ReplyTimeout
 
-from src.connections import Connection, RequestType, rtob, PROTOCOL_PORT
-from src.logs import ERROR
-from src.exceptions import CaptureFailed
+from src.connections import Connection, RequestType, MessageKind, Status, Frame, rtob, encode_json, decode_json, \
+                            PROTOCOL_PORT, PROTOCOL_VERSIONS, TRANSFER_CHUNK_SIZE, partial_path
+from src.logs import INFO, ERROR
+from src.exceptions import CaptureFailed, NoConnectionAvailable, SocketReceivedBytesEmpty
+from src.Client.imagerBrowser import get_browser
+
+REPLY_TIMEOUT = 120     # seconds the connection of a request may be silent before its response is given up
+HELLO_TIMEOUT = 5       # seconds to wait for the answer to version negotiation
+MAX_RESUME_ATTEMPTS = 3 # times an interrupted chunked transfer is resumed before giving up
+RANGE_SIZE = 4 << 20    # bytes fetched per FETCH_RANGE request in parallel mode
+MAX_PARALLEL = 4        # connections of a parallel transfer, the imager serves 8 clients at once by default
+
+HEARTBEAT_INTERVAL = 10 # seconds a v2 connection may be silent before a heartbeat is sent
+HEARTBEAT_TIMEOUT = 30  # seconds to wait for the heartbeat reply, it may queue behind a transfer
+RECONNECT_DELAY = 1     # seconds before the first reconnect attempt, doubled after every failure
+MAX_RECONNECT_DELAY = 30
+RECONNECT_WAIT = 5      # seconds a request waits for a reconnect in progress
+DISCOVERY_WAIT = 1      # seconds to wait for an imager to show up in service browsing when its name does not resolve
+
+V1_CAPABILITIES = [RequestType.CHECK_CONNECTED.name, RequestType.CAPTURE_MAIN.name,
+                   RequestType.CAPTURE_PREVIEW.name, RequestType.POWER_OFF.name]
+
+class RequestFuture(Future):
+    def __init__(self, request_id: int, connection: Optional[Connection] = None) -> None:
+        """Future for the response Frame of the request with given ID sent on connection, meta collects its META messages"""
+        super().__init__()
+        self.request_id = request_id
+        self.connection = connection
+        self.meta : dict = {}
+
+@dataclass
+class PendingRequest:
+    future: RequestFuture
+    sink: Optional[Path]    # file to stream the response body into, kept in memory if None
+    on_data: Optional[Callable[[bytearray], None]] = None   # called with the body of every DATA message
+    on_meta: Optional[Callable[[dict], None]] = None        # called with every META message
+    data_sink: Optional[Callable[[], Path]] = None          # gives the file to stream each DATA body into
+    on_data_saved: Optional[Callable[[Path], None]] = None  # called once a DATA body was written to its data_sink file
+    chunks: Optional["ChunkedDownload"] = None              # receives DATA bodies of a chunked transfer
+    connection: Optional[Connection] = None                 # connection the request was sent on
+
+class ChunkedDownload:
+    def __init__(self, path: Path) -> None:
+        """
+        Writes the chunks of a chunked transfer into path
+
+        Only the part of the file received intact from its start counts, so after an interruption
+        or a checksum mismatch the transfer is resumed from received. The chunks go into a partial
+        file that replaces path once the download is kept
+        """
+        self.path = path
+        self.partial = partial_path(path)
+        self.transfer_id : Optional[int] = None
+        self.size : Optional[int] = None
+        self.received = 0       # bytes from the start of the file received intact
+        self.corrupt = False    # a chunk failed its checksum, later chunks are dropped until resumed
+
+        self.buffer = bytearray(TRANSFER_CHUNK_SIZE)
+        self.fd = os.open(self.partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+    def on_meta(self, meta: dict) -> None:
+        """Takes transfer ID, size and start offset from the META message announcing the chunks"""
+        if "transfer_id" not in meta:
+            return
+
+        self.transfer_id = meta["transfer_id"]
+        self.size = meta["size"]
+        self.received = meta.get("offset", 0)
+        self.corrupt = False
+
+    def receive(self, connection: Connection, size: int) -> None:
+        """Receives one DATA body (reader thread) and writes it into place if it is intact and in order"""
+        self.buffer = connection.chunk_buffer(size, self.buffer)
+        offset, data, intact = connection.recv_chunk(size, self.buffer)
+
+        if self.corrupt or offset != self.received:
+            return
+
+        if not intact:
+            self.corrupt = True
+            return
+
+        os.pwrite(self.fd, data, offset)
+        self.received += len(data)
+
+    def is_complete(self) -> bool:
+        return self.size is not None and self.received == self.size and not self.corrupt
+
+    def close(self, keep: bool) -> None:
+        """Closes the file, moves it to path if keep, else removes it"""
+        if self.is_complete():
+            os.ftruncate(self.fd, self.received)
+        os.close(self.fd)
+
+        if keep:
+            os.replace(self.partial, self.path)
+        else:
+            self.partial.unlink(missing_ok=True)
+
+class StreamedDownload:
+    def __init__(self, path: Optional[Path] = None) -> None:
+        """
+        Collects the DATA bodies of a streamed capture in order
+
+        path: file to write the image into (through a partial file that replaces path once kept), kept in memory if None
+        """
+        self.path = path
+        self.buffer = bytearray()
+        self.received = 0
+        self.size : Optional[int] = None    # announced by the imager once the stream has ended
+        self.file = partial_path(path).open("wb") if path is not None else None
+
+    def on_meta(self, meta: dict) -> None:
+        self.size = meta.get("size", self.size)
+
+    def on_data(self, data: bytearray) -> None:
+        """Appends one DATA body (reader thread)"""
+        if self.file is not None:
+            self.file.write(data)
+        else:
+            self.buffer += data
+        self.received += len(data)
+
+    def is_complete(self) -> bool:
+        return self.size is not None and self.received == self.size
+
+    def close(self, keep: bool) -> None:
+        """Closes the file, moves it to path if keep, else removes it"""
+        if self.file is None or self.path is None:
+            return
+
+        self.file.close()
+        if keep:
+            os.replace(partial_path(self.path), self.path)
+        else:
+            partial_path(self.path).unlink(missing_ok=True)
+
+class RangePool:
+    def __init__(self, open_connection: Callable[[], Connection], size: int) -> None:
+        """
+        Small pool of extra v2 connections to the imager and the threads using them, one range request at a time
+        for parallel transfers; both are kept between transfers, at most size connections are open at once
+
+        open_connection: opens and negotiates a new connection
+        size: number of connections (and threads)
+        """
+        self.open_connection = open_connection
+        self.size = size
+        self.idle : list[Connection] = []
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="range")
+
+    def map(self, fetch: Callable[[tuple[int, int]], bool], spans: list[tuple[int, int]]) -> list[bool]:
+        """Runs fetch for every (offset, length) span on the pool's threads, returns the results in order"""
+        return list(self.executor.map(fetch, spans))
+
+    def acquire(self) -> Connection:
+        """Takes an idle connection or opens a new one, raises if the imager cannot be reached"""
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return self.open_connection()
+
+    def release(self, connection: Connection, healthy: bool) -> None:
+        """Returns a connection, closed instead if a request on it failed or the pool is full"""
+        with self.lock:
+            if healthy and len(self.idle) < self.size:
+                self.idle.append(connection)
+                return
+        connection.close()
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+class ParallelDownload:
+    def __init__(self, path: Path, size: int) -> None:
+        """
+        Writes the ranges of a transfer fetched over several connections into a preallocated partial file
+
+        Every range is written in place with pwrite, so they can arrive in any order
+        """
+        self.path = path
+        self.partial = partial_path(path)
+        self.size = size
+
+        self.fd = os.open(self.partial, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.posix_fallocate(self.fd, 0, size)
+        except (AttributeError, OSError):   # not available on every platform and filesystem
+            os.ftruncate(self.fd, size)
+
+    def ranges(self, parallel: int) -> list[tuple[int, int]]:
+        """(offset, length) of the ranges covering the file, at most RANGE_SIZE but at least one per connection"""
+        range_size = max(1, min(RANGE_SIZE, -(-self.size // parallel)))
+        return [(offset, min(range_size, self.size - offset)) for offset in range(0, self.size, range_size)]
+
+    def receive_range(self, connection: Connection, request_id: int, offset: int, length: int) -> bool:
+        """
+        Receives the chunks of one FETCH_RANGE request and writes them into place
+
+        return: True if the whole range arrived intact and the imager completed the request
+        """
+        buffer = bytearray(TRANSFER_CHUNK_SIZE)
+        expected = offset
+        while True:
+            kind, code, response_id, size = connection.recv_frame_header()
+            if response_id != request_id:
+                raise SocketReceivedBytesEmpty()    # the pool connection is out of step, drop it
+
+            if kind == MessageKind.DATA:
+                buffer = connection.chunk_buffer(size, buffer)
+                chunk_offset, data, intact = connection.recv_chunk(size, buffer)
+                if not intact or chunk_offset != expected:
+                    return False
+                os.pwrite(self.fd, data, chunk_offset)
+                expected += len(data)
+            else:
+                body = connection.recvb(size) if size else bytearray()
+                if body is None:
+                    raise SocketReceivedBytesEmpty()
+                if kind == MessageKind.RESPONSE:
+                    return code == Status.OK.value and expected == offset + length
+
+    def close(self, keep: bool) -> None:
+        """Closes the file, moves it to path if keep, else removes it"""
+        os.close(self.fd)
+
+        if keep:
+            os.replace(self.partial, self.path)
+        else:
+            self.partial.unlink(missing_ok=True)
+
+@dataclass
+class SeriesDownload:
+    directory: Path
+    prefix: str                         # frames are saved as <prefix>_<index><suffix>
+    on_saved: Callable[[Path], None]
+    series_id: Optional[int] = None     # assigned by the imager
+    index: int = 0                      # index of the frame announced by the last META message
+    spool_id: Optional[int] = None      # ID the imager spools that frame under, if it does
+    suffix: str = ".jpg"                # file suffix of that frame, ".png" for lossless gray frames
+    saved: int = 0
+    retries: int = 0                    # re-attach attempts the imager refused since the last successful one
+    stored: set[int] = field(default_factory=set)   # indices of the frames saved, the imager resends unacknowledged ones
+
+    def on_meta(self, meta: dict) -> None:
+        self.series_id = meta.get("series_id", self.series_id)
+        if "index" in meta:
+            self.index = meta["index"]
+            self.spool_id = meta.get("spool_id")
+            self.suffix = meta.get("suffix", ".jpg")
+            self.retries = 0
+
+    def next_path(self) -> Path:
+        return self.directory / f"{self.prefix}_{self.index + 1:04d}{self.suffix}"
+
+    def on_frame_saved(self, path: Path) -> None:
+        """Counts and passes on a saved frame, a frame sent again after a re-attach only replaced its own file"""
+        if self.index in self.stored:
+            return
+
+        self.stored.add(self.index)
+        self.saved += 1
+        self.on_saved(path)
+
+@dataclass
+class CaptureTiming:
+    """Where the time of a capture went, in seconds"""
+    requested_at: float
+    total: Optional[float] = None       # from sending the request to the image being received
+    queue: Optional[float] = None       # waiting for the camera on the imager
+    capture: Optional[float] = None     # taking the image on the imager
+    phases: dict[str, float] = field(default_factory=dict)  # the imager's breakdown of capture
+    receive: Optional[float] = None     # from the imager finishing the capture to the image being received
+    send: Optional[float] = None        # the imager reading and sending the image (chunked and streamed captures only)
+    preview: Optional[float] = None     # from sending the request to the preview of a dual capture being received
+    decode: Optional[float] = None      # decoding for display, filled in by whoever displays the image
+    captured_at: Optional[float] = None
+    capture_id: Optional[int] = None    # ID the imager keeps the capture under (see fetch_capture)
+
+    def on_meta(self, meta: dict) -> None:
+        """Takes the queue and capture times of the META message the imager sends once the capture is done"""
+        if "wait_s" not in meta:
+            return
+
+        self.captured_at = time.monotonic()
+        self.capture_id = meta.get("capture_id")
+        self.queue = meta["wait_s"]
+        self.capture = meta["capture_s"]
+        self.phases = meta.get("phases", {})
+
+    def on_received(self) -> None:
+        """Completes the timing once the image was received"""
+        now = time.monotonic()
+        self.total = now - self.requested_at
+        if self.captured_at is not None:
+            self.receive = now - self.captured_at
+
+    def report(self) -> dict:
+        """Breakdown as a dict of seconds, phases nested, unknown parts left out"""
+        report = {"capture_id": self.capture_id, "total_s": self.total, "queue_s": self.queue, "capture_s": self.capture, "phases": self.phases,
+                  "receive_s": self.receive, "send_s": self.send, "decode_s": self.decode, "preview_s": self.preview}
+        return {name: value for name, value in report.items() if value is not None}
+
+    def __str__(self) -> str:
+        parts = []
+        if self.queue is not None:
+            parts.append(f"queue {self.queue:.2f}s")
+        if self.capture is not None:
+            phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+            parts.append(f"capture {self.capture:.2f}s" + (f" ({phases})" if phases else ""))
+        if self.receive is not None:
+            parts.append(f"receive {self.receive:.2f}s" + (f" (imager send {self.send:.2f}s)" if self.send is not None else ""))
+        if self.decode is not None:
+            parts.append(f"decode {self.decode:.2f}s")
+        preview = f" (preview after {self.preview:.2f}s)" if self.preview is not None else ""
+        return f"capture took {self.total or 0:.2f}s" + (": " + " + ".join(parts) if parts else "") + preview
 
 class ImagerClientConnection:
-    def __init__(self, log: Callable[[str, str], None]) -> None:
+    def __init__(self, log: Callable[[str, str], None], on_reconnect: Optional[Callable[[], None]] = None,
+                 on_timing: Optional[Callable[[CaptureTiming], None]] = None) -> None:
         """
         Constructs client side of connection
 
+        Liveness is tracked in the background (TCP keepalive, plus heartbeats on quiet v2 connections);
+        a lost connection is re-established with backoff to the last address
+
         logger: logger that is being used by frontend (same logfile)
+        on_reconnect: called (from the reconnect thread) after a lost connection was re-established
+        on_timing: called (from the capturing thread) with the latency breakdown of every successful capture
         """
         self.__log = log
+        self.on_reconnect = on_reconnect
+        self.on_timing = on_timing
         self.hostname : Optional[str] = None
+        self.address : Optional[str] = None
+        self.port = PROTOCOL_PORT
         self.connection : Optional[Connection] = None
 
-    def discover(self, hostname: str) -> Optional[str]:
+        self.connected = threading.Event()  # set while connection is believed healthy
+        self.stopped = threading.Event()    # set once the connection is closed on purpose, stops reconnecting
+        self.reconnect_lock = threading.Lock()
+        self.reconnecting = False
+
+        self.version = 1
+        self.capabilities : list[str] = []
+
+        self.request_ids = itertools.count(1)
+        self.pending : dict[int, PendingRequest] = {}
+        self.pending_lock = threading.Lock()
+        self.v1_lock = threading.Lock()     # v1 is lock-step, one request on the wire at a time
+
+        self.preview_stream_id : Optional[int] = None
+        self.range_pool : Optional[RangePool] = None    # extra connections of parallel transfers
+        self.range_budget = MAX_PARALLEL                # further connections the imager accepted when connecting
+
+    def discover(self, hostname: str) -> Optional[tuple[str, int]]:
         """
-        Looks for IP of host using hostname and mDNS
+        Looks for the imager called hostname
+
+        Imagers advertising themselves are answered from the cache of the background service browser,
+        others are resolved with a (possibly slow) hostname lookup. Only names neither cached nor resolvable
+        wait up to DISCOVERY_WAIT for the browser to find them, IP addresses are used as they are
 
-        hostname: string with canonical hostname
+        hostname: instance name or canonical hostname of the imager (raspberrypi.local), or its IP address
+        return: IP and port of the imager
         """
-        
         try:
-            ip = socket.gethostbyname(hostname)
+            ipaddress.ip_address(hostname)
             self.hostname = hostname
-        except:
+            return hostname, PROTOCOL_PORT
+        except ValueError:
+            pass
+
+        browser = get_browser()
+        record = browser.lookup(hostname) if browser is not None else None
+
+        if record is None:
+            try:
+                ip = socket.gethostbyname(hostname)
+                self.hostname = hostname
+                return ip, PROTOCOL_PORT
+            except OSError:
+                record = browser.lookup(hostname, DISCOVERY_WAIT) if browser is not None else None
+
+        if record is None:
             self.__log(ERROR, f"could not find {hostname} on network")
             return
 
-        return ip
-    
-    def connect(self, ip: str) -> Optional[str]:
+        self.hostname = hostname
+        return record.address, record.port
+
+    def __open(self, ip: str, port: int) -> Connection:
+        """Opens a socket to ip at port"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.connect((ip, port))
+        sock.settimeout(120)
+        connection = Connection(sock)
+        connection.tune_for_bulk()
+        connection.enable_keepalive()
+        return connection
+
+    def __negotiate(self, connection: Connection) -> tuple[int, list[str], Optional[int]]:
+        """
+        Sends HELLO with the supported protocol versions
+
+        return: negotiated version, capabilities of the server and the number of further connections it accepts
+                (None if it does not tell)
         """
-        Connects to ip at protocol port, returns ip on success, else None
+        connection.sock.settimeout(HELLO_TIMEOUT)
+        connection.send_fmsg(rtob(RequestType.HELLO) +
+                             encode_json({"versions": PROTOCOL_VERSIONS, "capabilities": V1_CAPABILITIES}))
+        answer = decode_json(connection.recv_fmsg())
+        connection.sock.settimeout(120)
+
+        return answer["version"], answer["capabilities"], answer.get("free_connections")
+
+    def connect(self, ip: str, port: int = PROTOCOL_PORT) -> Optional[str]:
+        """
+        Connects to ip at port, returns ip on success, else None
+
+        Negotiates the protocol version; servers that predate negotiation drop the
+        connection on HELLO, after which a fresh v1 connection is made
 
         ip: string with IPv4 address
+        port: port the imager listens on
         """
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.connect((ip, PROTOCOL_PORT))
-            sock.settimeout(120)
-            self.connection = Connection(sock)
+            connection = self.__open(ip, port)
         except:
-            self.__log(ERROR, f"could not connect to {ip}@{PROTOCOL_PORT}")
+            self.__log(ERROR, f"could not connect to {ip}@{port}")
             return
-        
+
+        try:
+            version, capabilities, free_connections = self.__negotiate(connection)
+        except:
+            connection.close()
+            try:
+                connection = self.__open(ip, port)
+            except:
+                self.__log(ERROR, f"could not connect to {ip}@{port}")
+                return
+            version, capabilities, free_connections = 1, V1_CAPABILITIES, 0
+
+        self.connection = connection
+        self.address = ip
+        self.port = port
+        self.version = version
+        self.capabilities = capabilities
+        self.range_budget = MAX_PARALLEL if free_connections is None else free_connections
+        self.stopped.clear()
+        self.connected.set()
+
+        if self.version >= 2:
+            connection.sock.settimeout(None)
+            threading.Thread(target=self.__reader, args=(connection,), daemon=True).start()
+            threading.Thread(target=self.__heartbeat, args=(connection,), daemon=True).start()
+
         return ip
-    
+
     def __close(self) -> None:
+        self.connected.clear()
+
+        # forget the connection before closing it, so its reader does not take the close for a lost connection
+        connection, self.connection = self.connection, None
+        if connection is not None:
+            connection.close()
+
+        pool, self.range_pool = self.range_pool, None
+        if pool is not None:
+            pool.close()
+
+    def __connection_lost(self, connection: Optional[Connection] = None) -> None:
+        """Closes connection (the current one if None) and starts reconnecting, no-op if it was already replaced"""
+        if connection is not None and connection is not self.connection:
+            return
+
         if self.connection is not None:
-            self.connection.close()
+            self.__log(ERROR, f"lost connection to {self.hostname or self.address}")
+        self.__close()
+        self.__start_reconnect()
+
+    def __start_reconnect(self) -> None:
+        with self.reconnect_lock:
+            if self.reconnecting or self.stopped.is_set() or self.address is None:
+                return
+            self.reconnecting = True
+
+        threading.Thread(target=self.__reconnect, daemon=True).start()
+
+    def __reconnect(self) -> None:
+        """
+        Reconnects to the last address, waiting twice as long after every failed attempt
+
+        If service browsing knows the imager under its hostname, its current address is used
+        """
+        delay = RECONNECT_DELAY
+        try:
+            while not self.stopped.is_set():
+                browser = get_browser()
+                record = browser.lookup(self.hostname) if browser is not None and self.hostname is not None else None
+                if record is not None:
+                    self.address, self.port = record.address, record.port
+
+                if self.connect(self.address, self.port) is not None: # type: ignore
+                    self.__log(INFO, f"reconnected to {self}")
+                    if self.on_reconnect is not None:
+                        self.on_reconnect()
+                    return
+
+                self.stopped.wait(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+        finally:
+            with self.reconnect_lock:
+                self.reconnecting = False
+
+    def __heartbeat(self, connection: Connection) -> None:
+        """
+        Sends CHECK_CONNECTED when a v2 connection has been silent for HEARTBEAT_INTERVAL, until it is replaced
+
+        Bytes still arriving (e.g. a large body the reply queues behind) keep the connection alive,
+        only a heartbeat unanswered for HEARTBEAT_TIMEOUT of silence drops it
+        """
+        while not self.stopped.wait(HEARTBEAT_INTERVAL) and self.connection is connection:
+            if time.monotonic() - connection.last_received < HEARTBEAT_INTERVAL:
+                continue
+
+            try:
+                reply = self.request(RequestType.CHECK_CONNECTED)
+                while True:
+                    try:
+                        reply.result(timeout=HEARTBEAT_TIMEOUT)
+                        break
+                    except ReplyTimeout:
+                        if time.monotonic() - connection.last_received >= HEARTBEAT_TIMEOUT:
+                            raise
+            except:
+                self.__connection_lost(connection)
+                return
+
+    def __live_connection(self) -> Optional[Connection]:
+        """Connection known to be healthy, waits up to RECONNECT_WAIT for a reconnect if there is none"""
+        if self.connection is None:
+            self.__start_reconnect()
+            self.connected.wait(RECONNECT_WAIT)
+
+        connection = self.connection
+        if connection is None:
+            self.__log(ERROR, "No connection available")
+        return connection
+
+    def __reader(self, connection: Connection) -> None:
+        """
+        Receives v2 frames and resolves the matching pending requests
+
+        Runs until the connection drops, then fails every request still waiting
+        (including one whose response was cut off)
+        """
+        pending = None
+        try:
+            while True:
+                kind, code, request_id, size = connection.recv_frame_header()
+
+                with self.pending_lock:
+                    if kind == MessageKind.RESPONSE:
+                        pending = self.pending.pop(request_id, None)
+                    else:
+                        pending = self.pending.get(request_id)
+
+                # chunks only follow the META announcing their transfer, DATA before it (a dual capture's preview) is passed to on_data
+                if kind == MessageKind.DATA and pending is not None and pending.chunks is not None and pending.chunks.transfer_id is not None:
+                    pending.chunks.receive(connection, size)
+                    continue
+
+                if kind == MessageKind.DATA and pending is not None and pending.data_sink is not None:
+                    path = pending.data_sink()
+                    if connection.recv_body_to_file(size, path) != size:
+                        raise SocketReceivedBytesEmpty()
+
+                    if pending.on_data_saved is not None:
+                        try:
+                            pending.on_data_saved(path)
+                        except Exception as e:
+                            self.__log(ERROR, f"handling data for request {request_id} raised {e}")
+                    continue
+
+                if kind == MessageKind.DATA:
+                    body = connection.recvb(size)
+
+                    if body is None:
+                        raise SocketReceivedBytesEmpty()
+
+                    if pending is not None and pending.on_data is not None:
+                        try:
+                            pending.on_data(body)
+                        except Exception as e:
+                            self.__log(ERROR, f"handling data for request {request_id} raised {e}")
+                    continue
+
+                if kind == MessageKind.META:
+                    body = connection.recvb(size)
+
+                    if body is None:
+                        raise SocketReceivedBytesEmpty()
+
+                    if pending is not None:
+                        meta = decode_json(body)
+                        pending.future.meta.update(meta)
+                        if pending.on_meta is not None:
+                            try:
+                                pending.on_meta(meta)
+                            except Exception as e:
+                                self.__log(ERROR, f"handling meta for request {request_id} raised {e}")
+                    continue
+
+                if pending is not None and pending.sink is not None and code == Status.OK.value:
+                    connection.recv_body_to_file(size, pending.sink)
+                    body = bytearray()
+                else:
+                    body = connection.recvb(size)
 
-        self.connection = None
+                    if body is None:
+                        raise SocketReceivedBytesEmpty()
+
+                if pending is not None:
+                    pending.future.set_result(Frame(kind, code, request_id, body))
+        except:
+            with self.pending_lock:
+                pending_requests = [pending for pending in self.pending.values() if pending.connection is connection]
+                for waiting in pending_requests:
+                    self.pending.pop(waiting.future.request_id)
+
+            # a RESPONSE is no longer pending while its body is received
+            if pending is not None and not pending.future.done() and pending not in pending_requests:
+                pending_requests.append(pending)
+
+            for pending in pending_requests:
+                pending.future.set_exception(NoConnectionAvailable())
+
+            self.__connection_lost(connection)
+
+    def __request_v1(self, connection: Connection, request_type: RequestType, sink: Optional[Path]) -> RequestFuture:
+        """Lock-step v1 request, returns an already resolved future"""
+        future = RequestFuture(0)
+        with self.v1_lock:
+            if not connection.send_fmsg(rtob(request_type)):
+                raise NoConnectionAvailable()
+
+            if sink is not None:
+                size = connection.recv_fmsg_to_file(sink)
+                body = bytearray()
+            else:
+                body = connection.recv_fmsg()
+                size = len(body)
+
+        # v1 signals a failed capture with an empty body
+        status = Status.OK
+        if request_type in [RequestType.CAPTURE_MAIN, RequestType.CAPTURE_PREVIEW] and size == 0:
+            status = Status.FAILED
+
+        future.set_result(Frame(MessageKind.RESPONSE, status.value, 0, body))
+        return future
+
+    def request(self, request_type: RequestType, body: bytes = b"", sink: Optional[Path] = None,
+                on_data: Optional[Callable[[bytearray], None]] = None,
+                on_meta: Optional[Callable[[dict], None]] = None,
+                data_sink: Optional[Callable[[], Path]] = None,
+                on_data_saved: Optional[Callable[[Path], None]] = None,
+                chunks: Optional[ChunkedDownload] = None) -> RequestFuture:
+        """
+        Sends a request, returns a future that resolves to the response Frame
+
+        With v2 several requests can be in flight at once, responses are matched by request ID
+
+        request_type: type of request
+        body: request body (v2 only)
+        sink: file to stream the response body into instead of keeping it in memory
+        on_data: called (from the reader thread) with every DATA message for this request (v2 only)
+        on_meta: called (from the reader thread) with every META message for this request (v2 only)
+        data_sink: gives the file to stream each DATA body into instead of passing it to on_data (v2 only)
+        on_data_saved: called (from the reader thread) with the file of every DATA body written by data_sink (v2 only)
+        chunks: receives the DATA bodies of a chunked transfer (v2 only)
+        """
+        connection = self.connection
+
+        if connection is None:
+            raise NoConnectionAvailable()
+
+        if self.version == 1:
+            return self.__request_v1(connection, request_type, sink)
+
+        request_id = next(self.request_ids)
+        pending = PendingRequest(RequestFuture(request_id, connection), sink, on_data, on_meta, data_sink, on_data_saved, chunks, connection)
+
+        with self.pending_lock:
+            self.pending[request_id] = pending
+
+        if not connection.send_frame(MessageKind.REQUEST, request_type, request_id, body):
+            with self.pending_lock:
+                self.pending.pop(request_id, None)
+            raise NoConnectionAvailable()
+
+        return pending.future
+
+    def wait_reply(self, future: RequestFuture, timeout: Optional[float] = None) -> Frame:
+        """
+        Waits for the response to a request for as long as its connection is alive
+
+        A capture may queue behind others and its image may take minutes to arrive, so the wait is not
+        limited as a whole: ReplyTimeout is raised once the connection has been silent for timeout (the
+        heartbeat keeps a healthy one talking). Only the request is given up, the connection is kept
+
+        timeout: seconds of silence, REPLY_TIMEOUT if None
+        return: the response Frame
+        """
+        timeout = REPLY_TIMEOUT if timeout is None else timeout
+        started = time.monotonic()
+        while True:
+            try:
+                return future.result(timeout=min(timeout, HEARTBEAT_INTERVAL))
+            except ReplyTimeout:
+                last_received = started
+                if future.connection is not None:
+                    last_received = max(last_received, future.connection.last_received)
+                if time.monotonic() - last_received >= timeout:
+                    with self.pending_lock:
+                        self.pending.pop(future.request_id, None)
+                    raise
+
+    def supports(self, request_type: RequestType) -> bool:
+        """True if the connected server handles request_type"""
+        return request_type.name in self.capabilities
 
     def check_connection(self) -> Optional[Connection]:
         """
@@ -65,52 +754,562 @@ class ImagerClientConnection:
         if self.connection is None:
             self.__log(ERROR, "No connection available")
             return
-        
+
         try:
-            self.connection.send_fmsg(rtob(RequestType.CHECK_CONNECTED))
-            msg = self.connection.recv_fmsg()
+            self.wait_reply(self.request(RequestType.CHECK_CONNECTED))
         except:
             self.__log(ERROR, "No connection available")
-            self.__close()
+            self.__connection_lost()
             return
-        
+
         return self.connection
-    
-    def capture(self, preview = True) -> Optional[Image.Image]:
-        """Sends capture request, preview = True captures preview, False captures main"""
-        connection = self.check_connection()
+
+    def __on_capture_meta(self, meta: dict, timing: CaptureTiming) -> None:
+        """Logs queueing information the imager sends about a capture, notes its timing"""
+        if meta.get("queue_position", 0) > 0 and "wait_s" not in meta:
+            self.__log(INFO, f"capture queued behind {meta['queue_position']} other capture(s)")
+
+        timing.on_meta(meta)
+
+    def __image_request(self, request_type: RequestType, sink: Optional[Path] = None, params: Optional[dict] = None,
+                        stream: bool = False, parallel: int = 1,
+                        on_preview: Optional[Callable[[bytes], None]] = None) -> Optional[Frame]:
+        """
+        Sends a request answered with an image (capture or fetch) and waits for the image
+
+        If the connection is lost after the imager announced the capture's ID, the capture is
+        fetched again from the imager's recent captures instead of being lost
+
+        sink: file to stream the image into, kept in memory if None
+        params: request body, e.g. {"roi", "size", "quality"} for captures (v2 only, ignored by v1 imagers)
+        stream: receive the image while the imager encodes it instead of resumably (v2 only, see __streamed_capture)
+        parallel: fetch the image over this many connections at once if above 1 (captures into a sink only,
+                  see __parallel_capture)
+        on_preview: called (from the reader thread) with the preview a dual capture sends ahead of the image (not in stream mode)
+        return: response on success, else None
+        """
+        connection = self.__live_connection()
 
         if connection is None:
             return
 
-        connection.send_fmsg(rtob(RequestType.CAPTURE_PREVIEW if preview else RequestType.CAPTURE_MAIN))
-        
+        if params and self.version < 2:
+            self.__log(INFO, "imager cannot crop or resize, capturing the full frame")
+
+        # extra connections count against the imager's client limit
+        parallel = min(parallel, MAX_PARALLEL, self.range_budget)
+
+        is_capture = request_type in [RequestType.CAPTURE_PREVIEW, RequestType.CAPTURE_MAIN]
+        timing = CaptureTiming(time.monotonic())
+
+        on_data = None
+        if on_preview is not None:
+            def on_data(data: bytearray) -> None:
+                timing.preview = time.monotonic() - timing.requested_at
+                on_preview(bytes(data))
+
         try:
-            preview_bytes = connection.recv_fmsg()
+            if stream and self.version >= 2:
+                response = self.__streamed_capture(request_type, sink, params, timing)
+            elif parallel > 1 and sink is not None and is_capture and self.supports(RequestType.FETCH_RANGE):
+                response = self.__parallel_capture(request_type, sink, params, timing, parallel, on_data)
+            elif sink is not None and self.supports(RequestType.RESUME_TRANSFER):
+                response = self.__chunked_capture(request_type, sink, params, timing, on_data)
+            else:
+                future = self.request(request_type, encode_json(params) if params else b"", sink=sink, on_data=on_data,
+                                      on_meta=lambda meta: self.__on_capture_meta(meta, timing))
+                response = self.wait_reply(future)
+                timing.on_received()
 
-            if preview_bytes == b"":
+            if response.status != Status.OK:
+                if sink is not None:
+                    sink.unlink(missing_ok=True)
                 raise CaptureFailed()
 
-            preview_image = Image.open(io.BytesIO(preview_bytes))
-
         except CaptureFailed as e:
-            self.__log(ERROR, "Capture failed")
+            self.__log(ERROR, "Capture failed" if is_capture else f"{request_type.name} failed")
+            return
+        except ReplyTimeout:
+            # the connection went silent, the heartbeat decides whether it is lost
+            self.__log(ERROR, f"no reply to {request_type.name}")
+            if sink is not None:
+                sink.unlink(missing_ok=True)
             return
+        except (OSError, SocketReceivedBytesEmpty, NoConnectionAvailable):
+            self.__log(ERROR, "No connection available")
+            self.__connection_lost(connection)
+
+            if not is_capture or timing.capture_id is None or not self.supports(RequestType.FETCH_CAPTURE):
+                return
+
+            self.__log(INFO, f"fetching capture {timing.capture_id} again from the imager")
+            return self.__image_request(RequestType.FETCH_CAPTURE, sink, {"capture_id": timing.capture_id})
+
+        if is_capture:
+            self.__log(INFO, str(timing))
+            if self.on_timing is not None:
+                self.on_timing(timing)
+
+        return response
+
+    def __chunked_capture(self, request_type: RequestType, sink: Path, params: Optional[dict], timing: CaptureTiming,
+                          on_data: Optional[Callable[[bytearray], None]] = None) -> Frame:
+        """
+        Captures (or fetches) in chunked mode, resuming the transfer (reconnecting if needed) when it is interrupted
+
+        The imager keeps the image until it is acknowledged, so only the missing part is sent again
+
+        timing: completed with the imager's timing and the receive time
+        on_data: receives DATA sent ahead of the transfer (the preview of a dual capture)
+        return: the final response
+        """
+        connection = self.connection
+        download = ChunkedDownload(sink)
+        on_meta = lambda meta: (self.__on_capture_meta(meta, timing), download.on_meta(meta))
+
+        future = self.request(request_type, encode_json({**(params or {}), "chunked": True}),
+                              on_data=on_data, on_meta=on_meta, chunks=download)
+        attempts = 0
+        try:
+            while True:
+                try:
+                    response = self.wait_reply(future)
+
+                    if response.status != Status.OK or download.is_complete():
+                        break
+                    self.__log(ERROR, f"transfer {download.transfer_id} failed its checksum at {download.received}/{download.size} bytes")
+                except (OSError, SocketReceivedBytesEmpty, NoConnectionAvailable):
+                    if download.transfer_id is None:    # nothing to resume on the imager
+                        raise
+                    self.__log(ERROR, f"transfer {download.transfer_id} interrupted at {download.received}/{download.size} bytes")
+                    self.__connection_lost(connection)
+
+                if download.transfer_id is None or attempts >= MAX_RESUME_ATTEMPTS:
+                    raise NoConnectionAvailable()
+                attempts += 1
+
+                connection = self.__live_connection()
+                if connection is None:
+                    continue
+
+                self.__log(INFO, f"resuming transfer {download.transfer_id} at {download.received}/{download.size} bytes")
+                future = self.request(RequestType.RESUME_TRANSFER,
+                                      encode_json({"transfer_id": download.transfer_id, "offset": download.received}),
+                                      on_meta=download.on_meta, chunks=download)
+        finally:
+            download.close(keep=download.is_complete())
+
+        if download.is_complete():
+            timing.on_received()
+            timing.send = decode_json(response.body).get("send_s")
+            try:
+                self.wait_reply(self.request(RequestType.ACK_TRANSFER, encode_json({"transfer_id": download.transfer_id})))
+            except:
+                self.__log(ERROR, f"could not acknowledge transfer {download.transfer_id}")
+
+        return response
+
+    def __open_range_connection(self) -> Connection:
+        """Opens an extra v2 connection to the imager for range requests"""
+        if self.address is None:
+            raise NoConnectionAvailable()
+
+        connection = self.__open(self.address, self.port)
+        try:
+            if self.__negotiate(connection)[0] < 2:
+                raise NoConnectionAvailable()
+        except:
+            connection.close()
+            raise
+        return connection
+
+    def __fetch_range(self, pool: RangePool, download: ParallelDownload, transfer_id: int, offset: int, length: int) -> bool:
+        """Fetches one range over a pool connection, retrying on a fresh connection if it fails, returns success"""
+        for _ in range(MAX_RESUME_ATTEMPTS):
+            try:
+                connection = pool.acquire()
+            except:
+                continue
+
+            healthy = False
+            try:
+                request_id = next(self.request_ids)
+                body = encode_json({"transfer_id": transfer_id, "offset": offset, "length": length})
+                if connection.send_frame(MessageKind.REQUEST, RequestType.FETCH_RANGE, request_id, body):
+                    healthy = download.receive_range(connection, request_id, offset, length)
+            except:
+                healthy = False
+            finally:
+                pool.release(connection, healthy)
+
+            if healthy:
+                return True
+        return False
+
+    def __parallel_capture(self, request_type: RequestType, sink: Path, params: Optional[dict], timing: CaptureTiming,
+                           parallel: int, on_data: Optional[Callable[[bytearray], None]] = None) -> Frame:
+        """
+        Captures in parallel mode: the imager keeps the image and announces its size, the image is then fetched
+        as byte ranges over parallel connections from a small pool and written in place into a preallocated file
+
+        Fills a link a single connection cannot, e.g. when per-connection throughput is the bottleneck
+
+        timing: completed with the imager's timing and the receive time
+        on_data: receives DATA sent ahead of the announcement (the preview of a dual capture)
+        return: the final response
+        """
+        future = self.request(request_type, encode_json({**(params or {}), "parallel": True}), on_data=on_data,
+                              on_meta=lambda meta: self.__on_capture_meta(meta, timing))
+        response = self.wait_reply(future)
+        if response.status != Status.OK:
+            return response
+
+        announced = decode_json(response.body)
+        transfer_id = announced["transfer_id"]
+        pool = self.range_pool
+        if pool is None or pool.size != parallel:
+            if pool is not None:
+                pool.close()
+            pool = self.range_pool = RangePool(self.__open_range_connection, parallel)
+
+        started = time.monotonic()
+        download = ParallelDownload(sink, announced["size"])
+        results, complete = [], False
+        try:
+            results = pool.map(lambda span: self.__fetch_range(pool, download, transfer_id, *span), download.ranges(parallel))
+            complete = all(results)
+        finally:
+            download.close(keep=complete)
+
+        # acknowledged either way, a failed transfer is not fetched again
+        try:
+            self.wait_reply(self.request(RequestType.ACK_TRANSFER, encode_json({"transfer_id": transfer_id})))
+        except:
+            self.__log(ERROR, f"could not acknowledge transfer {transfer_id}")
+
+        if not complete:
+            self.__log(ERROR, f"parallel transfer {transfer_id} failed, {results.count(False)} range(s) missing")
+            raise CaptureFailed()
+
+        timing.on_received()
+        timing.send = time.monotonic() - started
+        return response
+
+    def __streamed_capture(self, request_type: RequestType, sink: Optional[Path], params: Optional[dict], timing: CaptureTiming) -> Frame:
+        """
+        Captures in stream mode, the image arrives while the imager is still encoding it and is never written to
+        a file there. Nothing can be resumed or fetched again, a lost connection loses the capture
+
+        Imagers that do not stream send the image as the RESPONSE body, which is taken as well
+
+        timing: completed with the imager's timing and the receive time
+        return: the final response, its body the image if sink is None
+        """
+        download = StreamedDownload(sink)
+        on_meta = lambda meta: (self.__on_capture_meta(meta, timing), download.on_meta(meta))
+
+        future = self.request(request_type, encode_json({**(params or {}), "stream": True}),
+                              on_data=download.on_data, on_meta=on_meta)
+        complete = False
+        try:
+            response = self.wait_reply(future)
+
+            if response.status == Status.OK and response.body:  # the imager sent the image in one piece
+                download.on_data(response.body)
+                download.size = download.received
+
+            complete = response.status == Status.OK and download.is_complete()
+        finally:
+            download.close(keep=complete)
+
+        if response.status == Status.OK and not complete:
+            self.__log(ERROR, f"streamed capture ended at {download.received}/{download.size} bytes")
+            raise CaptureFailed()
+
+        timing.on_received()
+        timing.send = future.meta.get("send_s")
+        return Frame(response.kind, response.code, response.request_id, download.buffer)
+
+    def capture(self, preview = True, stream = True) -> Optional[bytes]:
+        """
+        Sends capture request, preview = True captures preview, False captures main
+
+        stream: receive the image while the imager is still encoding it (see __streamed_capture)
+        return: the encoded image exactly as received (not decoded), None on failure
+        """
+        response = self.__image_request(RequestType.CAPTURE_PREVIEW if preview else RequestType.CAPTURE_MAIN, stream=stream)
+
+        if response is None:
+            return
+
+        return bytes(response.body)
+
+    def capture_to_file(self, filepath: Path, preview = False, options: Optional[dict] = None, stream = False,
+                        parallel: int = 1, on_preview: Optional[Callable[[bytes], None]] = None) -> Optional[Path]:
+        """
+        Sends capture request and streams the received image straight into filepath
+
+        The bytes are written verbatim (no decode and re-encode) and filepath only appears once complete
+
+        preview: True captures preview, False captures main
+        options: {"roi": [left, top, right, bottom], "size": [width, height], "quality": int,
+                 "gray": bool (luma only, lossless PNG unless a quality is given),
+                 "preview": [width, height] (box the preview asked for with on_preview fits within)}, all optional
+        stream: receive the image while the imager is still encoding it, instead of as a resumable transfer
+                of the finished file (see __streamed_capture)
+        parallel: fetch the finished file over this many connections at once (at most MAX_PARALLEL and the connections
+                  the imager has left, see __parallel_capture), ignored if stream is set or the imager cannot send ranges
+        on_preview: makes a main capture dual: called (from the reader thread) with a small JPEG of the same exposure,
+                    which the imager sends before the image itself (never called by older imagers); stream is ignored then
+        return: filepath on success, else None
+        """
+        request_type = RequestType.CAPTURE_PREVIEW if preview else RequestType.CAPTURE_MAIN
+        if on_preview is not None and not preview:
+            options = {"preview": True, **(options or {})}
+            stream = False
+        if self.__image_request(request_type, sink=filepath, params=options, stream=stream, parallel=parallel,
+                                on_preview=on_preview) is None:
+            return
+
+        return filepath
+
+    def list_captures(self) -> Optional[list[dict]]:
+        """
+        Lists the recent captures the imager keeps for fetching again
+
+        return: [{"capture_id", "type", "size", "captured_at"}] oldest first, None if the imager cannot tell
+        """
+        if self.__live_connection() is None or not self.supports(RequestType.LIST_CAPTURES):
+            return
+
+        try:
+            response = self.wait_reply(self.request(RequestType.LIST_CAPTURES))
         except:
             self.__log(ERROR, "No connection available")
-            self.__close()
             return
 
-        return preview_image
-    
+        return decode_json(response.body).get("captures", [])
+
+    def fetch_capture(self, capture_id: int, filepath: Path, size: Optional[tuple[int, int]] = None,
+                      quality: Optional[int] = None) -> Optional[Path]:
+        """
+        Fetches a recent capture from the imager again into filepath, without taking a new image
+
+        size: fetch a downscaled variant fitting within (width, height) instead of the full image
+        quality: JPEG quality of the downscaled variant
+        return: filepath on success, else None
+        """
+        if self.__live_connection() is None or not self.supports(RequestType.FETCH_CAPTURE):
+            self.__log(ERROR, "imager cannot fetch captures again")
+            return
+
+        params = {"capture_id": capture_id, "size": size, "quality": quality}
+        if self.__image_request(RequestType.FETCH_CAPTURE, sink=filepath,
+                                params={name: value for name, value in params.items() if value is not None}) is None:
+            return
+
+        return filepath
+
+    def calibrate(self) -> Optional[dict]:
+        """
+        Focuses and meters once on the imager, later captures reuse that focus, exposure and white balance
+
+        return: {"lens_position", "exposure_time", "analogue_gain", "colour_gains"} and the timing of the calibration,
+                None on failure or if the imager cannot calibrate
+        """
+        if self.__live_connection() is None or not self.supports(RequestType.CALIBRATE):
+            self.__log(ERROR, "imager cannot calibrate")
+            return
+
+        try:
+            response = self.wait_reply(self.request(RequestType.CALIBRATE))
+        except:
+            self.__log(ERROR, "No connection available")
+            return
+
+        if response.status != Status.OK:
+            self.__log(ERROR, "calibration failed")
+            return
+
+        return decode_json(response.body)
+
+    def invalidate_calibration(self) -> bool:
+        """
+        Drops the calibration of the imager, captures focus and meter on their own again
+
+        return: True on success
+        """
+        if self.__live_connection() is None or not self.supports(RequestType.INVALIDATE_CALIBRATION):
+            return False
+
+        try:
+            response = self.wait_reply(self.request(RequestType.INVALIDATE_CALIBRATION))
+        except:
+            self.__log(ERROR, "No connection available")
+            return False
+
+        return response.status == Status.OK
+
+    def list_spool(self) -> Optional[dict]:
+        """
+        Gets the manifest of the captures spooled on the imager
+
+        return: {"count", "bytes", "max_bytes", "policy", "captures": [{"spool_id", "name", "size", "sha256",
+                "captured_at", "series_id", "index"}] oldest first}, None if the imager has no spool
+        """
+        if self.__live_connection() is None or not self.supports(RequestType.LIST_SPOOL):
+            return
+
+        try:
+            response = self.wait_reply(self.request(RequestType.LIST_SPOOL))
+        except:
+            self.__log(ERROR, "No connection available")
+            return
+
+        if response.status != Status.OK:
+            return
+
+        return decode_json(response.body)
+
+    def fetch_spooled(self, spool_id: int, filepath: Path) -> Optional[Path]:
+        """
+        Fetches a spooled capture into filepath (resuming if interrupted), it stays spooled until ack_spooled
+
+        Safe to call from several threads at once, the fetches share the connection
+
+        return: filepath on success, else None
+        """
+        if self.__live_connection() is None or not self.supports(RequestType.FETCH_SPOOLED):
+            return
+
+        if self.__image_request(RequestType.FETCH_SPOOLED, sink=filepath, params={"spool_id": spool_id}) is None:
+            return
+
+        return filepath
+
+    def ack_spooled(self, spool_ids: list[int]) -> Optional[list[int]]:
+        """
+        Lets the imager delete spooled captures that are stored on this side
+
+        return: the IDs the imager deleted, None on failure
+        """
+        if self.__live_connection() is None or not self.supports(RequestType.ACK_SPOOLED):
+            return
+
+        try:
+            response = self.wait_reply(self.request(RequestType.ACK_SPOOLED, encode_json({"spool_ids": spool_ids})))
+        except:
+            self.__log(ERROR, "No connection available")
+            return
+
+        return decode_json(response.body).get("acked", [])
+
+    def start_preview_stream(self, on_frame: Callable[[bytearray], None], fps: float = 5) -> Optional[RequestFuture]:
+        """
+        Starts a live preview stream, on_frame is called with every JPEG frame (from the reader thread)
+
+        fps: maximum rate at which the server sends frames
+        return: future that resolves when the stream ends, None if streaming is unavailable
+        """
+        if self.connection is None:
+            self.__log(ERROR, "No connection available")
+            return
+
+        if self.version < 2 or not self.supports(RequestType.START_PREVIEW_STREAM):
+            self.__log(ERROR, "imager does not support live preview")
+            return
+
+        try:
+            future = self.request(RequestType.START_PREVIEW_STREAM, encode_json({"fps": fps}), on_data=on_frame)
+        except:
+            self.__log(ERROR, "No connection available")
+            self.__connection_lost()
+            return
+
+        self.preview_stream_id = future.request_id
+        return future
+
+    def stop_preview_stream(self) -> None:
+        """Stops the live preview stream if one is running"""
+        stream_id = self.preview_stream_id
+        self.preview_stream_id = None
+
+        if stream_id is None or self.connection is None:
+            return
+
+        try:
+            self.wait_reply(self.request(RequestType.STOP_PREVIEW_STREAM, encode_json({"stream_id": stream_id})))
+        except ReplyTimeout:
+            self.__log(ERROR, "no reply to STOP_PREVIEW_STREAM")
+        except:
+            self.__log(ERROR, "No connection available")
+            self.__connection_lost()
+
+    def capture_series(self, download: SeriesDownload, interval: float = 0, count: int = 0,
+                       preview: bool = False, options: Optional[dict] = None) -> Optional[RequestFuture]:
+        """
+        Starts a time-lapse series on the imager, or re-attaches to download.series_id if it is set
+
+        Frames are written into download.directory as they arrive; the imager keeps frames until
+        they are acknowledged once saved, so a series survives the client disconnecting. Frames the
+        imager spooled are acknowledged there, so they are not pulled again by sync_spool
+
+        interval: seconds between captures
+        count: number of captures
+        preview: True captures previews, False captures mains
+        options: crop, size and JPEG quality to apply on the imager (see capture_to_file)
+        return: future that resolves once every frame was delivered, None if series are unavailable
+        """
+        if self.connection is None:
+            self.__log(ERROR, "No connection available")
+            return
+
+        if self.version < 2 or not self.supports(RequestType.CAPTURE_SERIES):
+            self.__log(ERROR, "imager does not support capture series")
+            return
+
+        if download.series_id is not None:
+            params = {"series_id": download.series_id}
+        else:
+            params = {"interval": interval, "count": count, "resolution": "preview" if preview else "main", **(options or {})}
+
+        try:
+            return self.request(RequestType.CAPTURE_SERIES, encode_json(params), on_meta=download.on_meta,
+                                data_sink=download.next_path, on_data_saved=lambda path: self.__series_frame_saved(download, path))
+        except:
+            self.__log(ERROR, "No connection available")
+            self.__connection_lost()
+            return
+
+    def __series_frame_saved(self, download: SeriesDownload, path: Path) -> None:
+        """Passes a saved series frame on and acknowledges it (reader thread, so without waiting)"""
+        download.on_frame_saved(path)
+
+        try:
+            if download.spool_id is not None:
+                self.request(RequestType.ACK_SPOOLED, encode_json({"spool_ids": [download.spool_id]}))
+            elif self.supports(RequestType.ACK_SERIES):
+                self.request(RequestType.ACK_SERIES, encode_json({"series_id": download.series_id, "indices": [download.index]}))
+        except NoConnectionAvailable:
+            pass    # still held by the imager, sent again on re-attach or found already stored by sync_spool
+
+    def close(self) -> None:
+        """Closes the connection on purpose, it is not re-established"""
+        self.stopped.set()
+        self.__close()
+
     def power_off(self) -> None:
         """Tries to send power off signal (may fail), and terminates connection"""
-        
+
         try:
             connection = self.check_connection()
             if not connection is None:
-                connection.send_fmsg(rtob(RequestType.POWER_OFF))
+                if self.version == 1:
+                    connection.send_fmsg(rtob(RequestType.POWER_OFF))
+                else:
+                    connection.send_frame(MessageKind.REQUEST, RequestType.POWER_OFF, next(self.request_ids))
         finally:
+            self.stopped.set()
             self.__close()
 
     def __str__(self) -> str:
@@ -118,6 +1317,6 @@ class ImagerClientConnection:
         if self.hostname is None or self.connection is None:
             return "<NotConnected>"
 
-        sockname = self.connection.sock.getpeername()        
+        sockname = self.connection.sock.getpeername()
 
-        return f"{self.hostname}@{sockname[0]}:{sockname[1]}"
\ No newline at end of file
+        return f"{self.hostname}@{sockname[0]}:{sockname[1]}"
@@ -0,0 +1,185 @@
+import time
+import datetime
+import threading
+
+from typing import Optional, Callable, Iterable
+from pathlib import Path
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+
+from src.logs import INFO, ERROR
+from src.Client.imagerClient import ImagerClient
+from src.Client.imagerBrowser import get_browser
+
+MAX_FLEET_WORKERS = 16  # devices talked to at once
+
+@dataclass
+class FleetDevice:
+    name: str                           # host[:port] as entered, also names the device's subfolder
+    hostname: str
+    port: Optional[int]                 # None uses the advertised port
+    client: ImagerClient
+    latency: Optional[float] = None     # seconds the last capture took from request to saved file
+    state: str = "disconnected"         # what the fleet last did with the device, see status
+
+    @property
+    def status(self) -> str:
+        """state, except that a series is over once the client has downloaded all of it"""
+        if self.state == "series" and not self.client.is_series_running():
+            return "connected"
+        return self.state
+
+    def folder(self, directory: Path) -> Path:
+        """Subfolder of directory holding the images of this device"""
+        return directory / self.name.replace(":", "_")
+
+def parse_device(address: str) -> tuple[str, Optional[int]]:
+    """Splits "host[:port]" into hostname and port (None if not given)"""
+    hostname, _, port = address.strip().partition(":")
+    return hostname, int(port) if port else None
+
+class ImagerFleet:
+    def __init__(self, log: Callable[[str, str], None]) -> None:
+        """
+        Keeps connections to several imagers and sends them requests in parallel
+
+        log: log function of the frontend, messages are prefixed with the device name
+        """
+        self.__log = log
+        self.devices : dict[str, FleetDevice] = {}
+        self.devices_lock = threading.Lock()
+        self.adding : dict[str, threading.Event] = {}   # devices being discovered, set once they are added or given up
+        self.executor = ThreadPoolExecutor(max_workers=MAX_FLEET_WORKERS)
+
+    def __device_log(self, name: str) -> Callable[[str, str], None]:
+        return lambda type, msg: self.__log(type, f"[{name}] {msg}")
+
+    def add(self, address: str) -> Optional[FleetDevice]:
+        """
+        Discovers and connects to the imager at address ("host[:port]")
+
+        return: the device, None if it could not be reached
+        """
+        try:
+            hostname, port = parse_device(address)
+        except ValueError:
+            self.__log(ERROR, f"invalid device address {address}")
+            return
+
+        name = hostname if port is None else f"{hostname}:{port}"
+        with self.devices_lock:
+            if name in self.devices:
+                return self.devices[name]
+            adding = self.adding.get(name)
+            if adding is None:
+                adding = self.adding[name] = threading.Event()
+                discovering = True
+            else:
+                discovering = False
+
+        if not discovering:     # another thread is adding the same device, one client per device
+            adding.wait()
+            with self.devices_lock:
+                return self.devices.get(name)
+
+        try:
+            device = FleetDevice(name, hostname, port, ImagerClient(self.__device_log(name)))
+            if device.client.discover(hostname, port) is None:
+                return
+
+            device.state = "connected"
+            with self.devices_lock:
+                self.devices[name] = device
+            return device
+        finally:
+            with self.devices_lock:
+                self.adding.pop(name, None)
+            adding.set()
+
+    def known_imagers(self) -> list[str]:
+        """Names of the imagers found by service browsing that are not in the fleet yet"""
+        browser = get_browser()
+        if browser is None:
+            return []
+
+        with self.devices_lock:
+            return [record.name for record in browser.imagers() if record.name not in self.devices]
+
+    def remove(self, name: str) -> None:
+        """Forgets a device (its connection is closed, the imager keeps running)"""
+        with self.devices_lock:
+            device = self.devices.pop(name, None)
+
+        if device is not None:
+            device.client.close()
+
+    def select(self, names: Optional[Iterable[str]] = None) -> list[FleetDevice]:
+        """Devices with given names, all devices if None"""
+        with self.devices_lock:
+            if names is None:
+                return list(self.devices.values())
+            return [self.devices[name] for name in names if name in self.devices]
+
+    def capture(self, directory: Path, names: Optional[Iterable[str]] = None, preview: bool = False,
+                options: Optional[dict] = None) -> dict[str, Optional[Path]]:
+        """
+        Captures on every selected device at once, images go to per-device subfolders of directory
+
+        names: devices to capture on, all if None
+        preview: True captures previews, False captures mains
+        options: crop, size and JPEG quality to apply on the imagers
+        return: path of the saved image per device name, None where the capture failed
+        """
+        now = datetime.datetime.now()
+        stamp = f"{now:%Y%m%d-%H%M%S}-{now.microsecond // 1000:03d}"   # milliseconds, captures follow each other within a second
+        devices = self.select(names)
+
+        futures = {device.name: self.executor.submit(self.__capture, device, directory, stamp, preview, options)
+                   for device in devices}
+        return {name: future.result() for name, future in futures.items()}
+
+    def __capture(self, device: FleetDevice, directory: Path, stamp: str, preview: bool, options: Optional[dict]) -> Optional[Path]:
+        folder = device.folder(directory)
+        folder.mkdir(parents=True, exist_ok=True)
+        filepath = folder / f"{stamp}_{'preview' if preview else 'main'}.jpg"
+
+        device.state = "capturing"
+        started = time.monotonic()
+        path = device.client.capture_to_file(filepath, preview, options)
+
+        if path is None:
+            device.state = "failed"
+            return
+
+        device.latency = time.monotonic() - started
+        device.state = "connected"
+        self.__log(INFO, f"[{device.name}] saved {filepath.name} in {device.latency:.2f}s")
+        return path
+
+    def capture_series(self, directory: Path, interval: float, count: int, preview: bool,
+                       on_saved: Callable[[Path], None], names: Optional[Iterable[str]] = None,
+                       options: Optional[dict] = None) -> dict[str, bool]:
+        """
+        Starts a time-lapse series on every selected device, frames go to per-device subfolders of directory
+
+        on_saved: called (from connection reader threads) with the path of every saved frame
+        return: whether the series started, per device name
+        """
+        started = {}
+        for device in self.select(names):
+            folder = device.folder(directory)
+            folder.mkdir(parents=True, exist_ok=True)
+            started[device.name] = device.client.capture_series(folder, interval, count, preview, on_saved, options)
+            if started[device.name]:
+                device.state = "series"
+        return started
+
+    def power_off(self, names: Optional[Iterable[str]] = None) -> None:
+        """Powers off the selected devices and forgets them"""
+        devices = self.select(names)
+        for future in [self.executor.submit(device.client.power_off) for device in devices]:
+            future.result()
+
+        with self.devices_lock:
+            for device in devices:
+                self.devices.pop(device.name, None)
@@ -14,10 +14,17 @@ from typing import Any
 
 MIN_AREA_LABEL = 1000  # minimum area of a colony to be labelled
 
+DISH_ROI = (2312, 1000, 6000, 4625)     # hardcoded position of petri dish in a full frame when stencil is used
+DISH_SIZE = (DISH_ROI[2] - DISH_ROI[0], DISH_ROI[3] - DISH_ROI[1])
+
 def simple_preprocess(arr: np.ndarray):
     """Faster processing functions"""
     
     gray = cv2.cvtColor(arr, cv2.COLOR_BGR2GRAY)
+    return preprocess_gray(gray)
+
+def preprocess_gray(gray: np.ndarray):
+    """simple_preprocess for a single channel image, e.g. a gray capture, which needs no colour conversion"""
     #eq = cv2.equalizeHist(gray)
     clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
     cl1 = clahe.apply(gray)
@@ -65,9 +72,13 @@ def get_selected_properties(region_props) -> pd.DataFrame:
 def process1(path: Path) -> tuple[pd.DataFrame, dict[str, Any]]:
     """
     Process a single image; returns properties and labeled image
+
+    Gray captures (8-bit single channel, see CaptureOptions.gray) go straight to preprocess_gray,
+    "original" is then a 2D array
     """
     with Image.open(path) as image:
-        image = image.crop((2312, 1000, 6000, 4625)) # hardcoded position of petri dish when stencil is used
+        if image.size != DISH_SIZE:     # captures cropped to DISH_ROI on the imager already show only the dish
+            image = image.crop(DISH_ROI)
         width, height = image.size
 
         if width > 4000:
@@ -82,7 +93,10 @@ def process1(path: Path) -> tuple[pd.DataFrame, dict[str, Any]]:
 
         image = image.resize((width, height), Image.Resampling.LANCZOS)
         image_array = np.array(image)
-        processed = simple_preprocess(image_array)
+        if image.mode == "L":
+            processed = preprocess_gray(image_array)
+        else:
+            processed = simple_preprocess(image_array)
         region_props, colony_labels = label_colonies(processed)
         properties = get_selected_properties(region_props)
         properties["dish"] = path.stem
@@ -110,7 +124,7 @@ def label2rgboverlay(labels: np.ndarray, image: np.ndarray) -> np.ndarray:
 
     colors = [color_dict[c] for c in DEFAULT_COLORS]
 
-    grayscale_image = rgb2gray(image)
+    grayscale_image = image / 255 if image.ndim == 2 else rgb2gray(image)
     grayscale_image = np.stack([grayscale_image,grayscale_image,grayscale_image], axis=-1)
 
     dense_labels, inverse_label_matrix = np.unique(labels, return_inverse=True)
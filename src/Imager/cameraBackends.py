@@ -0,0 +1,795 @@
+import io
+import json
+import time
+import queue
+import subprocess
+
+from typing import Optional, Iterator, Callable, Sequence, Union, BinaryIO
+from pathlib import Path
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+
+from src.exceptions import CaptureFailed
+from src.Imager.previewStream import FrameSource, MjpegFrameSource, FakeFrameSource, READ_SIZE
+
+BACKEND_NAMES = ["auto", "picamera2", "rpicam", "fake"]
+
+CONTROL_DELAY_FRAMES = 3      # frames before controls set on a running camera take effect
+METERING_FRAMES = 30          # frames AE/AWB get to settle while calibrating
+
+GRAY_PNG_LEVEL = 1  # zlib level of gray captures, higher levels barely shrink sensor noise but take several times longer
+
+DUAL_PREVIEW_SIZE = (1014, 760)     # box the preview of a dual capture fits within unless asked otherwise
+DUAL_PREVIEW_QUALITY = 80
+EXIF_THUMBNAIL_SIZE = (640, 480)    # largest preview rpicam-still embeds as EXIF thumbnail, it has to fit one 64 KiB segment
+
+@dataclass(frozen=True)
+class CaptureOptions:
+    roi: Optional[tuple[int, int, int, int]] = None     # (left, top, right, bottom) in pixels of the uncropped frame
+    size: Optional[tuple[int, int]] = None              # (width, height) of the output image
+    quality: Optional[int] = None                       # JPEG quality, 1-100
+    gray: bool = False                                  # luma only, lossless 8-bit PNG (gray JPEG if quality is given)
+    preview: Optional[tuple[int, int]] = None           # also make a JPEG fitting within (width, height) from the same exposure
+
+    @staticmethod
+    def from_params(params: dict, frame: Optional["CaptureSettings"] = None) -> Optional["CaptureOptions"]:
+        """
+        Reads the optional "roi", "size", "quality", "gray" and "preview" parameters of a capture request, raises ValueError if invalid
+
+        "preview" is true for a preview of DUAL_PREVIEW_SIZE, or the [width, height] it has to fit within
+        frame: settings of the uncropped frame the roi has to lie within, not checked if None
+        return: options, None if the request has none
+        """
+        roi = params.get("roi")
+        size = params.get("size")
+        quality = params.get("quality")
+        gray = params.get("gray", False)
+        preview = params.get("preview")
+
+        if not isinstance(gray, bool):
+            raise ValueError(f"invalid gray {gray!r}")
+
+        if roi is None and size is None and quality is None and not gray and not preview:
+            return None
+
+        if roi is not None:
+            roi = tuple(int(v) for v in roi)
+            if len(roi) != 4 or roi[0] < 0 or roi[1] < 0 or roi[2] <= roi[0] or roi[3] <= roi[1]:
+                raise ValueError(f"invalid roi {roi}")
+            if frame is not None and (roi[2] > frame.width or roi[3] > frame.height):
+                raise ValueError(f"roi {roi} outside the {frame.width}x{frame.height} frame")
+
+        if size is not None:
+            size = tuple(int(v) for v in size)
+            if len(size) != 2 or size[0] <= 0 or size[1] <= 0:
+                raise ValueError(f"invalid size {size}")
+
+        if quality is not None:
+            quality = int(quality)
+            if not 1 <= quality <= 100:
+                raise ValueError(f"invalid quality {quality}")
+
+        if preview is True:
+            preview = DUAL_PREVIEW_SIZE
+        elif preview:
+            preview = tuple(int(v) for v in preview)
+            if len(preview) != 2 or preview[0] <= 0 or preview[1] <= 0:
+                raise ValueError(f"invalid preview size {preview}")
+        else:
+            preview = None
+
+        return CaptureOptions(roi, size, quality, gray, preview) # type: ignore
+
+@dataclass(frozen=True)
+class CameraCalibration:
+    lens_position: Optional[float]          # dioptres, None if the lens has no autofocus
+    exposure_time: int                      # microseconds
+    analogue_gain: float
+    colour_gains: tuple[float, float]       # red and blue AWB gains
+
+    def report(self) -> dict:
+        return {"lens_position": self.lens_position, "exposure_time": self.exposure_time,
+                "analogue_gain": self.analogue_gain, "colour_gains": list(self.colour_gains)}
+
+@dataclass(frozen=True)
+class CaptureSettings:
+    width: int
+    height: int
+    roi: Optional[tuple[int, int, int, int]] = None     # see CaptureOptions, clamped to the frame
+    size: Optional[tuple[int, int]] = None
+    quality: Optional[int] = None
+    gray: bool = False
+    calibration: Optional[CameraCalibration] = None     # fixed focus, exposure and gains, None runs AF/AE/AWB per capture
+
+    def with_options(self, options: Optional[CaptureOptions]) -> "CaptureSettings":
+        """Settings with the crop, size and quality of options applied"""
+        if options is None:
+            return self
+
+        roi = options.roi
+        if roi is not None:
+            roi = (min(roi[0], self.width - 1), min(roi[1], self.height - 1), min(roi[2], self.width), min(roi[3], self.height))
+
+        return replace(self, roi=roi, size=options.size, quality=options.quality, gray=options.gray)
+
+    def with_calibration(self, calibration: Optional[CameraCalibration]) -> "CaptureSettings":
+        """Settings capturing with the focus, exposure and gains of calibration (None for automatic ones)"""
+        return replace(self, calibration=calibration)
+
+    def output_size(self) -> tuple[int, int]:
+        """Width and height of the image these settings produce"""
+        if self.size is not None:
+            return self.size
+        if self.roi is not None:
+            return (self.roi[2] - self.roi[0], self.roi[3] - self.roi[1])
+        return (self.width, self.height)
+
+    def normalized_roi(self) -> tuple[float, float, float, float]:
+        """ROI as (x, y, width, height) fractions of the frame, the form rpicam's --roi takes"""
+        left, top, right, bottom = self.roi if self.roi is not None else (0, 0, self.width, self.height)
+        return (left / self.width, top / self.height, (right - left) / self.width, (bottom - top) / self.height)
+
+    def is_plain(self) -> bool:
+        """True if neither crop, resize, quality nor gray are requested"""
+        return self.roi is None and self.size is None and self.quality is None and not self.gray
+
+    def base(self) -> "CaptureSettings":
+        """Settings of the uncropped sensor mode (and pixel format) these settings are taken from"""
+        return CaptureSettings(self.width, self.height, gray=self.gray)
+
+@dataclass
+class PhaseTimer:
+    phases: dict[str, float] = field(default_factory=dict)    # seconds spent per phase, in order of first entry
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Adds the time spent in the with block to phase name"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.monotonic() - started
+
+class ChunkWriter(io.RawIOBase):
+    def __init__(self, on_chunk: Callable[[bytes], None]) -> None:
+        """Write-only file object passing everything written to on_chunk, lets encoders write straight to a stream"""
+        self.on_chunk = on_chunk
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.on_chunk(bytes(data))
+        return len(data)
+
+MAIN_SETTINGS = CaptureSettings(8000, 6000)
+PREVIEW_SETTINGS = CaptureSettings(2312, 1736)
+STREAM_SETTINGS = CaptureSettings(1014, 760)
+
+class CameraBackend:
+    """
+    Interface for the ways ImagerCtl can drive the camera
+    """
+    name = "base"
+
+    def open(self) -> None:
+        """Acquires the camera, raises on failure"""
+        pass
+
+    def close(self) -> None:
+        """Releases the camera"""
+        pass
+
+    def capture(self, settings: CaptureSettings, output: Path, timer: PhaseTimer) -> None:
+        """
+        Captures a JPEG (PNG if settings.gray) with given settings into output, raises CaptureFailed on failure
+
+        timer: records how long the phases of the capture took
+        """
+        raise NotImplementedError
+
+    def capture_stream(self, settings: CaptureSettings, on_chunk: Callable[[bytes], None], timer: PhaseTimer) -> None:
+        """
+        Captures a JPEG (PNG if settings.gray) with given settings without writing a file, raises CaptureFailed on failure
+
+        on_chunk: called with the encoded bytes in order as the encoder produces them,
+                  whatever was passed is invalid if CaptureFailed is raised
+        timer: records how long the phases of the capture took
+        """
+        raise NotImplementedError
+
+    def capture_dual(self, settings: CaptureSettings, output: Path, preview_size: tuple[int, int],
+                     on_preview: Callable[[bytes], None], timer: PhaseTimer) -> None:
+        """
+        Captures like capture, and passes on_preview a JPEG fitting within preview_size made from the same exposure
+
+        Backends that hold the frame in memory pass the preview on before the main image is encoded,
+        this one decodes it from output (at a reduced DCT scale for JPEGs) once it is written
+        """
+        self.capture(settings, output, timer)
+
+        with timer.phase("preview"):
+            preview = decode_preview(output, preview_size)
+        on_preview(preview)
+
+    def calibrate(self, timer: PhaseTimer) -> CameraCalibration:
+        """
+        Runs autofocus and lets AE/AWB settle once, raises CaptureFailed on failure
+
+        Captures with the returned calibration in their settings skip all three
+        return: the lens position, exposure and gains the camera settled on
+        """
+        raise NotImplementedError
+
+    def preview_source(self) -> FrameSource:
+        """Source of live preview frames, sharing the camera with this backend"""
+        raise NotImplementedError
+
+class RpicamStillBackend(CameraBackend):
+    """
+    Starts a new rpicam-still process for every capture
+
+    Every shot pays for process start, camera init, AE/AWB convergence and autofocus,
+    but nothing is held between captures
+    """
+    name = "rpicam"
+
+    def __init__(self, command: Sequence[str] = ("rpicam-still",)) -> None:
+        """
+        command: program (and leading arguments) taking rpicam-still's arguments, e.g. a fake encoder in tests
+        """
+        self.command = list(command)
+
+    def __args(self, settings: CaptureSettings, output: Union[Path, str]) -> list:
+        width, height = settings.output_size()
+        args = self.command + ["-o", output,
+                               "--width", str(width),
+                               "--height", str(height),
+                               "-n", "--denoise", "cdn_off"]
+
+        calibration = settings.calibration
+        if calibration is None:
+            args += ["--autofocus-on-capture"]
+        else:   # fixed exposure, so no AE/AWB convergence is needed before the capture either
+            if calibration.lens_position is not None:
+                args += ["--lens-position", f"{calibration.lens_position:.3f}"]
+            args += ["--shutter", str(calibration.exposure_time),
+                     "--gain", f"{calibration.analogue_gain:.3f}",
+                     "--awbgains", ",".join(f"{gain:.3f}" for gain in calibration.colour_gains),
+                     "--immediate"]
+
+        if settings.roi is not None:    # cropped by the ISP, only the ROI is scaled and encoded
+            args += ["--roi", ",".join(f"{v:.6f}" for v in settings.normalized_roi())]
+        if settings.quality is not None:
+            args += ["--quality", str(settings.quality)]
+        return args
+
+    def capture(self, settings: CaptureSettings, output: Path, timer: PhaseTimer) -> None:
+        if settings.gray:
+            self.__capture_gray(settings, output, timer)
+            return
+
+        args = self.__args(settings, output)
+
+        # camera start, AE/AWB, autofocus, encode and write all happen inside rpicam-still
+        with timer.phase("process_start"):
+            process = subprocess.Popen(args)
+        with timer.phase("rpicam"):
+            exit_code = process.wait()
+
+        if exit_code:
+            raise CaptureFailed()
+
+    def capture_stream(self, settings: CaptureSettings, on_chunk: Callable[[bytes], None], timer: PhaseTimer) -> None:
+        if settings.gray:
+            self.__capture_gray(settings, ChunkWriter(on_chunk), timer)
+            return
+
+        # "-o -" writes the JPEG to stdout, it is passed on as rpicam-still emits it,
+        # so sending overlaps with the rest of the encode and the camera shutting down
+        with timer.phase("process_start"):
+            process = subprocess.Popen(self.__args(settings, "-"), stdout=subprocess.PIPE)
+        with timer.phase("rpicam"):
+            try:
+                for chunk in iter(lambda: process.stdout.read1(READ_SIZE), b""): # type: ignore
+                    on_chunk(chunk)
+            finally:
+                exit_code = process.wait()
+
+        if exit_code:
+            raise CaptureFailed()
+
+    def capture_dual(self, settings: CaptureSettings, output: Path, preview_size: tuple[int, int],
+                     on_preview: Callable[[bytes], None], timer: PhaseTimer) -> None:
+        """
+        rpicam-still cannot save its low resolution stream, but it writes an EXIF thumbnail of the same frame
+        ahead of the main image data, so that thumbnail is passed on as soon as it is read
+
+        The preview is at most EXIF_THUMBNAIL_SIZE, gray captures (raw planes, no EXIF) decode it once written
+        """
+        if settings.gray:
+            super().capture_dual(settings, output, preview_size, on_preview, timer)
+            return
+
+        width, height = settings.output_size()
+        box = (min(preview_size[0], EXIF_THUMBNAIL_SIZE[0]), min(preview_size[1], EXIF_THUMBNAIL_SIZE[1]))
+        scale = min(box[0] / width, box[1] / height, 1)
+        thumb = f"{max(1, round(width * scale))}:{max(1, round(height * scale))}:{DUAL_PREVIEW_QUALITY}"
+
+        with timer.phase("process_start"):
+            process = subprocess.Popen(self.__args(settings, "-") + ["--thumb", thumb], stdout=subprocess.PIPE)
+        header: Optional[bytearray] = bytearray()   # start of the image, until the thumbnail was found (or there is none)
+        with timer.phase("rpicam"):
+            try:
+                with open(output, "wb") as file:
+                    for chunk in iter(lambda: process.stdout.read1(READ_SIZE), b""): # type: ignore
+                        file.write(chunk)
+                        if header is None:
+                            continue
+
+                        header += chunk
+                        complete, thumbnail = exif_thumbnail(header)
+                        if complete:
+                            header = None
+                            if thumbnail is not None:
+                                on_preview(thumbnail)
+                                on_preview = None
+            finally:
+                exit_code = process.wait()
+
+        if exit_code:
+            raise CaptureFailed()
+
+        if on_preview is not None:  # no thumbnail in the output after all
+            with timer.phase("preview"):
+                preview = decode_preview(output, preview_size)
+            on_preview(preview)
+
+    def calibrate(self, timer: PhaseTimer) -> CameraCalibration:
+        # a preview sized capture that is thrown away, only its metadata is kept
+        args = self.__args(PREVIEW_SETTINGS, "/dev/null") + ["--metadata", "-", "--metadata-format", "json"]
+
+        with timer.phase("process_start"):
+            process = subprocess.Popen(args, stdout=subprocess.PIPE)
+        with timer.phase("rpicam"):
+            output = process.stdout.read() # type: ignore
+            exit_code = process.wait()
+
+        if exit_code:
+            raise CaptureFailed()
+
+        try:
+            metadata = json.loads(output)
+            return CameraCalibration(metadata.get("LensPosition"), int(metadata["ExposureTime"]),
+                                     float(metadata["AnalogueGain"]), tuple(metadata["ColourGains"])) # type: ignore
+        except (ValueError, KeyError, TypeError) as e:
+            raise CaptureFailed() from e
+
+    def __capture_gray(self, settings: CaptureSettings, output: Union[Path, BinaryIO], timer: PhaseTimer) -> None:
+        """Takes the raw YUV420 output of rpicam-still (already cropped and scaled by the ISP) and keeps only its Y plane"""
+        with timer.phase("process_start"):
+            process = subprocess.Popen(self.__args(settings, "-") + ["--encoding", "yuv420"], stdout=subprocess.PIPE)
+        with timer.phase("rpicam"):
+            planes = process.stdout.read() # type: ignore
+            exit_code = process.wait()
+
+        width, height = settings.output_size()
+        if exit_code or len(planes) < width * height:
+            raise CaptureFailed()
+
+        with timer.phase("encode_write"):
+            from PIL import Image
+            save_gray(Image.frombuffer("L", (width, height), planes, "raw", "L", 0, 1), settings.quality, output)
+
+    def preview_source(self) -> FrameSource:
+        return MjpegFrameSource(STREAM_SETTINGS.width, STREAM_SETTINGS.height)
+
+class Picamera2Backend(CameraBackend):
+    """
+    Keeps one picamera2 session open between captures
+
+    The camera keeps running in the configuration of the last capture, so AE/AWB stay
+    converged and a capture costs an autofocus cycle (none once calibrated) plus sensor readout and encode
+
+    A ROI is cropped by the ISP (ScalerCrop) and scaled straight to the output size, only that is processed and encoded
+    """
+    name = "picamera2"
+
+    def __init__(self) -> None:
+        self.picam2 = None
+        self.configs: dict[CaptureSettings, dict] = {}
+        self.current: Optional[CaptureSettings] = None
+        self.applied: Optional[CameraCalibration] = None    # calibration the running camera's controls are fixed to
+        self.crop: Optional[tuple[int, int, int, int]] = None  # ScalerCrop the running camera reads out
+
+    def open(self) -> None:
+        from picamera2 import Picamera2 # only available on the Pi
+
+        self.picam2 = Picamera2()
+        self.__switch(PREVIEW_SETTINGS)
+
+    def close(self) -> None:
+        if self.picam2 is not None:
+            self.picam2.close()
+            self.picam2 = None
+            self.current = None
+
+    def __config(self, settings: CaptureSettings) -> dict:
+        if settings not in self.configs:
+            main = {"size": (settings.width, settings.height)}
+            if settings.gray:   # the Y plane of YUV420 is the luma, no colour conversion needed
+                main["format"] = "YUV420"
+
+            self.configs[settings] = self.picam2.create_still_configuration( # type: ignore
+                main=main,
+                buffer_count=1
+            )
+        return self.configs[settings]
+
+    @staticmethod
+    def __controls(calibration: Optional[CameraCalibration], crop: tuple[int, int, int, int]) -> dict:
+        """
+        Controls reading out crop of the sensor and fixing focus, exposure and gains to calibration,
+        or handing exposure and gains back to AE/AWB if None
+        """
+        if calibration is None:
+            return {"ScalerCrop": crop, "AeEnable": True, "AwbEnable": True}   # autofocus_cycle switches the AF mode itself
+
+        controls = {"ScalerCrop": crop, "AeEnable": False, "ExposureTime": calibration.exposure_time,
+                    "AnalogueGain": calibration.analogue_gain, "AwbEnable": False, "ColourGains": calibration.colour_gains}
+        if calibration.lens_position is not None:
+            from libcamera import controls as libcamera_controls
+
+            controls.update(AfMode=libcamera_controls.AfModeEnum.Manual, LensPosition=calibration.lens_position)
+        return controls
+
+    def __scaler_crop(self, settings: CaptureSettings) -> tuple[int, int, int, int]:
+        """ScalerCrop (x, y, width, height in sensor pixels) reading out the ROI of settings, the whole field if it has none"""
+        x, y, width, height = self.picam2.camera_properties["ScalerCropMaximum"] # type: ignore
+        if settings.roi is None:
+            return (x, y, width, height)
+
+        left, top, roi_width, roi_height = settings.normalized_roi()
+        return (x + round(left * width), y + round(top * height), round(roi_width * width), round(roi_height * height))
+
+    @staticmethod
+    def __stream(settings: CaptureSettings) -> CaptureSettings:
+        """Settings of the configuration the camera runs in for settings, a ROI is read out at the output size"""
+        if settings.roi is None:
+            return settings.base()
+        width, height = settings.output_size()
+        return CaptureSettings(width, height, gray=settings.gray)
+
+    def __switch(self, settings: CaptureSettings, calibration: Optional[CameraCalibration] = None,
+                 crop: Optional[tuple[int, int, int, int]] = None) -> None:
+        """
+        Runs the camera in the configuration for settings with the controls of calibration and crop (no-op if it already is)
+
+        crop: ScalerCrop to read out, the whole field if None
+        """
+        crop = crop or self.__scaler_crop(settings.base())
+        if self.current == settings and self.applied == calibration and self.crop == crop:
+            return
+
+        picam2 = self.picam2
+        if self.current == settings:    # controls set on a running camera take effect a few frames later
+            picam2.set_controls(self.__controls(calibration, crop)) # type: ignore
+            for _ in range(CONTROL_DELAY_FRAMES):
+                picam2.capture_metadata() # type: ignore
+        else:                           # controls set before start apply from the first frame
+            picam2.stop() # type: ignore
+            picam2.configure(self.__config(settings)) # type: ignore
+            picam2.set_controls(self.__controls(calibration, crop)) # type: ignore
+            picam2.start() # type: ignore
+            self.current = settings
+        self.applied = calibration
+        self.crop = crop
+
+    def calibrate(self, timer: PhaseTimer) -> CameraCalibration:
+        if self.picam2 is None:
+            raise CaptureFailed()
+
+        try:
+            with timer.phase("configure"):
+                self.__switch(PREVIEW_SETTINGS)
+            with timer.phase("autofocus"):
+                self.picam2.autofocus_cycle()
+            with timer.phase("metering"):
+                for _ in range(METERING_FRAMES):
+                    metadata = self.picam2.capture_metadata()
+                    if metadata.get("AeLocked", True):
+                        break
+
+            return CameraCalibration(metadata.get("LensPosition"), int(metadata["ExposureTime"]),
+                                     float(metadata["AnalogueGain"]), tuple(metadata["ColourGains"])) # type: ignore
+        except Exception as e:
+            raise CaptureFailed() from e
+
+    def capture(self, settings: CaptureSettings, output: Path, timer: PhaseTimer) -> None:
+        self.__capture(settings, output, timer)
+
+    def capture_stream(self, settings: CaptureSettings, on_chunk: Callable[[bytes], None], timer: PhaseTimer) -> None:
+        self.__capture(settings, ChunkWriter(on_chunk), timer)
+
+    def capture_dual(self, settings: CaptureSettings, output: Path, preview_size: tuple[int, int],
+                     on_preview: Callable[[bytes], None], timer: PhaseTimer) -> None:
+        # both are made from the one frame in memory, the preview goes out before the main image is encoded
+        def on_image(image) -> None:
+            on_preview(encode_preview(image, preview_size))
+
+        self.__capture(settings, output, timer, on_image)
+
+    def __capture(self, settings: CaptureSettings, output: Union[Path, BinaryIO], timer: PhaseTimer,
+                  on_image: Optional[Callable] = None) -> None:
+        """Captures into output, on_image is called with the PIL image of the ROI first (the camera encodes plain captures itself otherwise)"""
+        if self.picam2 is None:
+            raise CaptureFailed()
+
+        try:
+            stream = self.__stream(settings)
+            with timer.phase("configure"):
+                self.__switch(stream, settings.calibration, self.__scaler_crop(settings))
+            if settings.calibration is None:
+                with timer.phase("autofocus"):
+                    self.picam2.autofocus_cycle()
+
+            if settings.is_plain() and on_image is None:
+                with timer.phase("capture_encode_write"):
+                    self.picam2.capture_file(str(output) if isinstance(output, Path) else output, format="jpeg")
+                return
+
+            with timer.phase("capture"):
+                if settings.gray:
+                    from PIL import Image
+
+                    planes = self.picam2.capture_array("main")
+                    image = Image.fromarray(planes[:stream.height, :stream.width])
+                else:
+                    image = self.picam2.capture_image("main")
+            if on_image is not None:
+                with timer.phase("preview"):
+                    on_image(image)
+            with timer.phase("process_encode_write"):   # already cropped, only resized if the ISP aligned the output size
+                save_processed(image, replace(settings, roi=None, size=settings.output_size()), output)
+        except Exception as e:
+            raise CaptureFailed() from e
+
+    def preview_source(self) -> FrameSource:
+        return Picamera2FrameSource(self)
+
+class Picamera2FrameSource(FrameSource):
+    def __init__(self, backend: Picamera2Backend) -> None:
+        """
+        Live preview frames from the session of a Picamera2Backend, MJPEG encoded on the ISP side
+        """
+        self.backend = backend
+        self.frames: queue.Queue[Optional[bytes]] = queue.Queue(maxsize=2)
+        self.encoder = None
+
+    def __drain(self) -> None:
+        while not self.frames.empty():
+            self.frames.get_nowait()
+
+    def start(self) -> None:
+        from picamera2.encoders import MJPEGEncoder
+        from picamera2.outputs import Output
+
+        self.__drain()
+        frames = self.frames
+
+        class QueueOutput(Output):
+            def outputframe(self, frame, *args, **kwargs):
+                try:
+                    frames.put_nowait(bytes(frame))
+                except queue.Full:
+                    pass    # reader is behind, drop the frame
+
+        picam2 = self.backend.picam2
+        picam2.stop() # type: ignore
+        picam2.configure(picam2.create_video_configuration( # type: ignore
+            main={"size": (STREAM_SETTINGS.width, STREAM_SETTINGS.height)}
+        ))
+        self.backend.current = STREAM_SETTINGS
+        self.backend.applied = None     # a new configuration starts with automatic controls
+        self.encoder = MJPEGEncoder()
+        picam2.start_recording(self.encoder, QueueOutput()) # type: ignore
+
+    def stop(self) -> None:
+        if self.encoder is not None:
+            self.backend.picam2.stop_recording() # type: ignore
+            self.backend.current = None
+            self.encoder = None
+        self.__drain()
+        self.frames.put_nowait(None)
+
+    def read_frame(self) -> Optional[bytes]:
+        return self.frames.get()
+
+class FakeCameraBackend(CameraBackend):
+    """
+    Deterministic camera for tests, writes a solid colour JPEG (gray PNG) of the requested size after a fixed latency
+
+    Captures without a calibration run an autofocus sweep first, af_sweeps counts them (and those of calibrate)
+    """
+    name = "fake"
+    calibration = CameraCalibration(lens_position=2.5, exposure_time=20000, analogue_gain=1.5, colour_gains=(1.8, 1.6))
+
+    def __init__(self, latency: float = 0, fail: bool = False, autofocus: float = 0, encode: float = 0) -> None:
+        """
+        latency: seconds every capture takes
+        fail: if True every capture (and calibration) raises CaptureFailed
+        autofocus: seconds every autofocus sweep takes
+        encode: seconds encoding every image takes, after the preview of a dual capture is passed on
+        """
+        self.latency = latency
+        self.fail = fail
+        self.autofocus = autofocus
+        self.encode = encode
+        self.captures: list[CaptureSettings] = []
+        self.images: dict[CaptureSettings, bytes] = {}
+        self.af_sweeps = 0
+        self.calibrations = 0
+
+    def __image(self, settings: CaptureSettings) -> bytes:
+        if settings not in self.images:
+            from PIL import Image
+
+            buffer = io.BytesIO()
+            if settings.gray:
+                save_gray(Image.new("L", settings.output_size(), color=60), settings.quality, buffer)
+            else:
+                Image.new("RGB", settings.output_size(), color=(30, 60, 90)).save(buffer, "JPEG", quality=settings.quality or 75)
+            self.images[settings] = buffer.getvalue()
+        return self.images[settings]
+
+    def __autofocus(self, timer: PhaseTimer) -> None:
+        with timer.phase("autofocus"):
+            time.sleep(self.autofocus)
+        self.af_sweeps += 1
+
+    def __take(self, settings: CaptureSettings, timer: PhaseTimer, on_frame: Optional[Callable[[], None]] = None) -> bytes:
+        """Focuses unless calibrated, captures and encodes, on_frame is called in between"""
+        if settings.calibration is None:
+            self.__autofocus(timer)
+        with timer.phase("capture"):
+            time.sleep(self.latency)
+        self.captures.append(settings)
+
+        if self.fail:
+            raise CaptureFailed()
+
+        if on_frame is not None:
+            with timer.phase("preview"):
+                on_frame()
+
+        with timer.phase("encode"):
+            time.sleep(self.encode)
+            return self.__image(settings)
+
+    def capture(self, settings: CaptureSettings, output: Path, timer: PhaseTimer) -> None:
+        image = self.__take(settings, timer)
+        with timer.phase("write"):
+            output.write_bytes(image)
+
+    def capture_dual(self, settings: CaptureSettings, output: Path, preview_size: tuple[int, int],
+                     on_preview: Callable[[bytes], None], timer: PhaseTimer) -> None:
+        # like the picamera2 backend, the preview goes out before the main image is encoded
+        def on_frame() -> None:
+            from PIL import Image
+
+            frame = Image.new("L", settings.output_size(), color=60) if settings.gray else \
+                    Image.new("RGB", settings.output_size(), color=(30, 60, 90))
+            on_preview(encode_preview(frame, preview_size))
+
+        image = self.__take(settings, timer, on_frame)
+        with timer.phase("write"):
+            output.write_bytes(image)
+
+    def capture_stream(self, settings: CaptureSettings, on_chunk: Callable[[bytes], None], timer: PhaseTimer) -> None:
+        image = self.__take(settings, timer)
+        with timer.phase("stream"):
+            for offset in range(0, len(image), READ_SIZE):
+                on_chunk(image[offset:offset + READ_SIZE])
+
+    def calibrate(self, timer: PhaseTimer) -> CameraCalibration:
+        self.__autofocus(timer)
+
+        if self.fail:
+            raise CaptureFailed()
+
+        self.calibrations += 1
+        return self.calibration
+
+    def preview_source(self) -> FrameSource:
+        return FakeFrameSource(size=(STREAM_SETTINGS.width, STREAM_SETTINGS.height))
+
+def save_processed(image, settings: CaptureSettings, output: Union[Path, BinaryIO]) -> None:
+    """Crops, resizes and encodes a full frame PIL image as settings ask for into a file or file object"""
+    from PIL import Image
+
+    if settings.roi is not None:
+        image = image.crop(settings.roi)
+    if settings.size is not None and image.size != settings.size:
+        image = image.resize(settings.size, Image.Resampling.BILINEAR)
+
+    if settings.gray:
+        save_gray(image.convert("L"), settings.quality, output)
+    else:
+        image.convert("RGB").save(output, "JPEG", quality=settings.quality or 90)
+
+def encode_preview(image, size: tuple[int, int]) -> bytes:
+    """Downscaled copy of a PIL image fitting within size as JPEG bytes (gray stays gray), image itself is left as it is"""
+    from PIL import Image
+
+    scale = min(size[0] / image.width, size[1] / image.height, 1)
+    preview = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                           Image.Resampling.BILINEAR, reducing_gap=3.0)
+    if preview.mode not in ["L", "RGB"]:
+        preview = preview.convert("RGB")
+
+    buffer = io.BytesIO()
+    preview.save(buffer, "JPEG", quality=DUAL_PREVIEW_QUALITY)
+    return buffer.getvalue()
+
+def decode_preview(path: Path, size: tuple[int, int]) -> bytes:
+    """Preview fitting within size of an image file, JPEGs are decoded at a reduced DCT scale"""
+    from PIL import Image
+
+    with Image.open(path) as image:
+        image.draft("RGB", size)
+        return encode_preview(image, size)
+
+def exif_thumbnail(header: bytes) -> tuple[bool, Optional[bytes]]:
+    """
+    Finds the EXIF thumbnail in the start of a JPEG, looking through the APPn segments that follow its SOI
+
+    return: (whether header is long enough to tell, the thumbnail's JPEG bytes if there is one)
+    """
+    if len(header) >= 2 and header[:2] != b"\xff\xd8":
+        return True, None
+
+    position = 2
+    while True:
+        if len(header) < position + 4:
+            return False, None
+        if header[position] != 0xff or not 0xe0 <= header[position + 1] <= 0xef:   # past the APPn segments
+            return True, None
+
+        end = position + 2 + int.from_bytes(header[position + 2:position + 4], "big")
+        if len(header) < end:
+            return False, None
+
+        segment = bytes(header[position + 4:end])
+        if header[position + 1] == 0xe1 and segment.startswith(b"Exif\x00\x00"):
+            start = segment.find(b"\xff\xd8")
+            stop = segment.rfind(b"\xff\xd9")
+            return True, segment[start:stop + 2] if 0 <= start < stop else None
+        position = end
+
+def save_gray(image, quality: Optional[int], output: Union[Path, BinaryIO]) -> None:
+    """Encodes a single channel PIL image as lossless 8-bit PNG, or as gray JPEG if a quality is given"""
+    if quality is None:
+        image.save(output, "PNG", compress_level=GRAY_PNG_LEVEL)
+    else:
+        image.save(output, "JPEG", quality=quality)
+
+def make_backend(name: str) -> CameraBackend:
+    """
+    Creates and opens the backend with given name (see BACKEND_NAMES)
+
+    "auto" prefers a persistent picamera2 session and falls back to rpicam-still subprocesses
+    """
+    if name == "auto":
+        try:
+            return make_backend("picamera2")
+        except Exception:
+            return make_backend("rpicam")
+
+    backends = {
+        "picamera2": Picamera2Backend,
+        "rpicam": RpicamStillBackend,
+        "fake": FakeCameraBackend,
+    }
+    backend = backends[name]()
+    backend.open()
+    return backend
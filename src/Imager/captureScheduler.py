@@ -0,0 +1,149 @@
+import time
+import shutil
+import asyncio
+import itertools
+import tempfile
+
+from typing import Optional, Callable
+from pathlib import Path
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+
+from src.connections import RequestType
+from src.Imager.cameraBackends import CaptureOptions, PhaseTimer
+
+PREVIEW_PRIORITY = 0    # lower runs first, previews are interactive so they skip queued mains (calibrations too, so queued captures reuse them)
+MAIN_PRIORITY = 1
+
+DEFAULT_OUTPUT_DIR = Path(tempfile.gettempdir()) / "imager"
+JOBS_DIR = "jobs"       # subdirectory of the output directory the scheduler owns
+
+@dataclass(order=True)
+class CaptureJob:
+    priority: int
+    sequence: int           # keeps jobs of equal priority FIFO
+    request_type: RequestType = field(compare=False)
+    output: Path = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    queued_at: float = field(compare=False)
+    options: Optional[CaptureOptions] = field(compare=False, default=None)
+    position: int = field(compare=False, default=0)             # jobs ahead of this one when it was queued
+    started_at: Optional[float] = field(compare=False, default=None)
+    finished_at: Optional[float] = field(compare=False, default=None)
+    timer: PhaseTimer = field(compare=False, default_factory=PhaseTimer)   # phases of the capture itself
+    on_chunk: Optional[Callable[[bytes], None]] = field(compare=False, default=None)    # streamed jobs pass the image here instead of writing output
+    on_preview: Optional[Callable[[bytes], None]] = field(compare=False, default=None)  # dual captures pass their preview here before output is complete
+
+    def report(self) -> dict:
+        """Queue and capture times of the job and the phases of the capture, in seconds"""
+        started = self.started_at if self.started_at is not None else time.monotonic()
+        finished = self.finished_at if self.finished_at is not None else started
+        return {
+            "job_id": self.sequence,
+            "queue_position": self.position,
+            "wait_s": started - self.queued_at,
+            "capture_s": finished - started,
+            "phases": dict(self.timer.phases),
+        }
+
+class CaptureScheduler:
+    def __init__(self, capture: Callable[[RequestType, Path, Optional[CaptureOptions], PhaseTimer, Optional[Callable[[bytes], None]],
+                                          Optional[Callable[[bytes], None]]], Optional[Path]],
+                 output_dir: Path = DEFAULT_OUTPUT_DIR) -> None:
+        """
+        Serializes captures through one camera worker
+
+        Jobs run one at a time in priority order (FIFO within a priority), each writes to its own file.
+        They run on a thread of their own, so blocking work in the event loop's default executor never delays them
+
+        capture: blocking function performing a capture of given type and options into given path,
+                 timing its phases with given timer, or passing the image to given chunk callback if one is given,
+                 and passing the preview of a dual capture to given preview callback
+        output_dir: directory job outputs are written in, only its JOBS_DIR subdirectory is used (and emptied on start)
+        """
+        self.capture = capture
+        self.output_dir = output_dir / JOBS_DIR
+
+        self.queue: asyncio.PriorityQueue[CaptureJob] = asyncio.PriorityQueue()
+        self.sequence = itertools.count(1)
+        self.running: Optional[CaptureJob] = None
+
+    def depth(self) -> int:
+        """Number of jobs queued or running"""
+        return self.queue.qsize() + (1 if self.running is not None else 0)
+
+    def submit(self, request_type: RequestType, priority: Optional[int] = None, options: Optional[CaptureOptions] = None,
+               on_chunk: Optional[Callable[[bytes], None]] = None, on_preview: Optional[Callable[[bytes], None]] = None) -> CaptureJob:
+        """
+        Queues a capture, await job.future for the path of the image (raises CaptureFailed on failure)
+
+        A CALIBRATE job is queued like a capture, its future resolves to the CameraCalibration
+
+        priority: lower runs first, defaults to PREVIEW_PRIORITY or MAIN_PRIORITY
+        options: crop, size and JPEG quality of the capture
+        on_chunk: stream the image to this callback (called from the camera worker thread) instead of
+                  writing a file, job.future then resolves to None once the image is complete
+        on_preview: called (from the camera worker thread) with the preview of a main capture whose options ask
+                    for one, before job.future resolves
+        """
+        if priority is None:
+            priority = PREVIEW_PRIORITY if request_type in [RequestType.CAPTURE_PREVIEW, RequestType.CALIBRATE] else MAIN_PRIORITY
+
+        sequence = next(self.sequence)
+        kind = "main" if request_type == RequestType.CAPTURE_MAIN else "preview"
+        suffix = ".png" if options is not None and options.gray and options.quality is None else ".jpg"
+
+        job = CaptureJob(
+            priority=priority,
+            sequence=sequence,
+            request_type=request_type,
+            output=self.output_dir / f"{sequence:06d}_{kind}{suffix}",
+            future=asyncio.get_running_loop().create_future(),
+            queued_at=time.monotonic(),
+            options=options,
+            position=self.depth(),
+            on_chunk=on_chunk,
+            on_preview=on_preview
+        )
+        self.queue.put_nowait(job)
+        return job
+
+    def release(self, job: CaptureJob) -> None:
+        """Removes the output of a job once it has been sent"""
+        job.output.unlink(missing_ok=True)
+
+    async def run(self) -> None:
+        """Camera worker, runs jobs until cancelled"""
+        shutil.rmtree(self.output_dir, ignore_errors=True)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        loop = asyncio.get_running_loop()
+        worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="camera")
+        try:
+            while True:
+                job = await self.queue.get()
+
+                if job.future.done():   # requester went away while the job was queued
+                    continue
+
+                self.running = job
+                job.started_at = time.monotonic()
+                try:
+                    result = await loop.run_in_executor(worker, self.capture, job.request_type, job.output, job.options, job.timer,
+                                                        job.on_chunk, job.on_preview)
+                except Exception as e:
+                    self.__finish(job)
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                else:
+                    self.__finish(job)
+                    if job.future.done():
+                        self.release(job)
+                    else:
+                        job.future.set_result(result)
+        finally:
+            worker.shutdown(wait=False)
+
+    def __finish(self, job: CaptureJob) -> None:
+        job.finished_at = time.monotonic()
+        self.running = None
@@ -0,0 +1,118 @@
+import shutil
+import asyncio
+import datetime
+
+from typing import Optional
+from pathlib import Path
+from collections import deque
+from dataclasses import dataclass, field
+
+from src.connections import RequestType
+from src.Imager.cameraBackends import CaptureOptions
+
+@dataclass
+class SeriesFrame:
+    index: int
+    path: Path
+    captured_at: str    # ISO timestamp of the capture
+    spool_id: Optional[int] = None  # set if the frame is kept in the capture spool, path is then the spool's file
+    sha256: Optional[str] = None
+
+@dataclass
+class CaptureSeries:
+    series_id: int
+    request_type: RequestType
+    interval: float
+    count: int
+    directory: Path     # frames are buffered here until delivered
+    options: Optional[CaptureOptions] = None
+
+    captured: int = 0
+    failed: int = 0
+    finished: bool = False
+    sender: Optional[asyncio.Task] = None   # task of the client request currently receiving the frames
+    finished_at: Optional[float] = None     # loop time the last capture was done
+    frames: deque = field(default_factory=deque)        # captured frames not yet delivered, oldest first
+    unacked: dict[int, SeriesFrame] = field(default_factory=dict)   # index -> buffered frame sent but not acknowledged yet
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def add_frame(self, index: int, path: Path, spool_id: Optional[int] = None, sha256: Optional[str] = None) -> None:
+        """Buffers a captured frame, spooled frames are only referred to"""
+        self.captured += 1
+        self.frames.append(SeriesFrame(index, path, datetime.datetime.now().isoformat(timespec="seconds"), spool_id, sha256))
+        self.changed.set()
+
+    def add_failure(self) -> None:
+        self.failed += 1
+        self.changed.set()
+
+    def finish(self) -> None:
+        self.finished = True
+        self.finished_at = asyncio.get_running_loop().time()
+        self.changed.set()
+
+    def is_attached(self) -> bool:
+        """True while a client request is receiving the frames"""
+        return self.sender is not None and not self.sender.done()
+
+    async def next_frame(self) -> Optional[SeriesFrame]:
+        """Waits for the oldest undelivered frame, None once the series is finished and every frame acknowledged"""
+        while not self.frames:
+            if self.finished and not self.unacked:
+                return None
+            self.changed.clear()
+            await self.changed.wait()
+        return self.frames[0]
+
+    def delivered(self, frame: SeriesFrame) -> None:
+        """
+        Takes a frame off the queue after it was sent
+
+        Sent only means handed to the kernel, so a buffered frame is kept until the client acknowledges it
+        (see ack); a spooled frame stays in the spool until acknowledged there
+        """
+        if self.frames and self.frames[0] is frame:
+            self.frames.popleft()
+        if frame.spool_id is None:
+            self.unacked[frame.index] = frame
+
+    def ack(self, indices: list[int]) -> list[int]:
+        """Deletes the buffered frames the client stored, returns the indices that were waiting for it"""
+        acked = []
+        for index in indices:
+            frame = self.unacked.pop(index, None) if isinstance(index, int) else None
+            if frame is not None:
+                frame.path.unlink(missing_ok=True)
+                acked.append(index)
+
+        if acked:
+            self.changed.set()
+        return acked
+
+    def resend_unacked(self) -> None:
+        """Queues the frames sent but never acknowledged again, ahead of the rest (on re-attach)"""
+        self.frames.extendleft(sorted(self.unacked.values(), key=lambda frame: frame.index, reverse=True))
+        self.unacked.clear()
+        self.changed.set()
+
+    def buffered(self) -> int:
+        """Number of frames held for the client, sent or not"""
+        return len(self.frames) + len(self.unacked)
+
+    def is_complete(self) -> bool:
+        """True once every frame has been taken, delivered and acknowledged"""
+        return self.finished and not self.frames and not self.unacked
+
+    def report(self) -> dict:
+        return {
+            "series_id": self.series_id,
+            "count": self.count,
+            "captured": self.captured,
+            "failed": self.failed,
+            "buffered": self.buffered(),
+            "finished": self.finished,
+        }
+
+    def remove(self) -> None:
+        """Deletes the buffer directory"""
+        shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,172 @@
+import os
+import re
+import json
+import time
+import shutil
+import threading
+
+from typing import Optional, Literal
+from pathlib import Path
+from dataclasses import dataclass, asdict
+
+from src.connections import sha256_file
+
+SPOOL_BYTES = 4 << 30               # bytes of spooled captures kept
+SPOOL_MIN_FREE = 512 << 20          # bytes left free on the spool's filesystem
+MANIFEST_NAME = "manifest.json"
+SPOOL_FILE = re.compile(r"(\d{8}|checkout_\d{8}_\d+)(\.\w+)?|manifest\.part")   # names of the files the spool writes
+
+QuotaPolicy = Literal["drop-oldest", "refuse-new"]
+
+@dataclass
+class SpoolEntry:
+    spool_id: int
+    name: str           # file name in the spool directory
+    size: int
+    sha256: str
+    captured_at: float  # unix time
+    series_id: Optional[int] = None
+    index: Optional[int] = None
+
+    def report(self) -> dict:
+        return {"spool_id": self.spool_id, "name": self.name, "size": self.size, "sha256": self.sha256,
+                "captured_at": self.captured_at, "series_id": self.series_id, "index": self.index}
+
+class CaptureSpool:
+    def __init__(self, directory: Path, max_bytes: int = SPOOL_BYTES, min_free: int = SPOOL_MIN_FREE,
+                 policy: QuotaPolicy = "drop-oldest") -> None:
+        """
+        Captures kept on disk until a client acknowledges them, listed in a manifest that survives restarts
+
+        IDs keep counting up across restarts, so a client never confuses two captures. When the spool
+        would exceed max_bytes, or leave less than min_free bytes on its filesystem, policy decides:
+        "drop-oldest" deletes the oldest unacknowledged captures to make room, "refuse-new" keeps them
+        and add returns None
+
+        directory: directory holding the captures and the manifest, created on the first capture; on the SD card
+                   it survives restarts, unlike the output directory. Files the spool did not write are left alone
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_free = min_free
+        self.policy = policy
+
+        self.lock = threading.Lock()    # add runs in the executor, everything else on the event loop
+        self.entries: dict[int, SpoolEntry] = {}    # oldest first
+        self.reserved = 0                           # bytes of captures being moved in, counted against the quota
+        self.next_id = 1
+        self.__load()
+
+    def __manifest_path(self) -> Path:
+        return self.directory / MANIFEST_NAME
+
+    def __load(self) -> None:
+        """Reads the manifest, forgets entries whose file is gone and deletes spool files no entry refers to"""
+        try:
+            manifest = json.loads(self.__manifest_path().read_text())
+            self.next_id = int(manifest["next_id"])
+            for entry in [SpoolEntry(**entry) for entry in manifest["entries"]]:
+                if (self.directory / entry.name).exists():
+                    self.entries[entry.spool_id] = entry
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+
+        names = {entry.name for entry in self.entries.values()} | {MANIFEST_NAME}
+        for path in self.directory.iterdir():
+            if path.name not in names and SPOOL_FILE.fullmatch(path.name) and path.is_file():
+                path.unlink(missing_ok=True)
+
+    def __save(self) -> None:
+        """Writes the manifest atomically, a crash leaves the old or the new one"""
+        manifest = {"next_id": self.next_id, "entries": [asdict(entry) for entry in self.entries.values()]}
+        partial = self.__manifest_path().with_suffix(".part")
+        with open(partial, "w") as file:
+            json.dump(manifest, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(partial, self.__manifest_path())
+
+    def path(self, entry: SpoolEntry) -> Path:
+        return self.directory / entry.name
+
+    def bytes(self) -> int:
+        return sum(entry.size for entry in self.entries.values())
+
+    def add(self, path: Path, series_id: Optional[int] = None, index: Optional[int] = None) -> Optional[SpoolEntry]:
+        """
+        Moves a capture into the spool (blocking, hashes and copies it), path is gone afterwards unless None is returned
+
+        return: the new entry, None if the quota policy refused it
+        """
+        size = path.stat().st_size
+        self.directory.mkdir(parents=True, exist_ok=True)
+        sha256 = sha256_file(path)
+
+        # the size is reserved while the file is moved, so concurrent adds cannot overshoot the quota together
+        with self.lock:
+            if not self.__make_room(size):
+                return None
+
+            self.reserved += size
+            spool_id = self.next_id
+            self.next_id += 1
+            entry = SpoolEntry(spool_id, f"{spool_id:08d}{path.suffix}", size, sha256, time.time(), series_id, index)
+
+        try:
+            shutil.move(path, self.path(entry))    # a copy when the output directory is on tmpfs
+        except:
+            with self.lock:
+                self.reserved -= size
+            raise
+
+        with self.lock:
+            self.reserved -= size
+            self.entries[entry.spool_id] = entry
+            self.__save()
+        return entry
+
+    def __make_room(self, size: int) -> bool:
+        """Applies the quota policy for a capture of size bytes, True if it fits afterwards"""
+        def fits() -> bool:
+            return self.bytes() + self.reserved + size <= self.max_bytes and \
+                   shutil.disk_usage(self.directory).free - self.reserved - size >= self.min_free
+
+        if self.policy == "drop-oldest" and not fits():
+            while self.entries and not fits():
+                self.__delete(next(iter(self.entries)))
+            self.__save()
+        return fits()
+
+    def get(self, spool_id: int) -> Optional[SpoolEntry]:
+        return self.entries.get(spool_id)
+
+    def list_entries(self) -> list[SpoolEntry]:
+        """Spooled captures, oldest first"""
+        with self.lock:
+            return list(self.entries.values())
+
+    def checkout(self, entry: SpoolEntry) -> Path:
+        """Links the capture to a new file the caller owns, it stays intact even if the entry is acknowledged meanwhile"""
+        checkout = self.directory / f"checkout_{entry.spool_id:08d}_{time.monotonic_ns()}{Path(entry.name).suffix}"
+        os.link(self.path(entry), checkout)
+        return checkout
+
+    def ack(self, spool_ids: list[int]) -> list[int]:
+        """Deletes acknowledged captures, returns the IDs that were spooled"""
+        with self.lock:
+            acked = [spool_id for spool_id in spool_ids if self.__delete(spool_id)]
+            if acked:
+                self.__save()
+        return acked
+
+    def __delete(self, spool_id: int) -> bool:
+        entry = self.entries.pop(spool_id, None)
+        if entry is None:
+            return False
+
+        self.path(entry).unlink(missing_ok=True)
+        return True
+
+    def report(self) -> dict:
+        with self.lock:
+            return {"count": len(self.entries), "bytes": self.bytes(), "max_bytes": self.max_bytes, "policy": self.policy}
@@ -1,9 +1,13 @@
 import subprocess
 
+from typing import Union, Optional, Callable
 from pathlib import Path
 
 from src.logs import Logger, INFO, WARN, ERROR
 from src.exceptions import CaptureFailed
+from src.Imager.previewStream import FrameSource
+from src.Imager.cameraBackends import CameraBackend, CameraCalibration, CaptureOptions, CaptureSettings, PhaseTimer, \
+                                     MAIN_SETTINGS, PREVIEW_SETTINGS, make_backend
 
 LED_COUNT = 8         # Number of LED pixels.
 LED_PIN = 18          # GPIO pin connected to the pixels (must support PWM!).
@@ -14,8 +18,26 @@ LED_INVERT = False    # True to invert the signal (when using NPN transistor lev
 LED_CHANNEL = 0
 
 class ImagerCtl:
-    def __init__(self, logger: Logger) -> None:
+    def __init__(self, logger: Logger, backend: Union[str, CameraBackend] = "auto", session: bool = False) -> None:
+        """
+        Controls the camera and the device
+
+        Once calibrated (see calibrate), captures reuse the calibration's focus, exposure and gains
+        instead of running autofocus and AE/AWB for every shot, until it is invalidated
+
+        logger: logger of the server
+        backend: camera backend, or name of one to create (see cameraBackends.BACKEND_NAMES)
+        session: calibrate on the first capture (and the first after an invalidation) instead of only on request
+        """
         self.logger = logger
+        self.session = session
+        self.calibration : Optional[CameraCalibration] = None
+
+        if isinstance(backend, str):
+            backend = make_backend(backend)
+        self.backend = backend
+
+        self.__log(INFO, f"using {self.backend.name} camera backend")
 
     def __log(self, type: str, msg: str):
          """
@@ -26,48 +48,132 @@ class ImagerCtl:
          """
          self.logger.log(type, msg, "ImagerCtl")
 
-    def capture_main(self, temp_storage_path=Path("/tmp/main_img.jpg")) -> Path:
+    def calibrate(self, timer: Optional[PhaseTimer] = None) -> CameraCalibration:
+        """
+        Focuses and meters once, later captures reuse the result until invalidate_calibration
+
+        timer: records how long the phases of the calibration took
+        return: the lens position, exposure and gains now in use
+        """
+        self.__log(INFO, "calibrating focus and exposure")
+
+        try:
+            calibration = self.backend.calibrate(timer or PhaseTimer())
+        except CaptureFailed:
+            self.__log(ERROR, "failed to calibrate")
+            raise
+
+        self.calibration = calibration
+        self.__log(INFO, f"locked {calibration}")
+        return calibration
+
+    def invalidate_calibration(self) -> None:
+        """
+        Returns to autofocus and AE/AWB for every capture (in session mode until the next capture calibrates again)
+        """
+        if self.calibration is not None:
+            self.__log(INFO, "calibration invalidated")
+        self.calibration = None
+
+    def __settings(self, settings: CaptureSettings, options: Optional[CaptureOptions], timer: PhaseTimer) -> CaptureSettings:
+        """settings with options and the calibration applied, calibrating first in session mode"""
+        if self.session and self.calibration is None:
+            with timer.phase("calibrate"):
+                self.calibrate()
+
+        return settings.with_options(options).with_calibration(self.calibration)
+
+    def capture_main(self, temp_storage_path=Path("/tmp/main_img.jpg"), options: Optional[CaptureOptions] = None,
+                     timer: Optional[PhaseTimer] = None, on_preview: Optional[Callable[[bytes], None]] = None) -> Path:
         """
         Captures main image
 
         temp_storage_path: place to store captured image temporarily
+        options: crop, size and JPEG quality to apply on the imager
+        timer: records how long the phases of the capture took
+        on_preview: called with a small JPEG of the same exposure if options ask for a preview (see CameraBackend.capture_dual)
         return: path of captured image
         """
         self.__log(INFO, "capturing main")
 
-        exit_code = subprocess.run(["rpicam-still",
-                            "-o", temp_storage_path,
-                            "--width", "8000",
-                            "--height", "6000",
-                            "-n", "--autofocus-on-capture",
-                            "--denoise", "cdn_off"]).returncode
-
-        if exit_code:
+        try:
+            timer = timer or PhaseTimer()
+            settings = self.__settings(MAIN_SETTINGS, options, timer)
+            if on_preview is not None and options is not None and options.preview is not None:
+                self.backend.capture_dual(settings, temp_storage_path, options.preview, on_preview, timer)
+            else:
+                self.backend.capture(settings, temp_storage_path, timer)
+        except CaptureFailed:
             self.__log(ERROR, "failed to capture main")
-            raise CaptureFailed()
+            raise
         
         return temp_storage_path
 
-    def capture_preview(self, temp_storage_path=Path("/tmp/preview_img.jpg")) -> Path:
+    def capture_preview(self, temp_storage_path=Path("/tmp/preview_img.jpg"), options: Optional[CaptureOptions] = None,
+                        timer: Optional[PhaseTimer] = None) -> Path:
         """
         Captures preview image
 
         temp_storage_path: place to store captured image temporarily
+        options: crop, size and JPEG quality to apply on the imager
+        timer: records how long the phases of the capture took
         return: path of captured image
         """
-        exit_code = subprocess.run(["rpicam-still",
-                            "-o", temp_storage_path,
-                            "--width", "2312",
-                            "--height", "1736",
-                            "-n", "--autofocus-on-capture",
-                            "--denoise", "cdn_off"]).returncode
-        
-        if exit_code:
+        try:
+            timer = timer or PhaseTimer()
+            self.backend.capture(self.__settings(PREVIEW_SETTINGS, options, timer), temp_storage_path, timer)
+        except CaptureFailed:
             self.__log(ERROR, "failed to capture preview")
-            raise CaptureFailed()
+            raise
 
         return temp_storage_path
 
+    def stream_main(self, on_chunk: Callable[[bytes], None], options: Optional[CaptureOptions] = None,
+                    timer: Optional[PhaseTimer] = None) -> None:
+        """
+        Captures main image without a temporary file, passing the encoded bytes on as they are produced
+
+        on_chunk: called with the image in order, chunk by chunk (see CameraBackend.capture_stream)
+        options: crop, size and JPEG quality to apply on the imager
+        timer: records how long the phases of the capture took
+        """
+        self.__log(INFO, "streaming main")
+
+        try:
+            timer = timer or PhaseTimer()
+            self.backend.capture_stream(self.__settings(MAIN_SETTINGS, options, timer), on_chunk, timer)
+        except CaptureFailed:
+            self.__log(ERROR, "failed to capture main")
+            raise
+
+    def stream_preview(self, on_chunk: Callable[[bytes], None], options: Optional[CaptureOptions] = None,
+                       timer: Optional[PhaseTimer] = None) -> None:
+        """
+        Captures preview image without a temporary file, passing the encoded bytes on as they are produced
+
+        on_chunk: called with the image in order, chunk by chunk (see CameraBackend.capture_stream)
+        options: crop, size and JPEG quality to apply on the imager
+        timer: records how long the phases of the capture took
+        """
+        try:
+            timer = timer or PhaseTimer()
+            self.backend.capture_stream(self.__settings(PREVIEW_SETTINGS, options, timer), on_chunk, timer)
+        except CaptureFailed:
+            self.__log(ERROR, "failed to capture preview")
+            raise
+
+    def preview_source(self) -> FrameSource:
+        """
+        Source for the live preview stream, one long-lived MJPEG pipeline
+        """
+        return self.backend.preview_source()
+
+    def close(self) -> None:
+        """
+        Releases the camera
+        """
+        self.backend.close()
+
     def power_off(self) -> None:
         """
         Powers of device
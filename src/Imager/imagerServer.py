@@ -1,38 +1,91 @@
-import socket
-import threading
+import time
+import asyncio
+import itertools
 
 from typing import Optional, Callable, Literal, Union
 from pathlib import Path
-from PIL import Image
 
-from src.connections import Connection, RequestType, rtob, format_address_tuple, PROTOCOL_PORT
+from src.connections import AsyncConnection, RequestType, MessageKind, Status, Frame, format_address_tuple, \
+                            encode_json, decode_json, PROTOCOL_PORT, PROTOCOL_VERSIONS
 from src.logs import Logger, INFO, WARN, ERROR
+from src.exceptions import SocketReceivedBytesEmpty
 from src.Imager.imagerCtl import ImagerCtl, CaptureFailed
+from src.Imager.previewStream import PreviewStream
+from src.Imager.cameraBackends import CameraBackend, CameraCalibration, CaptureOptions, PhaseTimer, MAIN_SETTINGS, PREVIEW_SETTINGS
+from src.Imager.captureScheduler import CaptureScheduler, CaptureJob, DEFAULT_OUTPUT_DIR
+from src.Imager.captureSeries import CaptureSeries
+from src.Imager.transferStore import TransferStore, Transfer
+from src.Imager.recentCaptures import RecentCaptures, RecentCapture, RECENT_CAPTURE_COUNT, RECENT_CAPTURE_BYTES, \
+                                      VARIANT_QUALITY, make_variant
+from src.Imager.captureSpool import CaptureSpool, QuotaPolicy, SPOOL_BYTES
+from src.Imager.serviceAdvertiser import ServiceAdvertiser
+
+MAX_PREVIEW_FPS = 30
+CLIENT_TIMEOUT = 1200   # seconds a v1 client may stay silent before it is dropped
+MIN_SERIES_INTERVAL = 0.5
+SERIES_TTL = 3600       # seconds a finished series keeps its undelivered frames for a client to re-attach
 
 class ImagerServer:
-    def __init__(self, logfile : Path = Path("logs/imager_logs.txt"), rollingRecordCount : Optional[int] = 50) -> None:
+    def __init__(self, logfile : Path = Path("logs/imager_logs.txt"), rollingRecordCount : Optional[int] = 50,
+                 cameraBackend : Union[str, CameraBackend] = "auto", maxConnections : int = 8, backlog : int = 16,
+                 outputDir : Path = DEFAULT_OUTPUT_DIR, advertise : bool = True,
+                 recentCount : int = RECENT_CAPTURE_COUNT, recentBytes : int = RECENT_CAPTURE_BYTES,
+                 calibrationSession : bool = False, spoolDir : Optional[Path] = None,
+                 spoolBytes : int = SPOOL_BYTES, spoolPolicy : QuotaPolicy = "drop-oldest", seriesTtl : float = SERIES_TTL) -> None:
         """
         ImagerServerConnection constructor
 
         Class to run easy server to interact with src.Client.imagerApp
-        
+        Clients are served from one asyncio event loop, blocking camera work runs in its executor
+
         logfile: path to record file of logs
         rollingRecordCount: amount of logs to keep in logfile
+        cameraBackend: camera backend for ImagerCtl, or its name
+        maxConnections: number of clients served at once, further clients are refused
+        backlog: accept backlog of the listening socket
+        outputDir: directory for captures waiting to be sent (one per server), only its "jobs" subdirectory
+                   is written to and emptied on start
+        advertise: advertise the server as a zeroconf service (see ServiceAdvertiser)
+        recentCount: number of recent captures kept for re-fetching with FETCH_CAPTURE
+        recentBytes: bytes of recent captures kept (in the jobs subdirectory of outputDir)
+        calibrationSession: focus and meter on the first capture and reuse that for later ones until
+                            INVALIDATE_CALIBRATION, instead of only after a CALIBRATE request
+        spoolDir: directory series frames are spooled in until a client acknowledges them (see CaptureSpool),
+                  it survives restarts; None (the default) keeps series frames only until the client acknowledges them
+        spoolBytes: bytes of spooled frames kept
+        spoolPolicy: what happens to new frames once the spool is full (see CaptureSpool)
+        seriesTtl: seconds a finished series keeps undelivered frames for a client to re-attach
         """
         self.logger = Logger(logfile, rollingRecordCount)
 
-        self.imagerCtl = ImagerCtl(self.logger)
+        self.imagerCtl = ImagerCtl(self.logger, cameraBackend, calibrationSession)
+        self.preview_stream = PreviewStream(self.imagerCtl.preview_source())
+        self.scheduler = CaptureScheduler(self.__run_capture, outputDir)
+        self.transfers = TransferStore()
+        self.recent = RecentCaptures(self.scheduler.output_dir / "recent", recentCount, recentBytes)
+        self.variant_lock = asyncio.Lock()  # one downscaled variant is made at a time
+        self.spool = CaptureSpool(spoolDir, spoolBytes, policy=spoolPolicy) if spoolDir is not None else None
 
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.max_connections = maxConnections
+        self.backlog = backlog
+        self.advertise = advertise
+
+        self.loop : Optional[asyncio.AbstractEventLoop] = None
+        self.shutdown : Optional[asyncio.Event] = None
+        self.clients : set[asyncio.Task] = set()
+        self.series : dict[int, CaptureSeries] = {}         # series still capturing or holding undelivered frames
+        self.series_tasks : set[asyncio.Task] = set()
+        self.series_ids = itertools.count(1)
+        self.series_ttl = seriesTtl
 
         self.running = False
+        self.power_off_requested = False    # set by a POWER_OFF request, start() then powers the Pi off
 
 
     def __log(self, type: str, msg: str):
          """
          Creates log with name of class attached
-         
+
          type: type of log
          msg: message to log
          """
@@ -44,82 +97,858 @@ class ImagerServer:
 
     def start(self, ip: str = '0.0.0.0', port: int = 8888) -> None:
         """
-        Starts the server
-        
+        Starts the server, blocks until it is stopped (POWER_OFF request, stop() or KeyboardInterrupt)
+
+        The Pi is powered off afterwards only if a client sent POWER_OFF
+
+        ip: IP address to start server on
+        port: port to start listening on
+        """
+        try:
+            asyncio.run(self.serve(ip, port))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.running = False
+            self.imagerCtl.close()
+
+        # only a client asks for the Pi to go down, stop() and Ctrl-C just end the server
+        if self.power_off_requested:
+            self.imagerCtl.power_off()
+
+    def stop(self) -> None:
+        """Stops the server, safe to call from any thread"""
+        self.running = False
+        if self.loop is not None and self.shutdown is not None:
+            self.loop.call_soon_threadsafe(self.shutdown.set)
+
+    async def serve(self, ip: str = '0.0.0.0', port: int = 8888) -> None:
+        """
+        Serves clients until shutdown, then closes every client connection
+
         ip: IP address to start server on
         port: port to start listening on
         """
         sockname = (ip, port)
         self.__log(INFO, f"starting server on {sockname}")
-        self.server_socket.bind(sockname)
-        self.server_socket.listen(1)
-        self.server_socket.settimeout(5)
 
+        self.loop = asyncio.get_running_loop()
+        self.shutdown = asyncio.Event()
+
+        server = await asyncio.start_server(self.__accept, ip, port, backlog=self.backlog, reuse_address=True)
+        scheduler = asyncio.create_task(self.scheduler.run())
         self.running = True
-        
-        while self.isRunning():
+
+        advertiser = ServiceAdvertiser(ip, port)
+        if self.advertise:
             try:
-                client_socket, client_address = self.server_socket.accept()
-                self.__log(INFO, f"client connected from: {client_address}")
-                
-                thread = threading.Thread(
-                    target=self.handle_client,
-                    args=(client_socket, f"client@{format_address_tuple(client_address)}"),
-                    daemon=True
-                )
-                thread.start()
-                
-            except socket.timeout:
-                continue
-            except KeyboardInterrupt:
-                break
+                await advertiser.start()
+                self.__log(INFO, f"advertising as {advertiser.info.name}") # type: ignore
             except Exception as e:
-                self.__log(ERROR, f"exception from thread {e}")
-                continue
-        
-        self.server_socket.close()
-        self.imagerCtl.power_off()
+                self.__log(WARN, f"could not advertise server: {e}")
+
+        async with server:
+            await self.shutdown.wait()
 
-    def handle_client(self, client_socket: socket.socket, client_name: str) -> None:
+            try:
+                await advertiser.stop()
+            except Exception as e:
+                self.__log(WARN, f"could not withdraw advertisement: {e}")
+
+            server.close()
+            tasks = list(self.clients) + list(self.series_tasks) + [scheduler]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.__log(INFO, "server stopped")
+
+    async def __accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Runs a client connection, refusing it when maxConnections are already served"""
+        connection = AsyncConnection(reader, writer)
+        client_name = f"client@{format_address_tuple(connection.peername())}"
+
+        if len(self.clients) >= self.max_connections:
+            self.__log(WARN, f"refused {client_name}, already serving {len(self.clients)} clients")
+            await connection.close()
+            return
+
+        self.__log(INFO, f"client connected from: {client_name}")
+
+        task = asyncio.current_task()
+        self.clients.add(task) # type: ignore
+        connection.tune_for_bulk()
+        connection.enable_keepalive()
+        try:
+            await self.handle_client(connection, client_name)
+
+        except asyncio.CancelledError:
+            pass
+
+        except (SocketReceivedBytesEmpty, asyncio.IncompleteReadError, ConnectionError):
+            self.__log(INFO, f"{client_name} disconnected")
+
+        except Exception as e:
+            self.__log(ERROR, f"{client_name} task raised {e}")
+
+        finally:
+            self.clients.discard(task) # type: ignore
+            await connection.close()
+
+    def __power_off(self) -> None:
+        """Handles a POWER_OFF request"""
+        self.power_off_requested = True
+        self.running = False
+        if self.shutdown is not None:
+            self.shutdown.set()
+
+    async def handle_client(self, connection: AsyncConnection, client_name: str) -> None:
         """
         Logic to handle a client connection
 
-        Scheme is challenge-response
+        Scheme is challenge-response (v1) until the client negotiates v2 with a HELLO request
+
+        connection: connection to client
+        client_name: name of the client used in logs
+        """
+        while self.isRunning():
+
+            request = await asyncio.wait_for(connection.recv_fmsg(), CLIENT_TIMEOUT)
+            # an empty body is request type 0, as v1 clients encode it
+            try:
+                request_type = RequestType(request[0]) if request else RequestType.CHECK_CONNECTED
+            except ValueError:
+                self.__log(WARN, f"{client_name} sent unknown request type {request[0]}, closing the connection")
+                return
+
+            self.__log(INFO, f"from {client_name} received request: {request_type.name} ")
+            if request_type == RequestType.CHECK_CONNECTED:
+                await connection.send_fmsg(b"")
+
+            elif request_type in [RequestType.CAPTURE_PREVIEW, RequestType.CAPTURE_MAIN]:
+                job = self.scheduler.submit(request_type)
+                try:
+                    fpath = await job.future
+                    await connection.send_file(fpath)
+
+                except CaptureFailed:
+                    self.__log(ERROR, f"failed to capture image")
+
+                    await connection.send_fmsg(b"")
+
+                finally:
+                    self.scheduler.release(job)
+
+            elif request_type == RequestType.HELLO:
+                if await self.__negotiate(connection, request[1:]) == 2:
+                    await self.__handle_client_v2(connection, client_name)
+                    break
+
+            elif request_type == RequestType.POWER_OFF:
+                self.__power_off()
+                break
+
+            else:   # only handled after negotiating v2, an empty answer keeps a lock-step client going
+                self.__log(WARN, f"{client_name} sent {request_type.name} without negotiating v2")
+                await connection.send_fmsg(b"")
+
+    def __run_capture(self, request_type: RequestType, output: Path, options: Optional[CaptureOptions], timer: PhaseTimer,
+                      on_chunk: Optional[Callable[[bytes], None]] = None,
+                      on_preview: Optional[Callable[[bytes], None]] = None) -> Union[Path, CameraCalibration, None]:
+        """
+        Performs the capture (or calibration) asked for by request_type (blocking, run by the scheduler), raises CaptureFailed on failure
+
+        on_chunk: stream the image to on_chunk instead of writing it to output
+        on_preview: receives the preview of a dual main capture (see ImagerCtl.capture_main)
+        """
+        started = time.monotonic()
+        with self.preview_stream.paused():
+            timer.phases["pause_preview"] = time.monotonic() - started
+
+            if request_type == RequestType.CALIBRATE:
+                return self.imagerCtl.calibrate(timer)
+
+            if on_chunk is not None:
+                if request_type == RequestType.CAPTURE_MAIN:
+                    return self.imagerCtl.stream_main(on_chunk, options, timer)
+                return self.imagerCtl.stream_preview(on_chunk, options, timer)
 
-        client_socket: socket connection to client
-        client_address: tuple containing ip and port of client
+            if request_type == RequestType.CAPTURE_MAIN:
+                return self.imagerCtl.capture_main(output, options, timer, on_preview)
+            return self.imagerCtl.capture_preview(output, options, timer)
+
+    def __capabilities(self) -> list[str]:
+        """Names of the request types this server handles"""
+        spool_types = [RequestType.LIST_SPOOL, RequestType.FETCH_SPOOLED, RequestType.ACK_SPOOLED]
+        return [request_type.name for request_type in RequestType if self.spool is not None or request_type not in spool_types]
+
+    async def __negotiate(self, connection: AsyncConnection, hello: bytes) -> int:
+        """
+        Answers a HELLO request with the highest protocol version both sides support, the capabilities of the
+        server and how many more clients it would serve right now (the budget for extra range connections)
+
+        hello: JSON body of the request, {"versions": [...], "capabilities": [...]}
+        return: negotiated version
+        """
+        client_versions = decode_json(hello).get("versions", [1])
+        common = set(client_versions).intersection(PROTOCOL_VERSIONS)
+        version = max(common) if common else 1
+
+        await connection.send_fmsg(encode_json({"version": version, "capabilities": self.__capabilities(),
+                                                "free_connections": max(0, self.max_connections - len(self.clients))}))
+        return version
+
+    async def __handle_client_v2(self, connection: AsyncConnection, client_name: str) -> None:
+        """
+        Logic to handle a client connection after negotiating v2
+
+        Requests are handled concurrently, every response carries the ID of its request
+        so replies may go out in a different order than the requests came in
         """
-        client_socket.settimeout(1200)
-        connection = Connection(client_socket)
+        active_streams: dict[int, asyncio.Event] = {}   # stop events of this client's preview streams
+        requests: set[asyncio.Task] = set()
+
         try:
             while self.isRunning():
+                frame = await connection.recv_frame()
 
-                request = connection.recv_fmsg()
-                request_type = RequestType(int.from_bytes(request, "little"))
-                
-                self.__log(INFO, f"from {client_name} received request: {request_type.name} ")
-                if request_type == RequestType.CHECK_CONNECTED:
-                    connection.send_fmsg(b"")
-
-                elif request_type in [RequestType.CAPTURE_PREVIEW, RequestType.CAPTURE_MAIN]:
-                    try:
-                        fpath = self.imagerCtl.capture_main() \
-                                if request_type == RequestType.CAPTURE_MAIN else \
-                                self.imagerCtl.capture_preview()
-                                
-                        connection.send_file(fpath)
+                if frame.kind != MessageKind.REQUEST:
+                    continue
 
-                    except CaptureFailed:
-                        self.__log(ERROR, f"failed to capture image")
+                try:
+                    request_type = frame.request_type
+                except ValueError:
+                    await connection.send_frame(MessageKind.RESPONSE, Status.BAD_REQUEST, frame.request_id)
+                    continue
 
-                        connection.send_fmsg(b"")
+                self.__log(INFO, f"from {client_name} received request {frame.request_id}: {request_type.name}")
 
-                elif request_type == RequestType.POWER_OFF:
-                    self.running = False
+                if request_type == RequestType.POWER_OFF:
+                    self.__power_off()
                     break
 
+                task = asyncio.create_task(self.__handle_request_v2(connection, frame, client_name, active_streams))
+                requests.add(task)
+                task.add_done_callback(requests.discard)
+        finally:
+            for stop in list(active_streams.values()):
+                stop.set()
+            for task in list(requests):
+                task.cancel()
+            await asyncio.gather(*requests, return_exceptions=True)
+
+    async def __handle_request_v2(self, connection: AsyncConnection, frame: Frame, client_name: str, active_streams: dict[int, asyncio.Event]) -> None:
+        """Handles a single v2 request and sends its response"""
+        request_type = frame.request_type
+        try:
+            if request_type == RequestType.CHECK_CONNECTED:
+                await connection.send_frame(MessageKind.RESPONSE, Status.OK, frame.request_id)
+
+            elif request_type in [RequestType.CAPTURE_PREVIEW, RequestType.CAPTURE_MAIN]:
+                await self.__capture_v2(connection, frame)
+
+            elif request_type == RequestType.START_PREVIEW_STREAM:
+                await self.__stream_preview(connection, frame, active_streams)
+
+            elif request_type == RequestType.CAPTURE_SERIES:
+                await self.__capture_series(connection, frame)
+
+            elif request_type == RequestType.RESUME_TRANSFER:
+                params = decode_json(frame.body)
+                transfer = self.transfers.get(params.get("transfer_id"))
+                offset = params.get("offset", 0)
+
+                if transfer is None:
+                    await connection.send_frame(MessageKind.RESPONSE, Status.FAILED, frame.request_id)
+                elif not isinstance(offset, int) or not 0 <= offset <= transfer.size:
+                    await connection.send_frame(MessageKind.RESPONSE, Status.BAD_REQUEST, frame.request_id)
+                else:
+                    self.__log(INFO, f"{client_name} resumes transfer {transfer.transfer_id} at {offset}/{transfer.size}")
+                    await self.__send_transfer(connection, frame.request_id, transfer, offset)
+
+            elif request_type == RequestType.FETCH_RANGE:
+                await self.__send_range(connection, frame)
+
+            elif request_type == RequestType.LIST_CAPTURES:
+                captures = [capture.report() for capture in self.recent.list_captures()]
+                await connection.send_frame(MessageKind.RESPONSE, Status.OK, frame.request_id, encode_json({"captures": captures}))
+
+            elif request_type == RequestType.FETCH_CAPTURE:
+                await self.__fetch_capture(connection, frame)
+
+            elif request_type == RequestType.CALIBRATE:
+                await self.__calibrate(connection, frame)
+
+            elif request_type == RequestType.INVALIDATE_CALIBRATION:
+                self.imagerCtl.invalidate_calibration()
+                await connection.send_frame(MessageKind.RESPONSE, Status.OK, frame.request_id)
+
+            elif request_type in [RequestType.LIST_SPOOL, RequestType.FETCH_SPOOLED, RequestType.ACK_SPOOLED] and self.spool is None:
+                await connection.send_frame(MessageKind.RESPONSE, Status.UNSUPPORTED, frame.request_id)
+
+            elif request_type == RequestType.LIST_SPOOL:
+                captures = [entry.report() for entry in self.spool.list_entries()] # type: ignore
+                await connection.send_frame(MessageKind.RESPONSE, Status.OK, frame.request_id,
+                                            encode_json({**self.spool.report(), "captures": captures})) # type: ignore
+
+            elif request_type == RequestType.FETCH_SPOOLED:
+                await self.__fetch_spooled(connection, frame)
+
+            elif request_type == RequestType.ACK_SPOOLED:
+                spool_ids = decode_json(frame.body).get("spool_ids", [])
+                acked = self.spool.ack(spool_ids) # type: ignore
+                if acked:
+                    self.__log(INFO, f"{client_name} acknowledged {len(acked)} spooled capture(s)")
+                await connection.send_frame(MessageKind.RESPONSE, Status.OK, frame.request_id, encode_json({"acked": acked}))
+
+            elif request_type == RequestType.ACK_SERIES:
+                params = decode_json(frame.body)
+                series = self.series.get(params.get("series_id")) # type: ignore
+                acked = series.ack(params.get("indices", [])) if series is not None else []
+                await connection.send_frame(MessageKind.RESPONSE, Status.OK if series is not None else Status.FAILED,
+                                            frame.request_id, encode_json({"acked": acked}))
+
+            elif request_type == RequestType.ACK_TRANSFER:
+                acked = self.transfers.ack(decode_json(frame.body).get("transfer_id"))
+                await connection.send_frame(MessageKind.RESPONSE, Status.OK if acked else Status.FAILED, frame.request_id)
+
+            elif request_type == RequestType.STOP_PREVIEW_STREAM:
+                stream_id = decode_json(frame.body).get("stream_id")
+                for request_id, stop in list(active_streams.items()):
+                    if stream_id is None or stream_id == request_id:
+                        stop.set()
+
+                await connection.send_frame(MessageKind.RESPONSE, Status.OK, frame.request_id)
+
+            else:
+                await connection.send_frame(MessageKind.RESPONSE, Status.UNSUPPORTED, frame.request_id)
+
+        except asyncio.CancelledError:
+            raise
+
         except Exception as e:
-            self.__log(ERROR, f"{client_name} thread raised {e}")
+            self.__log(ERROR, f"{client_name} request {frame.request_id} raised {e}")
+
+    async def __capture_v2(self, connection: AsyncConnection, frame: Frame) -> None:
+        """
+        Queues a capture and sends the image once the camera worker has taken it
+
+        A META message with the queue position is sent on queueing, and one with the
+        queue and capture times, the capture's phases (see CaptureJob.report) and the
+        capture_id it can be fetched again with (see __fetch_capture) before the RESPONSE
+
+        In chunked mode the image is sent by __send_transfer and kept until the client sends
+        ACK_TRANSFER, so an interrupted transfer can be resumed with RESUME_TRANSFER
+
+        In parallel mode the image is kept like in chunked mode, but only announced: the RESPONSE body is
+        {"transfer_id", "size"} and the client fetches byte ranges with FETCH_RANGE, over several connections
+
+        In stream mode the image is sent by __stream_capture while it is encoded
+
+        A dual main capture also sends a small preview made from the same exposure, see __send_preview,
+        ahead of everything else about the image; it cannot be combined with stream mode
+
+        frame: capture request, body {"priority": int, "roi": [left, top, right, bottom], "size": [width, height],
+               "quality": int, "gray": bool, "preview": bool | [width, height], "chunked": bool, "parallel": bool,
+               "stream": bool}, all optional (priority: lower runs first, see CaptureOptions for roi, size, quality,
+               gray and preview)
+        """
+        params = decode_json(frame.body)
+        uncropped = MAIN_SETTINGS if frame.request_type == RequestType.CAPTURE_MAIN else PREVIEW_SETTINGS
+        try:
+            options = CaptureOptions.from_params(params, uncropped)
+        except (ValueError, TypeError):
+            await connection.send_frame(MessageKind.RESPONSE, Status.BAD_REQUEST, frame.request_id)
+            return
+
+        dual = options is not None and options.preview is not None
+        if dual and (frame.request_type != RequestType.CAPTURE_MAIN or params.get("stream")):
+            await connection.send_frame(MessageKind.RESPONSE, Status.BAD_REQUEST, frame.request_id)
+            return
+
+        if params.get("stream"):
+            await self.__stream_capture(connection, frame, params.get("priority"), options)
+            return
+
+        loop = asyncio.get_running_loop()
+        preview: Optional[asyncio.Future] = loop.create_future() if dual else None
+        on_preview = None
+        if preview is not None:
+            on_preview = lambda image: loop.call_soon_threadsafe(lambda: preview.done() or preview.set_result(image))
+
+        job = self.scheduler.submit(frame.request_type, params.get("priority"), options, on_preview=on_preview)
+        await connection.send_frame(MessageKind.META, Status.OK, frame.request_id,
+                                    encode_json({"queue_position": job.position, "queue_depth": self.scheduler.depth()}))
+        sender = asyncio.create_task(self.__send_preview(connection, frame.request_id, job, preview)) if preview is not None else None
+        transfer = None
+        try:
+            try:
+                fpath = await job.future
+            finally:
+                # the preview is passed on before the job completes, so it is sent (or never comes) by now
+                if preview is not None and not preview.done():
+                    preview.cancel()
+                if sender is not None:
+                    await asyncio.gather(sender, return_exceptions=True)
+            report = job.report()
+
+            # linking (or copying, off tmpfs) the capture is file I/O, kept off the event loop
+            recent = await asyncio.get_running_loop().run_in_executor(None, self.recent.add, job.sequence, frame.request_type, fpath)
+            if recent is not None:
+                report["capture_id"] = recent.capture_id
+            await connection.send_frame(MessageKind.META, Status.OK, frame.request_id, encode_json(report))
+
+            if params.get("parallel"):
+                transfer = self.transfers.add(fpath)
+                await connection.send_frame(MessageKind.RESPONSE, Status.OK, frame.request_id, encode_json(transfer.report()))
+            elif params.get("chunked"):
+                transfer = self.transfers.add(fpath)
+                await self.__send_transfer(connection, frame.request_id, transfer, 0)
+            else:
+                await connection.send_frame_file(MessageKind.RESPONSE, Status.OK, frame.request_id, fpath)
+
+        except CaptureFailed:
+            self.__log(ERROR, f"failed to capture image")
+
+            await connection.send_frame(MessageKind.META, Status.OK, frame.request_id, encode_json(job.report()))
+            await connection.send_frame(MessageKind.RESPONSE, Status.FAILED, frame.request_id)
+
+        finally:
+            if transfer is None:
+                self.scheduler.release(job)
+
+    async def __send_preview(self, connection: AsyncConnection, request_id: int, job: CaptureJob, preview: asyncio.Future) -> None:
+        """
+        Sends the preview of a dual capture as soon as the camera worker has made it, while the main image is still encoded
+
+        A META message {"preview": bytes, "preview_s"} announces it, preview_s being the seconds from the start of the
+        capture to the preview, and a DATA message holds the JPEG
+        """
+        image = await preview
+        meta = {"preview": len(image), "preview_s": time.monotonic() - (job.started_at or job.queued_at)}
+        if await connection.send_frame(MessageKind.META, Status.OK, request_id, encode_json(meta)):
+            await connection.send_frame(MessageKind.DATA, Status.OK, request_id, image)
+
+    async def __calibrate(self, connection: AsyncConnection, frame: Frame) -> None:
+        """
+        Queues a calibration on the camera worker, ahead of queued captures so they already reuse it
+
+        The RESPONSE body is the calibration {"lens_position", "exposure_time", "analogue_gain", "colour_gains"}
+        with the job's timing (see CaptureJob.report)
+        """
+        job = self.scheduler.submit(RequestType.CALIBRATE)
+        try:
+            calibration = await job.future
+        except CaptureFailed:
+            await connection.send_frame(MessageKind.RESPONSE, Status.FAILED, frame.request_id, encode_json(job.report()))
+            return
+
+        await connection.send_frame(MessageKind.RESPONSE, Status.OK, frame.request_id,
+                                    encode_json({**calibration.report(), **job.report()}))
+
+    async def __stream_capture(self, connection: AsyncConnection, frame: Frame, priority: Optional[int], options: Optional[CaptureOptions]) -> None:
+        """
+        Queues a capture whose encoder output is sent as DATA messages while it is produced, no file is written
+
+        The META message with the capture's report (see CaptureJob.report) follows the last DATA message and
+        adds the image's "size" and "send_s", the time from the first chunk to the last one being sent.
+        The RESPONSE has no body; if it is FAILED the DATA received so far is no image. Streamed captures
+        are not kept for FETCH_CAPTURE
+        """
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue[Optional[bytes]] = asyncio.Queue()
+
+        job = self.scheduler.submit(frame.request_type, priority, options,
+                                    on_chunk=lambda chunk: loop.call_soon_threadsafe(chunks.put_nowait, chunk))
+        await connection.send_frame(MessageKind.META, Status.OK, frame.request_id,
+                                    encode_json({"queue_position": job.position, "queue_depth": self.scheduler.depth()}))
+
+        sender = asyncio.create_task(self.__send_chunks(connection, frame.request_id, chunks))
+        status = Status.OK
+        try:
+            await job.future
+        except CaptureFailed:
+            self.__log(ERROR, f"failed to capture image")
+            status = Status.FAILED
+        finally:
+            # chunks are queued from the camera worker before the job completes, so this ends the stream
+            chunks.put_nowait(None)
+
+        size, send_s = await sender
+        if size is None:
+            return
+
+        await connection.send_frame(MessageKind.META, Status.OK, frame.request_id,
+                                    encode_json({**job.report(), "size": size, "send_s": send_s}))
+        await connection.send_frame(MessageKind.RESPONSE, status, frame.request_id)
+
+    async def __send_chunks(self, connection: AsyncConnection, request_id: int,
+                            chunks: asyncio.Queue[Optional[bytes]]) -> tuple[Optional[int], float]:
+        """
+        Sends the chunks of a streamed capture as DATA messages until None is queued
+
+        return: bytes sent (None if the connection failed) and seconds from the first chunk to the end
+        """
+        size = 0
+        started = None
+        failed = False
+        while (chunk := await chunks.get()) is not None:
+            if started is None:
+                started = time.monotonic()
+            # keep draining after a failure, the camera worker still produces the rest of the image
+            if not failed and not await connection.send_frame(MessageKind.DATA, Status.OK, request_id, chunk):
+                failed = True
+            size += len(chunk)
+
+        return None if failed else size, time.monotonic() - started if started is not None else 0
+
+    async def __fetch_capture(self, connection: AsyncConnection, frame: Frame) -> None:
+        """
+        Sends a recent capture again, or a downscaled variant of it, without touching the camera
+
+        The response is sent like the one of a capture, in chunked mode as a resumable transfer
+
+        frame: FETCH_CAPTURE request, body {"capture_id": int, "size": [width, height], "quality": int, "chunked": bool},
+               the variant fits within size and is only made if size is given
+        """
+        params = decode_json(frame.body)
+        capture = self.recent.get(params.get("capture_id"))
+
+        if capture is None:
+            await connection.send_frame(MessageKind.RESPONSE, Status.FAILED, frame.request_id)
+            return
+
+        try:
+            options = CaptureOptions.from_params({"size": params.get("size"), "quality": params.get("quality")})
+        except (ValueError, TypeError):
+            await connection.send_frame(MessageKind.RESPONSE, Status.BAD_REQUEST, frame.request_id)
+            return
+
+        try:
+            if options is not None and options.size is not None:
+                fpath = await self.__variant(capture, options.size, options.quality or VARIANT_QUALITY)
+            else:
+                fpath = await asyncio.get_running_loop().run_in_executor(None, self.recent.checkout, capture.path)
+        except Exception as e:  # e.g. the capture was dropped while its variant was made
+            self.__log(ERROR, f"could not fetch capture {capture.capture_id}: {e}")
+            await connection.send_frame(MessageKind.RESPONSE, Status.FAILED, frame.request_id)
+            return
+
+        if params.get("chunked"):
+            await self.__send_transfer(connection, frame.request_id, self.transfers.add(fpath), 0)
+            return
+
+        try:
+            await connection.send_frame_file(MessageKind.RESPONSE, Status.OK, frame.request_id, fpath)
+        finally:
+            fpath.unlink(missing_ok=True)
+
+    async def __fetch_spooled(self, connection: AsyncConnection, frame: Frame) -> None:
+        """
+        Sends a spooled capture, like a capture (in chunked mode as a resumable transfer), it stays spooled until acknowledged
+
+        frame: FETCH_SPOOLED request, body {"spool_id": int, "chunked": bool}
+        """
+        params = decode_json(frame.body)
+        entry = self.spool.get(params.get("spool_id")) # type: ignore
+
+        try:
+            fpath = self.spool.checkout(entry) if entry is not None else None # type: ignore
+        except FileNotFoundError:   # acknowledged or dropped by the quota since it was looked up
+            fpath = None
+
+        if fpath is None:
+            await connection.send_frame(MessageKind.RESPONSE, Status.FAILED, frame.request_id)
+            return
+
+        await connection.send_frame(MessageKind.META, Status.OK, frame.request_id, encode_json(entry.report())) # type: ignore
+
+        if params.get("chunked"):
+            await self.__send_transfer(connection, frame.request_id, self.transfers.add(fpath), 0)
+            return
+
+        try:
+            await connection.send_frame_file(MessageKind.RESPONSE, Status.OK, frame.request_id, fpath)
+        finally:
+            fpath.unlink(missing_ok=True)
+
+    async def __variant(self, capture: RecentCapture, size: tuple[int, int], quality: int) -> Path:
+        """Checks out the downscaled variant of capture, made in the executor unless it was made before"""
+        async with self.variant_lock:
+            variant = capture.variants.get((size[0], size[1], quality))
+            loop = asyncio.get_running_loop()
+            if variant is not None:
+                return await loop.run_in_executor(None, self.recent.checkout, variant)
+
+            variant = self.recent.variant_path(capture, size, quality)
+            await loop.run_in_executor(None, make_variant, capture.path, variant, size, quality)
+
+            checkout = await loop.run_in_executor(None, self.recent.checkout, variant)
+            self.recent.add_variant(capture, size, quality, variant)
+            return checkout
+
+    async def __send_transfer(self, connection: AsyncConnection, request_id: int, transfer: Transfer, offset: int) -> None:
+        """
+        Sends a transfer from offset on as checksummed chunks
+
+        A META message {"transfer_id", "size", "offset"} announces the chunks, the RESPONSE
+        {"transfer_id", "size", "send_s"} follows the last one
+        """
+        await connection.send_frame(MessageKind.META, Status.OK, request_id, encode_json({**transfer.report(), "offset": offset}))
+
+        started = time.monotonic()
+        if await connection.send_file_chunks(request_id, transfer.path, offset):
+            await connection.send_frame(MessageKind.RESPONSE, Status.OK, request_id,
+                                        encode_json({**transfer.report(), "send_s": time.monotonic() - started}))
+
+    async def __send_range(self, connection: AsyncConnection, frame: Frame) -> None:
+        """
+        Sends a byte range of a transfer as checksummed chunks, then a RESPONSE {"transfer_id", "offset", "length", "send_s"}
+
+        The transfer stays until ACK_TRANSFER, so ranges of it can be fetched (again) from any connection
+
+        frame: FETCH_RANGE request, body {"transfer_id": int, "offset": int, "length": int}
+        """
+        params = decode_json(frame.body)
+        transfer = self.transfers.get(params.get("transfer_id"))
+        offset, length = params.get("offset"), params.get("length")
+
+        if transfer is None:
+            await connection.send_frame(MessageKind.RESPONSE, Status.FAILED, frame.request_id)
+            return
+        if not isinstance(offset, int) or not isinstance(length, int) or offset < 0 or length < 0 or offset + length > transfer.size:
+            await connection.send_frame(MessageKind.RESPONSE, Status.BAD_REQUEST, frame.request_id)
+            return
+
+        started = time.monotonic()
+        if await connection.send_file_chunks(frame.request_id, transfer.path, offset, length=length):
+            await connection.send_frame(MessageKind.RESPONSE, Status.OK, frame.request_id,
+                                        encode_json({"transfer_id": transfer.transfer_id, "offset": offset, "length": length,
+                                                     "send_s": time.monotonic() - started}))
+
+    async def __stream_preview(self, connection: AsyncConnection, frame: Frame, active_streams: dict[int, asyncio.Event]) -> None:
+        """
+        Sends preview frames as DATA messages until the stream is stopped, then completes the request
+
+        Frames are sent at most at the requested fps; only the newest frame is held for the stream until the
+        previous one has been sent, so frames are dropped rather than queued when the link falls behind.
+        Frames are handed over to the event loop by the stream's reader thread, so no executor thread waits for them
+
+        frame: START_PREVIEW_STREAM request, body {"fps": float}
+        """
+        loop = asyncio.get_running_loop()
+        fps = min(max(float(decode_json(frame.body).get("fps", 5)), 0.1), MAX_PREVIEW_FPS)
+        stop = asyncio.Event()
+        active_streams[frame.request_id] = stop
+
+        newest: asyncio.Queue[bytes] = asyncio.Queue(maxsize=1)
+        def put_newest(jpeg: bytes) -> None:
+            if newest.full():
+                newest.get_nowait()
+            newest.put_nowait(jpeg)
+
+        listener = lambda sequence, jpeg: loop.call_soon_threadsafe(put_newest, jpeg)
+        self.preview_stream.add_listener(listener)
+        await loop.run_in_executor(None, self.preview_stream.subscribe)
+        try:
+            while not stop.is_set() and self.isRunning():
+                started = time.monotonic()
+
+                try:
+                    jpeg = await asyncio.wait_for(newest.get(), 1)
+                except asyncio.TimeoutError:
+                    continue
+
+                if not await connection.send_frame(MessageKind.DATA, Status.OK, frame.request_id, jpeg):
+                    return
+
+                try:
+                    await asyncio.wait_for(stop.wait(), max(0, 1 / fps - (time.monotonic() - started)))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            active_streams.pop(frame.request_id, None)
+            self.preview_stream.remove_listener(listener)
+            await asyncio.shield(loop.run_in_executor(None, self.preview_stream.unsubscribe))
+
+        await connection.send_frame(MessageKind.RESPONSE, Status.OK, frame.request_id)
+
+    async def __capture_series(self, connection: AsyncConnection, frame: Frame) -> None:
+        """
+        Starts a time-lapse series, or re-attaches to one, and sends its frames as they are captured
+
+        Each frame is sent as a META message {"series_id", "index", "captured_at"} followed by a DATA
+        message holding the JPEG. The series runs on the server independently of this request: if the
+        client goes away, frames stay buffered on the imager until a client re-attaches with the series_id
+
+        Each frame's META also holds its file "suffix" (".jpg", or ".png" for lossless gray frames)
+
+        Without a spool, a sent frame stays buffered until the client acknowledges its index with ACK_SERIES
+        {"series_id", "indices"}; the RESPONSE only follows once every frame was acknowledged
+
+        With a spool, frames are kept there as well: their META also holds "spool_id" and "sha256", the client
+        acknowledges them with ACK_SPOOLED once stored, and frames acknowledged before they were sent are skipped
+
+        Re-attaching takes the series over from a request still attached to it, e.g. one on a half-open
+        connection that has not been noticed yet, and sends the frames left unacknowledged again. A series that
+        is not (or no longer) held is answered with FAILED {"reason": "unknown"}
+
+        frame: CAPTURE_SERIES request, body {"interval": float, "count": int, "resolution": "main" | "preview"}
+               plus the optional capture options of __capture_v2, or {"series_id": int} to re-attach
+        """
+        params = decode_json(frame.body)
+
+        if "series_id" in params:
+            series = self.series.get(params["series_id"])
+            if series is None:
+                await connection.send_frame(MessageKind.RESPONSE, Status.FAILED, frame.request_id, encode_json({"reason": "unknown"}))
+                return
+
+            stale = series.sender
+            if stale is not None and not stale.done():
+                self.__log(INFO, f"series {series.series_id} re-attached, dropping the request still attached to it")
+                stale.cancel()
+                await asyncio.gather(stale, return_exceptions=True)
+
+            # frames sent before the drop may have died in the old link, the client skips those it already stored
+            series.resend_unacked()
+        else:
+            try:
+                interval = max(float(params["interval"]), MIN_SERIES_INTERVAL)
+                count = int(params["count"])
+                request_type = RequestType.CAPTURE_PREVIEW if params.get("resolution", "main") == "preview" else RequestType.CAPTURE_MAIN
+                uncropped = MAIN_SETTINGS if request_type == RequestType.CAPTURE_MAIN else PREVIEW_SETTINGS
+                options = CaptureOptions.from_params(params, uncropped)
+            except (KeyError, ValueError, TypeError):
+                await connection.send_frame(MessageKind.RESPONSE, Status.BAD_REQUEST, frame.request_id)
+                return
+
+            series = self.__start_series(request_type, interval, count, options)
+
+        await connection.send_frame(MessageKind.META, Status.OK, frame.request_id, encode_json(series.report()))
+
+        series.sender = asyncio.current_task()
+        try:
+            while True:
+                series_frame = await series.next_frame()
+                if series_frame is None:
+                    break
+
+                fpath = series_frame.path
+                meta = {"series_id": series.series_id, "index": series_frame.index, "captured_at": series_frame.captured_at,
+                        "suffix": series_frame.path.suffix}
+                if series_frame.spool_id is not None:
+                    entry = self.spool.get(series_frame.spool_id) if self.spool is not None else None
+                    try:
+                        fpath = self.spool.checkout(entry) if entry is not None else None # type: ignore
+                    except FileNotFoundError:
+                        fpath = None
+                    if fpath is None:   # acknowledged (pulled from the spool) or dropped by the quota meanwhile
+                        series.delivered(series_frame)
+                        continue
+                    meta.update(spool_id=entry.spool_id, sha256=entry.sha256)
+
+                try:
+                    if not await connection.send_frame(MessageKind.META, Status.OK, frame.request_id, encode_json(meta)):
+                        return
+                    if not await connection.send_frame_file(MessageKind.DATA, Status.OK, frame.request_id, fpath):
+                        return
+                finally:
+                    if fpath != series_frame.path:
+                        fpath.unlink(missing_ok=True)
+
+                series.delivered(series_frame)
+        finally:
+            if series.sender is asyncio.current_task():
+                series.sender = None
+
+        self.series.pop(series.series_id, None)
+        series.remove()
+
+        await connection.send_frame(MessageKind.RESPONSE, Status.OK, frame.request_id, encode_json(series.report()))
+
+    def __start_series(self, request_type: RequestType, interval: float, count: int, options: Optional[CaptureOptions]) -> CaptureSeries:
+        """Registers a series and starts capturing it"""
+        series_id = next(self.series_ids)
+        series = CaptureSeries(series_id, request_type, interval, count, self.scheduler.output_dir / f"series_{series_id}", options)
+        series.directory.mkdir(parents=True, exist_ok=True)
+        self.series[series_id] = series
+
+        task = asyncio.create_task(self.__run_series(series))
+        self.series_tasks.add(task)
+        task.add_done_callback(self.series_tasks.discard)
+
+        self.__log(INFO, f"started series {series_id}: {count} x {request_type.name} every {interval}s")
+        return series
+
+    async def __run_series(self, series: CaptureSeries) -> None:
+        """
+        Submits the captures of a series on an absolute schedule
+
+        Capture i is queued at start + i * interval, so capture, encode and transfer times never
+        shift later captures. Captures are collected by separate tasks, a slow capture only delays
+        the ones queued behind it in the scheduler
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        collectors = []
+        try:
+            for index in range(series.count):
+                await asyncio.sleep(max(0, start + index * series.interval - loop.time()))
+                job = self.scheduler.submit(series.request_type, options=series.options)
+                collectors.append(asyncio.create_task(self.__collect_series_frame(series, index, job)))
+
+            await asyncio.gather(*collectors)
+        finally:
+            for collector in collectors:
+                collector.cancel()
+            series.finish()
+            self.__log(INFO, f"series {series.series_id} finished: {series.captured} captured, {series.failed} failed")
+            self.__expire_series(series)
+
+    def __expire_series(self, series: CaptureSeries) -> None:
+        """
+        Forgets a finished series nobody is attached to once it is fully delivered or series_ttl has passed,
+        checks again later otherwise (its spooled frames stay in the spool)
+        """
+        if self.series.get(series.series_id) is not series:
+            return
+
+        loop = asyncio.get_running_loop()
+        remaining = series.finished_at + self.series_ttl - loop.time() # type: ignore
+        if not series.is_attached() and (series.is_complete() or remaining <= 0):
+            if series.buffered():
+                self.__log(WARN, f"series {series.series_id} was not collected, dropping {series.buffered()} buffered frame(s)")
+            self.series.pop(series.series_id, None)
+            series.remove()
+            return
+
+        # an attached client is given a while longer to finish
+        loop.call_later(max(remaining, min(self.series_ttl, 60)), self.__expire_series, series)
+
+    async def __collect_series_frame(self, series: CaptureSeries, index: int, job: CaptureJob) -> None:
+        """Moves a finished capture into the spool, or into the buffer of its series if there is no room or no spool"""
+        try:
+            fpath = await job.future
+            if self.spool is not None:
+                try:
+                    entry = await asyncio.get_running_loop().run_in_executor(None, self.spool.add, fpath, series.series_id, index)
+                except OSError as e:
+                    entry = None
+                    self.__log(ERROR, f"could not spool frame {index} of series {series.series_id}: {e}")
+
+                if entry is not None:
+                    series.add_frame(index, self.spool.path(entry), entry.spool_id, entry.sha256)
+                    return
+                self.__log(WARN, f"spool full, frame {index} of series {series.series_id} is only kept until delivered")
+
+            path = series.directory / f"{index:05d}{fpath.suffix}"
+            fpath.replace(path)
+            series.add_frame(index, path)
+
+        except CaptureFailed:
+            self.__log(ERROR, f"failed to capture frame {index} of series {series.series_id}")
+            series.add_failure()
 
         finally:
-            connection.close()
\ No newline at end of file
+            self.scheduler.release(job)
@@ -0,0 +1,228 @@
+import io
+import time
+import threading
+import subprocess
+
+from typing import Optional, Callable
+from contextlib import contextmanager
+
+JPEG_SOI = b"\xff\xd8"  # start of image marker
+JPEG_EOI = b"\xff\xd9"  # end of image marker
+
+READ_SIZE = 1 << 16
+
+class FrameSource:
+    """
+    Produces a continuous series of JPEG frames
+    """
+    def start(self) -> None:
+        """Starts producing frames"""
+        raise NotImplementedError
+
+    def stop(self) -> None:
+        """Stops producing frames, read_frame returns None afterwards"""
+        raise NotImplementedError
+
+    def read_frame(self) -> Optional[bytes]:
+        """Blocks until the next frame is available, None once the source has stopped"""
+        raise NotImplementedError
+
+class MjpegFrameSource(FrameSource):
+    def __init__(self, width: int = 1014, height: int = 760, framerate: int = 15) -> None:
+        """
+        Frame source backed by one long-lived rpicam-vid process writing MJPEG to stdout
+
+        width, height: resolution of the frames
+        framerate: rate at which the camera produces frames
+        """
+        self.width = width
+        self.height = height
+        self.framerate = framerate
+        self.process: Optional[subprocess.Popen] = None
+        self.buffer = bytearray()
+
+    def start(self) -> None:
+        self.buffer = bytearray()
+        self.process = subprocess.Popen(["rpicam-vid",
+                                         "-t", "0", "-n",
+                                         "--codec", "mjpeg",
+                                         "--width", str(self.width),
+                                         "--height", str(self.height),
+                                         "--framerate", str(self.framerate),
+                                         "--autofocus-mode", "continuous",
+                                         "-o", "-"],
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL)
+
+    def stop(self) -> None:
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+
+    def read_frame(self) -> Optional[bytes]:
+        process = self.process
+        if process is None or process.stdout is None:
+            return None
+
+        while True:
+            start = self.buffer.find(JPEG_SOI)
+            if start >= 0:
+                end = self.buffer.find(JPEG_EOI, start + 2)
+                if end >= 0:
+                    frame = bytes(self.buffer[start:end + 2])
+                    del self.buffer[:end + 2]
+                    return frame
+
+            chunk = process.stdout.read1(READ_SIZE) # type: ignore
+            if not chunk:
+                return None
+            self.buffer += chunk
+
+class FakeFrameSource(FrameSource):
+    def __init__(self, framerate: float = 15, frame_count: int = 3, size: tuple[int, int] = (320, 240)) -> None:
+        """
+        Deterministic frame source for tests, cycles through frame_count solid colour JPEGs
+
+        framerate: rate at which frames are produced
+        """
+        from PIL import Image
+
+        self.interval = 1 / framerate
+        self.frames: list[bytes] = []
+        for i in range(frame_count):
+            buffer = io.BytesIO()
+            Image.new("RGB", size, color=(40 * i % 256, 80, 160)).save(buffer, "JPEG")
+            self.frames.append(buffer.getvalue())
+
+        self.produced = 0
+        self.running = threading.Event()
+
+    def start(self) -> None:
+        self.running.set()
+
+    def stop(self) -> None:
+        self.running.clear()
+
+    def read_frame(self) -> Optional[bytes]:
+        time.sleep(self.interval)
+
+        if not self.running.is_set():
+            return None
+
+        frame = self.frames[self.produced % len(self.frames)]
+        self.produced += 1
+        return frame
+
+class PreviewStream:
+    def __init__(self, source: FrameSource) -> None:
+        """
+        Keeps a frame source running while it has subscribers
+
+        Only the newest frame is kept, readers that fall behind skip the frames in between
+
+        source: source of the frames
+        """
+        self.source = source
+        self.condition = threading.Condition()  # guards the latest-frame slot
+        self.control_lock = threading.Lock()    # guards starting and stopping the source
+
+        self.sequence = 0           # number of the newest frame
+        self.frame: Optional[bytes] = None
+        self.subscribers = 0
+        self.pauses = 0
+        self.reader: Optional[threading.Thread] = None
+        self.listeners: list[Callable[[int, bytes], None]] = []
+
+    def __read_frames(self) -> None:
+        """Moves frames from the source into the latest-frame slot until the source stops"""
+        while True:
+            frame = self.source.read_frame()
+            if frame is None:
+                break
+
+            with self.condition:
+                self.sequence += 1
+                self.frame = frame
+                self.condition.notify_all()
+                sequence = self.sequence
+
+            for listener in list(self.listeners):
+                listener(sequence, frame)
+
+    def __start_source(self) -> None:
+        self.source.start()
+        self.reader = threading.Thread(target=self.__read_frames, daemon=True)
+        self.reader.start()
+
+    def __stop_source(self) -> None:
+        self.source.stop()
+        if self.reader is not None:
+            self.reader.join(timeout=5)
+            self.reader = None
+
+        with self.condition:
+            self.frame = None
+            self.condition.notify_all()
+
+    def is_active(self) -> bool:
+        """True while the source should be producing frames"""
+        return self.subscribers > 0 and self.pauses == 0
+
+    def subscribe(self) -> None:
+        """Registers a reader, starts the source for the first one"""
+        with self.control_lock:
+            self.subscribers += 1
+            if self.subscribers == 1 and self.pauses == 0:
+                self.__start_source()
+
+    def unsubscribe(self) -> None:
+        """Unregisters a reader, stops the source after the last one"""
+        with self.control_lock:
+            self.subscribers -= 1
+            if self.subscribers == 0 and self.pauses == 0:
+                self.__stop_source()
+
+    @contextmanager
+    def paused(self):
+        """Releases the camera for the duration of the block (e.g. for a still capture)"""
+        with self.control_lock:
+            self.pauses += 1
+            if self.pauses == 1 and self.subscribers > 0:
+                self.__stop_source()
+        try:
+            yield
+        finally:
+            with self.control_lock:
+                self.pauses -= 1
+                if self.pauses == 0 and self.subscribers > 0:
+                    self.__start_source()
+
+    def add_listener(self, listener: Callable[[int, bytes], None]) -> None:
+        """
+        Passes every new frame to listener, with its frame number, instead of having a thread wait for it
+
+        listener: called from the reader thread, must not block
+        """
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[int, bytes], None]) -> None:
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def wait_frame(self, after: int, timeout: float = 1) -> Optional[tuple[int, bytes]]:
+        """
+        Waits for a frame newer than frame number after
+
+        return: (frame number, frame) or None on timeout
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence > after and self.frame is not None, timeout=timeout)
+
+            if self.sequence <= after or self.frame is None:
+                return None
+
+            return self.sequence, self.frame
@@ -0,0 +1,139 @@
+import os
+import time
+import shutil
+import itertools
+import threading
+
+from typing import Optional
+from pathlib import Path
+from dataclasses import dataclass, field
+
+from src.connections import RequestType
+from src.Imager.cameraBackends import save_gray
+
+RECENT_CAPTURE_COUNT = 16           # captures kept for re-fetching
+RECENT_CAPTURE_BYTES = 256 << 20    # bytes of captures and their variants kept, the directory is on tmpfs
+VARIANT_QUALITY = 85                # JPEG quality of downscaled variants unless asked otherwise
+
+@dataclass
+class RecentCapture:
+    capture_id: int
+    request_type: RequestType
+    path: Path
+    size: int
+    captured_at: float                                          # unix time
+    variants: dict[tuple[int, int, int], Path] = field(default_factory=dict)   # (width, height, quality) -> file
+
+    def bytes(self) -> int:
+        """Bytes the capture and its variants take up"""
+        return self.size + sum(variant.stat().st_size for variant in self.variants.values() if variant.exists())
+
+    def report(self) -> dict:
+        return {"capture_id": self.capture_id, "type": self.request_type.name, "size": self.size, "captured_at": self.captured_at}
+
+def link_or_copy(source: Path, target: Path) -> None:
+    """Hard links source to target (no copy on the same filesystem), copies if linking is not possible"""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+def make_variant(source: Path, output: Path, size: tuple[int, int], quality: int) -> None:
+    """
+    Writes a downscaled copy of source that fits within size (blocking), gray captures stay gray (PNGs lossless)
+
+    JPEGs are decoded at the smallest DCT scale still covering size, so the full frame is never decoded
+    """
+    from PIL import Image
+
+    with Image.open(source) as image:
+        image.draft("RGB", size)
+        image.thumbnail(size, Image.Resampling.LANCZOS)
+        if image.mode == "L":
+            save_gray(image, None if image.format == "PNG" else quality, output)
+        else:
+            image.convert("RGB").save(output, "JPEG", quality=quality)
+
+class RecentCaptures:
+    def __init__(self, directory: Path, max_count: int = RECENT_CAPTURE_COUNT, max_bytes: int = RECENT_CAPTURE_BYTES) -> None:
+        """
+        Ring buffer of the latest captures, so a client can fetch one again without touching the camera
+
+        The oldest captures are dropped once there are more than max_count or they (with their
+        variants) take up more than max_bytes. Files handed out by checkout are not counted,
+        their owner removes them. Files are linked in the caller's thread (the server's executor),
+        the bookkeeping is locked.
+
+        directory: directory the captures are kept in
+        """
+        self.directory = directory
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.captures: dict[int, RecentCapture] = {}    # oldest first
+        self.checkouts = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def add(self, capture_id: int, request_type: RequestType, path: Path) -> Optional[RecentCapture]:
+        """
+        Keeps a capture under capture_id, path itself stays with the caller
+
+        return: the kept capture, None if it is larger than max_bytes
+        """
+        size = path.stat().st_size
+        if size > self.max_bytes:
+            return None
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        kept = self.directory / f"{capture_id:06d}{path.suffix}"
+        link_or_copy(path, kept)
+
+        capture = RecentCapture(capture_id, request_type, kept, size, time.time())
+        with self.lock:
+            self.captures[capture_id] = capture
+            self.__evict()
+            return self.captures.get(capture_id)
+
+    def get(self, capture_id: int) -> Optional[RecentCapture]:
+        return self.captures.get(capture_id)
+
+    def list_captures(self) -> list[RecentCapture]:
+        """Kept captures, oldest first"""
+        with self.lock:
+            return list(self.captures.values())
+
+    def variant_path(self, capture: RecentCapture, size: tuple[int, int], quality: int) -> Path:
+        """File the downscaled variant of capture with given size and quality is written to"""
+        return self.directory / f"{capture.capture_id:06d}_{size[0]}x{size[1]}_q{quality}{capture.path.suffix}"
+
+    def add_variant(self, capture: RecentCapture, size: tuple[int, int], quality: int, path: Path) -> None:
+        """Keeps a variant written by make_variant for later fetches, dropped if the capture is gone meanwhile"""
+        with self.lock:
+            if self.captures.get(capture.capture_id) is not capture:
+                path.unlink(missing_ok=True)
+                return
+
+            capture.variants[(size[0], size[1], quality)] = path
+            self.__evict()
+
+    def checkout(self, path: Path) -> Path:
+        """Links path to a new file the caller owns, it stays intact even if the capture is dropped"""
+        checkout = self.directory / f"checkout_{next(self.checkouts):06d}{path.suffix}"
+        link_or_copy(path, checkout)
+        return checkout
+
+    def clear(self) -> None:
+        with self.lock:
+            for capture in list(self.captures.values()):
+                self.__drop(capture)
+
+    def __evict(self) -> None:
+        """Drops the oldest captures until count and bytes are within limits"""
+        while self.captures and (len(self.captures) > self.max_count or
+                                 sum(capture.bytes() for capture in self.captures.values()) > self.max_bytes):
+            self.__drop(next(iter(self.captures.values())))
+
+    def __drop(self, capture: RecentCapture) -> None:
+        self.captures.pop(capture.capture_id, None)
+        capture.path.unlink(missing_ok=True)
+        for variant in capture.variants.values():
+            variant.unlink(missing_ok=True)
@@ -0,0 +1,62 @@
+import socket
+
+from src.connections import SERVICE_TYPE, PROTOCOL_PORT, PROTOCOL_VERSIONS
+
+def local_addresses(ip: str) -> list[str]:
+    """IPv4 addresses the server can be reached at when listening on ip"""
+    if ip not in ["0.0.0.0", ""]:
+        return [ip]
+
+    import ifaddr
+
+    addresses = [address.ip for adapter in ifaddr.get_adapters() for address in adapter.ips
+                 if address.is_IPv4 and not address.ip.startswith("127.")]
+    return addresses or ["127.0.0.1"]
+
+class ServiceAdvertiser:
+    def __init__(self, ip: str, port: int) -> None:
+        """
+        Advertises the imager as a SERVICE_TYPE zeroconf service, so clients find it without resolving a hostname
+
+        The instance is named after the hostname (plus the port if it is not the protocol port),
+        zeroconf renames it if another imager already uses the name
+
+        ip: address the server listens on
+        port: port the server listens on
+        """
+        hostname = socket.gethostname().split(".")[0]
+        name = hostname if port == PROTOCOL_PORT else f"{hostname}-{port}"
+
+        self.zeroconf = None
+        self.info = None
+        self.name = name
+        self.ip = ip
+        self.port = port
+        self.hostname = hostname
+
+    async def start(self) -> None:
+        """Registers the service, raises if zeroconf is unavailable"""
+        from zeroconf import ServiceInfo, IPVersion
+        from zeroconf.asyncio import AsyncZeroconf
+
+        self.info = ServiceInfo(
+            SERVICE_TYPE,
+            f"{self.name}.{SERVICE_TYPE}",
+            port=self.port,
+            parsed_addresses=local_addresses(self.ip),
+            server=f"{self.hostname}.local.",
+            properties={"versions": ",".join(str(version) for version in PROTOCOL_VERSIONS)},
+        )
+        self.zeroconf = AsyncZeroconf(ip_version=IPVersion.V4Only)
+        await self.zeroconf.async_register_service(self.info, allow_name_change=True)   # several Pis may share a hostname
+
+    async def stop(self) -> None:
+        """Withdraws the service"""
+        if self.zeroconf is None:
+            return
+
+        try:
+            await self.zeroconf.async_unregister_service(self.info)
+        finally:
+            await self.zeroconf.async_close()
+            self.zeroconf = None
@@ -0,0 +1,56 @@
+import time
+import itertools
+
+from typing import Optional
+from pathlib import Path
+from dataclasses import dataclass
+
+TRANSFER_TTL = 900  # seconds an unacknowledged transfer is kept for resuming
+
+@dataclass
+class Transfer:
+    transfer_id: int
+    path: Path
+    size: int
+    created_at: float
+
+    def report(self) -> dict:
+        return {"transfer_id": self.transfer_id, "size": self.size}
+
+class TransferStore:
+    def __init__(self, ttl: float = TRANSFER_TTL) -> None:
+        """
+        Keeps captures sent in chunked mode until the client acknowledges them
+
+        ttl: seconds after which unacknowledged transfers are dropped
+        """
+        self.ttl = ttl
+        self.transfers: dict[int, Transfer] = {}
+        self.transfer_ids = itertools.count(1)
+
+    def add(self, path: Path) -> Transfer:
+        """Takes ownership of path until the transfer is acknowledged or expires"""
+        self.expire()
+
+        transfer = Transfer(next(self.transfer_ids), path, path.stat().st_size, time.monotonic())
+        self.transfers[transfer.transfer_id] = transfer
+        return transfer
+
+    def get(self, transfer_id: int) -> Optional[Transfer]:
+        return self.transfers.get(transfer_id)
+
+    def ack(self, transfer_id: int) -> bool:
+        """Drops an acknowledged transfer, False if it is unknown"""
+        transfer = self.transfers.pop(transfer_id, None)
+        if transfer is None:
+            return False
+
+        transfer.path.unlink(missing_ok=True)
+        return True
+
+    def expire(self) -> None:
+        """Drops transfers older than ttl"""
+        now = time.monotonic()
+        for transfer in list(self.transfers.values()):
+            if now - transfer.created_at > self.ttl:
+                self.ack(transfer.transfer_id)
@@ -1,46 +1,210 @@
+import os
+import json
+import zlib
+import hashlib
 import socket
+import asyncio
+import time
 import struct
+import threading
 
 from typing import Optional
 from pathlib import Path
 from enum import Enum
+from dataclasses import dataclass
 
-from src.exceptions import SocketReceivedBytesEmpty
+from src.exceptions import SocketReceivedBytesEmpty, MessageTooLarge
 
 PROTOCOL_PORT = 8888
+SERVICE_TYPE = "_petri-imager._tcp.local."   # zeroconf service type imagers advertise
 
 HEADER_FRMT = "!Q"
 HEADER_SIZE = struct.calcsize(HEADER_FRMT)
 
+FILE_CHUNK_SIZE = 1 << 20     # chunk size used when sendfile is not available
+PARTIAL_SUFFIX = ".part"      # downloads are written next to their target under this suffix until complete
+BULK_BUFFER_SIZE = 4 << 20    # socket buffer size requested for bulk transfers
+MAX_REQUEST_SIZE = 1 << 20    # largest message body an AsyncConnection accepts, requests carry small JSON bodies
+MAX_BODY_SIZE = 256 << 20     # largest body a Connection receives into memory, images kept in memory included
+
+KEEPALIVE_IDLE = 10         # seconds of silence before the kernel starts probing the peer
+KEEPALIVE_INTERVAL = 5      # seconds between probes
+KEEPALIVE_COUNT = 3         # unanswered probes before the connection is dropped
+
+# v2 frames: message kind, code (RequestType for requests, Status for responses), request ID, body size
+FRAME_HEADER_FRMT = "!BBIQ"
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER_FRMT)
+
+PROTOCOL_VERSIONS = [1, 2]
+
+# chunked transfers: every DATA body starts with the offset of its chunk in the file and the chunk's CRC32
+CHUNK_HEADER_FRMT = "!QI"
+CHUNK_HEADER_SIZE = struct.calcsize(CHUNK_HEADER_FRMT)
+TRANSFER_CHUNK_SIZE = 1 << 20
+HASH_BLOCK_SIZE = 1 << 20
+
 class RequestType(Enum):
     CHECK_CONNECTED = 0
     CAPTURE_MAIN = 1
     CAPTURE_PREVIEW = 2
     POWER_OFF = 3
+    HELLO = 4           # version negotiation, always sent as a v1 message
+    START_PREVIEW_STREAM = 5
+    STOP_PREVIEW_STREAM = 6
+    CAPTURE_SERIES = 7  # time-lapse, frames come back as META + DATA pairs
+    RESUME_TRANSFER = 8 # resends a chunked transfer from an offset
+    ACK_TRANSFER = 9    # lets the server drop a completed chunked transfer
+    LIST_CAPTURES = 10  # lists the recent captures the server keeps
+    FETCH_CAPTURE = 11  # sends a recent capture again, optionally downscaled, without touching the camera
+    CALIBRATE = 12      # focuses and meters once, later captures reuse focus, exposure and gains
+    INVALIDATE_CALIBRATION = 13 # returns to autofocus and AE/AWB for every capture
+    LIST_SPOOL = 14     # lists the manifest of the captures spooled on the server's disk
+    FETCH_SPOOLED = 15  # sends a spooled capture
+    ACK_SPOOLED = 16    # lets the server delete spooled captures the client has stored
+    FETCH_RANGE = 17    # sends a byte range of a chunked transfer, several can be fetched at once over separate connections
+    ACK_SERIES = 18     # lets the server delete buffered series frames the client has stored
+
+class MessageKind(Enum):
+    REQUEST = 0
+    RESPONSE = 1        # final message for a request
+    DATA = 2            # intermediate message for a request (e.g. a preview stream frame)
+    META = 3            # JSON information about a request (e.g. queue position), sent before its RESPONSE
+
+class Status(Enum):
+    OK = 0
+    FAILED = 1          # request was valid but could not be completed (e.g. capture failed)
+    BAD_REQUEST = 2     # request could not be parsed
+    UNSUPPORTED = 3     # request type is known but not handled by the peer
+
+@dataclass
+class Frame:
+    kind: MessageKind
+    code: int
+    request_id: int
+    body: bytearray
+
+    @property
+    def request_type(self) -> RequestType:
+        return RequestType(self.code)
+
+    @property
+    def status(self) -> Status:
+        return Status(self.code)
 
 def rtob(req: RequestType) -> bytes:
     """RequestType object to bytes"""
     return req.value.to_bytes(1, 'little')
 
+def encode_json(obj: dict) -> bytes:
+    """Encodes a message body holding a JSON object"""
+    return json.dumps(obj).encode()
+
+def decode_json(body: bytes) -> dict:
+    """Decodes a message body holding a JSON object, empty bodies decode to {}"""
+    if len(body) == 0:
+        return {}
+    return json.loads(bytes(body))
+
+def tune_socket_for_bulk(sock) -> None:
+    """
+    Sets socket options that suit large file transfers
+
+    Small request frames are sent immediately (no Nagle delay) and the kernel
+    buffers are enlarged so a multi-MB capture does not stall on a full window
+    """
+    options = [
+        (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+        (socket.SOL_SOCKET, socket.SO_SNDBUF, BULK_BUFFER_SIZE),
+        (socket.SOL_SOCKET, socket.SO_RCVBUF, BULK_BUFFER_SIZE),
+    ]
+    for level, option, value in options:
+        try:
+            sock.setsockopt(level, option, value)
+        except OSError:
+            pass
+
+def enable_keepalive(sock) -> None:
+    """
+    Has the kernel probe an idle connection, so a peer that vanished (unplugged, powered off)
+    errors blocked reads after about KEEPALIVE_IDLE + KEEPALIVE_INTERVAL * KEEPALIVE_COUNT seconds
+    """
+    options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    for name, value in [("TCP_KEEPIDLE", KEEPALIVE_IDLE), ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL), ("TCP_KEEPCNT", KEEPALIVE_COUNT)]:
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+
+    for level, option, value in options:
+        try:
+            sock.setsockopt(level, option, value)
+        except OSError:
+            pass
+
+def set_socket_cork(sock, corked: bool) -> None:
+    """Holds back partial frames while corked (Linux only), so header and body leave together"""
+    if hasattr(socket, "TCP_CORK"):
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, int(corked))
+        except OSError:
+            pass
+
+def pack_frame_header(kind: MessageKind, code: Enum, request_id: int, size: int) -> bytes:
+    """Packs a v2 frame header"""
+    return struct.pack(FRAME_HEADER_FRMT, kind.value, code.value, request_id, size)
+
+def pack_chunk_header(offset: int, chunk: bytes) -> bytes:
+    """Packs the header of a chunked transfer DATA body"""
+    return struct.pack(CHUNK_HEADER_FRMT, offset, zlib.crc32(chunk))
+
+def partial_path(fname: Path) -> Path:
+    """File a download into fname is written to, it replaces fname once complete"""
+    return fname.with_name(fname.name + PARTIAL_SUFFIX)
+
+def sha256_file(fname: Path) -> str:
+    """Hex SHA-256 of a file's content, how spooled captures are identified on both ends"""
+    digest = hashlib.sha256()
+    with open(fname, "rb") as file:
+        while block := file.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
 def format_address_tuple(address_tuple: tuple) -> str:
     """Formats entries from tuple as tuple[0]:tuple[1]"""
     return f"{address_tuple[0]}:{address_tuple[1]}"
 
 class Connection:
-    def __init__(self, sock: socket.socket) -> None:
-        """Wrapper for sockets"""
+    def __init__(self, sock: socket.socket, max_body_size: int = MAX_BODY_SIZE) -> None:
+        """
+        Wrapper for sockets
+
+        max_body_size: bodies announced larger than this raise MessageTooLarge instead of being received into memory,
+                       bodies streamed into files are not limited
+        """
         self.sock = sock
+        self.max_body_size = max_body_size
+        self.send_lock = threading.Lock()   # keeps frames from concurrent senders whole
+        self.last_received = time.monotonic()   # time bytes last arrived, also while a long body is received
+
+    def recv_into(self, view: memoryview) -> bool:
+        """Fills view completely with bytes from socket, False if the peer closed before that"""
+        received = 0
+        while received < len(view):
+            n = self.sock.recv_into(view[received:])
 
-    def recvb(self, n: int) -> Optional[bytes]:
-        """Attempts to receive n bytes from socket, None on failure"""
-        data = b''
-        while len(data) < n:
-            chunk = self.sock.recv(n - len(data))
-            
-            if not chunk:
-                return None
+            if not n:
+                return False
+
+            self.last_received = time.monotonic()
+            received += n
+        return True
 
-            data += chunk
+    def recvb(self, n: int) -> Optional[bytearray]:
+        """Attempts to receive n bytes from socket into a preallocated buffer, None on failure, raises MessageTooLarge above max_body_size"""
+        if n > self.max_body_size:
+            raise MessageTooLarge()
+
+        data = bytearray(n)
+        if not self.recv_into(memoryview(data)):
+            return None
         return data
 
     def send(self, msg: bytes) -> bool:
@@ -57,14 +221,18 @@ class Connection:
         message = struct.pack(HEADER_FRMT, req_len) + msg
         return self.send(message)
     
-    def recv_fmsg(self) -> bytes:
-        """Receive a message with a header and body"""
+    def recv_header(self) -> int:
+        """Receive a message header, returns size of the body that follows"""
         incomming_size_header = self.recvb(HEADER_SIZE)
 
         if incomming_size_header is None:
             raise SocketReceivedBytesEmpty()
-        
-        incomming_size = struct.unpack(HEADER_FRMT, incomming_size_header)[0]
+
+        return struct.unpack(HEADER_FRMT, incomming_size_header)[0]
+
+    def recv_fmsg(self) -> bytearray:
+        """Receive a message with a header and body"""
+        incomming_size = self.recv_header()
         
         incomming_msg_body = self.recvb(incomming_size)
 
@@ -72,20 +240,318 @@ class Connection:
             raise SocketReceivedBytesEmpty()
         
         return incomming_msg_body
+
+    def recv_fmsg_to_file(self, fname: Path) -> int:
+        """
+        Receive a message with a header and stream its body straight into a file
+
+        fname: path to write body to (partial files are removed on failure)
+        return: size of received body
+        """
+        return self.recv_body_to_file(self.recv_header(), fname)
+
+    def recv_body_to_file(self, size: int, fname: Path) -> int:
+        """
+        Streams the next size bytes from socket into a file, written verbatim
+
+        The body goes into a partial file that atomically replaces fname once complete,
+        so fname never holds a truncated image
+
+        size: size of the body, as given by its header
+        fname: path to write body to (partial files are removed on failure)
+        return: size of received body
+        """
+        buffer = bytearray(min(FILE_CHUNK_SIZE, max(size, 1)))
+        view = memoryview(buffer)
+        received = 0
+        partial = partial_path(fname)
+        try:
+            with partial.open('wb') as file:
+                while received < size:
+                    n = self.sock.recv_into(view[:min(len(buffer), size - received)])
+
+                    if not n:
+                        raise SocketReceivedBytesEmpty()
+
+                    self.last_received = time.monotonic()
+                    file.write(view[:n])
+                    received += n
+
+            os.replace(partial, fname)
+        except:
+            partial.unlink(missing_ok=True)
+            raise
+
+        return size
+
+    def send_frame(self, kind: MessageKind, code: Enum, request_id: int, body: bytes = b"") -> bool:
+        """
+        Sends a v2 frame, safe to call from several threads
+
+        kind: kind of message
+        code: RequestType for requests, Status for responses
+        request_id: ID chosen by the requester, responses echo it
+        body: message body
+        """
+        header = pack_frame_header(kind, code, request_id, len(body))
+        with self.send_lock:
+            return self.send(header + body)
+
+    def send_frame_file(self, kind: MessageKind, code: Enum, request_id: int, fname: Path) -> bool:
+        """Sends a v2 frame with the contents of fname as body, streamed like send_file"""
+        try:
+            with fname.open('rb') as file, self.send_lock:
+                size = os.fstat(file.fileno()).st_size
+                return self.__send_with_file(pack_frame_header(kind, code, request_id, size), file, size)
+        except:
+            return False
+
+    def recv_frame_header(self) -> tuple[MessageKind, int, int, int]:
+        """Receive a v2 frame header, returns (kind, code, request_id, body size)"""
+        header = self.recvb(FRAME_HEADER_SIZE)
+
+        if header is None:
+            raise SocketReceivedBytesEmpty()
+
+        kind, code, request_id, size = struct.unpack(FRAME_HEADER_FRMT, header)
+        return MessageKind(kind), code, request_id, size
+
+    def recv_chunk(self, size: int, buffer: bytearray) -> tuple[int, memoryview, bool]:
+        """
+        Receives the body of a chunked transfer DATA frame
+
+        size: size of the body, as given by its frame header
+        buffer: reused receive buffer, at least size - CHUNK_HEADER_SIZE bytes (see chunk_buffer)
+        return: offset of the chunk in the file, its data (a view into buffer) and whether its checksum matches
+        """
+        header = self.recvb(CHUNK_HEADER_SIZE)
+
+        if header is None:
+            raise SocketReceivedBytesEmpty()
+
+        offset, crc = struct.unpack(CHUNK_HEADER_FRMT, header)
+        data = memoryview(buffer)[:size - CHUNK_HEADER_SIZE]
+
+        if not self.recv_into(data):
+            raise SocketReceivedBytesEmpty()
+
+        return offset, data, zlib.crc32(data) == crc
+
+    def chunk_buffer(self, size: int, buffer: bytearray) -> bytearray:
+        """buffer if it holds the data of a chunked transfer DATA body of size, else a larger one; raises MessageTooLarge above max_body_size"""
+        if size - CHUNK_HEADER_SIZE <= len(buffer):
+            return buffer
+        if size > self.max_body_size:
+            raise MessageTooLarge()
+        return bytearray(size - CHUNK_HEADER_SIZE)
+
+    def recv_frame(self) -> Frame:
+        """Receive a complete v2 frame"""
+        kind, code, request_id, size = self.recv_frame_header()
+
+        body = self.recvb(size)
+
+        if body is None:
+            raise SocketReceivedBytesEmpty()
+
+        return Frame(kind, code, request_id, body)
     
     def close(self) -> None:
-        """Closes the socket"""
+        """Closes the socket (shut down first, so threads blocked on it wake up)"""
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
         self.sock.close()
 
-    def send_file(self, fname: Path) -> bool:
-        """Sends given file through socket"""
+    def tune_for_bulk(self) -> None:
+        """Sets socket options that suit large file transfers (see tune_socket_for_bulk)"""
+        tune_socket_for_bulk(self.sock)
 
-        buffer = b'' 
-        with fname.open('rb') as file:
-            buffer = file.read()
-        
-        header = struct.pack(HEADER_FRMT, len(buffer))
+    def enable_keepalive(self) -> None:
+        """Turns on TCP keepalive probes (see enable_keepalive)"""
+        enable_keepalive(self.sock)
+
+    def __send_file_chunked(self, file, size: int) -> int:
+        """Fallback for send_file, sends size bytes of file through a single reused buffer"""
+        buffer = bytearray(min(FILE_CHUNK_SIZE, max(size, 1)))
+        view = memoryview(buffer)
+        sent = 0
+        while sent < size:
+            read = file.readinto(view[:min(len(buffer), size - sent)])
+            if not read:
+                break
+            self.sock.sendall(view[:read])
+            sent += read
+        return sent
+
+    def send_file(self, fname: Path, stream: bool = True) -> bool:
+        """
+        Sends given file through socket
+
+        fname: path of file to send
+        stream: stream the file with sendfile (zero-copy) instead of reading it into memory first
+        """
+        if not stream:
+            buffer = b''
+            with fname.open('rb') as file:
+                buffer = file.read()
+
+            header = struct.pack(HEADER_FRMT, len(buffer))
+
+            h = self.send(header)
+            b = self.send(buffer)
+            return h and b
+
+        try:
+            with fname.open('rb') as file, self.send_lock:
+                size = os.fstat(file.fileno()).st_size
+                return self.__send_with_file(struct.pack(HEADER_FRMT, size), file, size)
+        except:
+            return False
+
+    def __send_with_file(self, header: bytes, file, size: int) -> bool:
+        """Sends header followed by size bytes of file, zero-copy where the platform allows it"""
+        set_socket_cork(self.sock, True)
+        try:
+            self.sock.sendall(header)
+
+            try:
+                sent = self.sock.sendfile(file, 0, size)
+            except (AttributeError, ValueError, NotImplementedError):
+                file.seek(0)
+                sent = self.__send_file_chunked(file, size)
+        finally:
+            set_socket_cork(self.sock, False)
+
+        return sent == size
+
+class AsyncConnection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, max_body_size: int = MAX_REQUEST_SIZE) -> None:
+        """
+        Wrapper for asyncio streams, speaks the same framing as Connection
+
+        max_body_size: bodies announced larger than this raise MessageTooLarge instead of being received
+        """
+        self.reader = reader
+        self.writer = writer
+        self.max_body_size = max_body_size
+        self.send_lock = asyncio.Lock()     # keeps frames from concurrent senders whole
+
+    def peername(self) -> tuple:
+        """Address of the peer"""
+        return self.writer.get_extra_info("peername")
+
+    def tune_for_bulk(self) -> None:
+        """Sets socket options that suit large file transfers (see tune_socket_for_bulk)"""
+        tune_socket_for_bulk(self.writer.get_extra_info("socket"))
+
+    def enable_keepalive(self) -> None:
+        """Turns on TCP keepalive probes (see enable_keepalive)"""
+        enable_keepalive(self.writer.get_extra_info("socket"))
+
+    async def recvb(self, n: int) -> bytes:
+        """Receives exactly n bytes, raises SocketReceivedBytesEmpty if the peer closed before that"""
+        try:
+            return await self.reader.readexactly(n)
+        except asyncio.IncompleteReadError:
+            raise SocketReceivedBytesEmpty()
+
+    async def send(self, msg: bytes) -> bool:
+        """Attempts to send msg, returns True on success"""
+        try:
+            self.writer.write(msg)
+            await self.writer.drain()
+        except:
+            return False
+        return True
+
+    async def recv_fmsg(self) -> bytes:
+        """Receive a message with a header and body"""
+        incomming_size = struct.unpack(HEADER_FRMT, await self.recvb(HEADER_SIZE))[0]
+        if incomming_size > self.max_body_size:
+            raise MessageTooLarge()
+        return await self.recvb(incomming_size)
+
+    async def send_fmsg(self, msg: bytes) -> bool:
+        """Sends formatted message"""
+        async with self.send_lock:
+            return await self.send(struct.pack(HEADER_FRMT, len(msg)) + msg)
+
+    async def send_file(self, fname: Path) -> bool:
+        """Sends given file as a formatted message, streamed with sendfile where possible"""
+        try:
+            with fname.open('rb') as file:
+                size = os.fstat(file.fileno()).st_size
+                async with self.send_lock:
+                    return await self.__send_with_file(struct.pack(HEADER_FRMT, size), file, size)
+        except:
+            return False
+
+    async def recv_frame(self) -> Frame:
+        """Receive a complete v2 frame"""
+        kind, code, request_id, size = struct.unpack(FRAME_HEADER_FRMT, await self.recvb(FRAME_HEADER_SIZE))
+        if size > self.max_body_size:
+            raise MessageTooLarge()
+        body = bytearray(await self.recvb(size))
+        return Frame(MessageKind(kind), code, request_id, body)
 
-        h = self.send(header)
-        b = self.send(buffer)
-        return h and b
\ No newline at end of file
+    async def send_frame(self, kind: MessageKind, code: Enum, request_id: int, body: bytes = b"") -> bool:
+        """Sends a v2 frame, safe to call from several tasks"""
+        async with self.send_lock:
+            return await self.send(pack_frame_header(kind, code, request_id, len(body)) + body)
+
+    async def send_frame_file(self, kind: MessageKind, code: Enum, request_id: int, fname: Path) -> bool:
+        """Sends a v2 frame with the contents of fname as body, streamed like send_file"""
+        try:
+            with fname.open('rb') as file:
+                size = os.fstat(file.fileno()).st_size
+                async with self.send_lock:
+                    return await self.__send_with_file(pack_frame_header(kind, code, request_id, size), file, size)
+        except:
+            return False
+
+    async def send_file_chunks(self, request_id: int, fname: Path, offset: int = 0, chunk_size: int = TRANSFER_CHUNK_SIZE,
+                               length: Optional[int] = None) -> bool:
+        """
+        Sends fname from offset on as DATA frames of at most chunk_size bytes, each carrying its offset and CRC32
+
+        Other frames may go out between chunks, so a long transfer does not hold up other requests
+
+        length: bytes to send from offset, up to the end of the file if None
+        """
+        end = offset + length if length is not None else None
+        try:
+            with fname.open('rb') as file:
+                file.seek(offset)
+                while True:
+                    chunk = file.read(chunk_size if end is None else min(chunk_size, end - offset))
+                    if not chunk:
+                        return True
+
+                    if not await self.send_frame(MessageKind.DATA, Status.OK, request_id, pack_chunk_header(offset, chunk) + chunk):
+                        return False
+                    offset += len(chunk)
+        except:
+            return False
+
+    async def __send_with_file(self, header: bytes, file, size: int) -> bool:
+        """Sends header followed by size bytes of file, zero-copy where the transport allows it"""
+        sock = self.writer.get_extra_info("socket")
+        set_socket_cork(sock, True)
+        try:
+            self.writer.write(header)
+            await self.writer.drain()
+            sent = await asyncio.get_running_loop().sendfile(self.writer.transport, file, 0, size)
+        finally:
+            set_socket_cork(sock, False)
+
+        return sent == size
+
+    async def close(self) -> None:
+        """Closes the connection"""
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except:
+            pass
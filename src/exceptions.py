@@ -12,6 +12,10 @@ class SocketReceivedBytesEmpty(Exception):
     def __str__(self) -> str:
         return "received bytes object from socket was None"
     
+class MessageTooLarge(Exception):
+    def __str__(self) -> str:
+        return "announced message size exceeds the maximum"
+
 class CaptureFailed(Exception):
     def __str__(self) -> str:
         return "failed to capture image"
\ No newline at end of file
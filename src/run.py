@@ -16,7 +16,10 @@ if __name__ == "__main__":
         constructor = ImagerServer
         defaults = {
             "log-path": Path("logs/imager_logs.txt"),
-            "log-record-count": 100
+            "log-record-count": 100,
+            "camera-backend": "auto",
+            "max-connections": 8,
+            "backlog": 16
         }
     
     for key in defaults.keys():
@@ -25,5 +28,10 @@ if __name__ == "__main__":
         if user_val is not None:
             defaults[key] = user_val
 
-    app = constructor(*defaults.values())
+    # spooling is opt-in, its directory is resolved now so it does not depend on the working directory later
+    keywords = {}
+    if options["type"] == "imager" and options.get("spool-dir") is not None:
+        keywords["spoolDir"] = options["spool-dir"].resolve()
+
+    app = constructor(*defaults.values(), **keywords)
     app.start()
\ No newline at end of file
@@ -2,6 +2,8 @@ import argparse
 
 from pathlib import Path
 
+from src.Imager.cameraBackends import BACKEND_NAMES
+
 NAME = "Petri dish imager"
 DESCRIPTION = "This repository holds the files to control a RPI 4B and camera via a GUI and a socket connection"
 EPILOG = "If you are a member of UAntwerpen and need more help, feel free to send an email to jamie.lakchi@student.uantwerpen.be."
@@ -14,12 +16,20 @@ def get_user_args() -> dict:
     argParser.add_argument("-t", "--type", help="which script to run, client or imager", action="store", required=True, choices=["client", "imager"])
     argParser.add_argument("--log-path", help="Filepath of where to store logs", action="store", default=None, type=Path)
     argParser.add_argument("--log-record-count", help="Decides number of logs that are kept", action="store", default=None, type=int)
+    argParser.add_argument("--camera-backend", help="How the imager drives the camera (auto prefers a persistent picamera2 session)", action="store", default=None, choices=BACKEND_NAMES)
+    argParser.add_argument("--max-connections", help="Number of clients the imager serves at once", action="store", default=None, type=int)
+    argParser.add_argument("--backlog", help="Accept backlog of the imager server socket", action="store", default=None, type=int)
+    argParser.add_argument("--spool-dir", help="Directory the imager spools series frames in until a client pulls them, no spool if not given", action="store", default=None, type=Path)
     args = argParser.parse_args()
 
     options = {
         "type" : args.type,
         "log-path" : args.log_path,
-        "log-record-count" : args.log_record_count
+        "log-record-count" : args.log_record_count,
+        "camera-backend" : args.camera_backend,
+        "max-connections" : args.max_connections,
+        "backlog" : args.backlog,
+        "spool-dir" : args.spool_dir
     }
 
     return options
\ No newline at end of file
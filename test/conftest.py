@@ -0,0 +1,183 @@
+# Shared fixtures of the loopback tests: imager servers with fake cameras and clients connected to them
+
+import os
+import time
+import socket
+import struct
+import asyncio
+import threading
+
+import pytest
+
+from pathlib import Path
+from typing import Callable, Optional
+
+from src.Imager.imagerServer import ImagerServer
+from src.Imager.cameraBackends import CameraBackend, FakeCameraBackend, CaptureSettings, PhaseTimer
+from src.Client.imagerClientConnection import ImagerClientConnection
+from test.load_harness import free_port
+
+class NoiseCameraBackend(FakeCameraBackend):
+    def __init__(self, size: int, **kwargs) -> None:
+        """Fake camera writing size random bytes per capture, every capture differs and nothing compresses"""
+        super().__init__(**kwargs)
+        self.size = size
+        self.written: list[bytes] = []
+
+    def capture(self, settings: CaptureSettings, output: Path, timer: PhaseTimer) -> None:
+        super().capture(settings, output, timer)
+        image = os.urandom(self.size)
+        output.write_bytes(image)
+        self.written.append(image)
+
+def run_server(server: ImagerServer, port: int) -> threading.Thread:
+    """Serves on 127.0.0.1:port in a thread, returns once the server is up"""
+    # serve() instead of start(): start() would power the machine off after a POWER_OFF request
+    thread = threading.Thread(target=asyncio.run, args=(server.serve("127.0.0.1", port),), daemon=True)
+    thread.start()
+
+    deadline = time.monotonic() + 5
+    while not server.isRunning():
+        assert time.monotonic() < deadline, "server did not start"
+        time.sleep(0.01)
+    return thread
+
+class LinkProxy:
+    def __init__(self, target_port: int) -> None:
+        """
+        Forwards local connections to target_port and breaks the link on demand
+
+        cut_at: after this many bytes from the server on the first connection, the client side is reset
+        corrupt_at: this byte from the server on the first connection is flipped on its way to the client
+        half_open: cut keeps the server side open and silent, so the server does not notice the drop
+        rate: bytes per second forwarded from the server, unlimited if None
+        """
+        self.target_port = target_port
+        self.cut_at: Optional[int] = None
+        self.corrupt_at: Optional[int] = None
+        self.half_open = False
+        self.rate: Optional[int] = None
+        self.downstream = 0     # bytes sent from the server to clients over all connections
+        self.connections = 0
+        self.links: list[tuple[socket.socket, socket.socket]] = []
+        self.blackholed: set[socket.socket] = set()    # client sides of links whose bytes are swallowed both ways
+
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self.__accept, daemon=True).start()
+
+    def __accept(self) -> None:
+        while True:
+            try:
+                client, _ = self.listener.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(("127.0.0.1", self.target_port))
+            first = self.connections == 0
+            self.connections += 1
+            self.links.append((client, upstream))
+            threading.Thread(target=self.__pump, args=(client, upstream, False, False), daemon=True).start()
+            threading.Thread(target=self.__pump, args=(upstream, client, True, first), daemon=True).start()
+
+    def __pump(self, source: socket.socket, target: socket.socket, downstream: bool, tampered: bool) -> None:
+        """Forwards source to target, applying corrupt_at and cut_at if tampered"""
+        forwarded = 0
+        try:
+            while data := source.recv(1 << 14 if downstream and self.rate else 1 << 16):
+                if tampered and self.corrupt_at is not None and forwarded <= self.corrupt_at < forwarded + len(data):
+                    data = bytearray(data)
+                    data[self.corrupt_at - forwarded] ^= 0xff
+                if tampered and self.cut_at is not None and forwarded + len(data) >= self.cut_at:
+                    data = data[:self.cut_at - forwarded]
+
+                if source in self.blackholed or target in self.blackholed:
+                    continue
+
+                target.sendall(data)
+                forwarded += len(data)
+                if downstream:
+                    self.downstream += len(data)
+                    if self.rate:
+                        time.sleep(len(data) / self.rate)
+
+                if tampered and forwarded == self.cut_at:
+                    self.cut(target, source)
+                    return
+        except OSError:
+            pass
+
+    def cut(self, client: socket.socket, upstream: socket.socket) -> None:
+        """Resets the client side of a link, closes the server side too unless half_open"""
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        try:
+            client.shutdown(socket.SHUT_RD)     # wakes the pump blocked on it, so the close below takes effect (RST)
+        except OSError:
+            pass
+        client.close()
+        if not self.half_open:
+            upstream.close()
+
+    def blackhole(self, client: socket.socket, upstream: socket.socket) -> None:
+        """Silently drops everything sent over a link from now on, neither side notices until it times out"""
+        self.blackholed.add(client)
+
+    def close(self) -> None:
+        self.listener.close()
+        for client, upstream in self.links:
+            client.close()
+            upstream.close()
+
+@pytest.fixture
+def link_proxy():
+    """Factory for LinkProxy instances in front of a port, all are closed after the test"""
+    proxies = []
+
+    def create(target_port: int) -> LinkProxy:
+        proxy = LinkProxy(target_port)
+        proxies.append(proxy)
+        return proxy
+
+    yield create
+
+    for proxy in proxies:
+        proxy.close()
+
+@pytest.fixture
+def imager_server(tmp_path: Path):
+    """
+    Factory starting an imager server with given camera backend on a free port, returns (server, port)
+
+    Keyword arguments are passed on to ImagerServer, all servers are stopped after the test
+    """
+    running = []
+
+    def start(backend: CameraBackend = None, **kwargs) -> tuple[ImagerServer, int]:
+        port = free_port()
+        kwargs.setdefault("outputDir", tmp_path / f"out_{port}")
+        kwargs.setdefault("spoolDir", None)
+        server = ImagerServer(tmp_path / f"log_{port}.txt", 50, backend or FakeCameraBackend(), advertise=False, **kwargs)
+        running.append((server, run_server(server, port)))
+        return server, port
+
+    yield start
+
+    for server, thread in running:
+        server.stop()
+        thread.join(timeout=5)
+        server.imagerCtl.close()
+
+@pytest.fixture
+def imager_client():
+    """Factory connecting a client to 127.0.0.1:port, returns the connection, all are closed after the test"""
+    connections = []
+
+    def connect(port: int, log: Callable[[str, str], None] = lambda type, msg: None) -> ImagerClientConnection:
+        connection = ImagerClientConnection(log)
+        assert connection.connect("127.0.0.1", port) is not None
+        connections.append(connection)
+        return connection
+
+    yield connect
+
+    for connection in connections:
+        connection.close()
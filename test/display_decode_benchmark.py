@@ -0,0 +1,76 @@
+# Benchmark for decoding captures at display size
+# Compares a full-resolution decode followed by LANCZOS resampling (what the views used to do)
+# with decode_scaled, which lets the JPEG decoder scale down first, for every display path
+#
+# usage: python -m test.display_decode_benchmark [--image capture.jpg] [--repeat 5] [--output results.json]
+#
+# without --image a synthetic 8000x6000 main capture is generated
+
+import json
+import time
+import argparse
+import tempfile
+
+from pathlib import Path
+from PIL import Image
+
+from src.Client.UI.imageDisplay import decode_scaled
+
+# display path: (size, fit)
+VIEWS = {
+    "ControllerView": ((400, 300), False),
+    "PyCOLONYView thumbnail": ((120, 90), True),
+    "PyCOLONYView large view": ((1200, 900), True),
+}
+
+def make_capture(fpath: Path, size: tuple[int, int], quality: int = 90) -> None:
+    """Writes a gradient with mild noise as JPEG, which compresses about like a real 48 MP capture"""
+    gradient = Image.linear_gradient("L").resize(size)
+    bands = [Image.blend(gradient, Image.effect_noise(size, sigma), 0.3) for sigma in [8, 12, 16]]
+    Image.merge("RGB", bands).save(fpath, "JPEG", quality=quality)
+
+def decode_full(fpath: Path, size: tuple[int, int], fit: bool) -> Image.Image:
+    """Full-resolution decode, then resampling"""
+    with Image.open(fpath) as image:
+        image.load()
+        if fit:
+            image.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=None)
+            return image
+        return image.resize(size, Image.Resampling.LANCZOS)
+
+def best_of(repeat: int, decode) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decode()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main() -> None:
+    argParser = argparse.ArgumentParser(description="Benchmark for decoding captures at display size")
+    argParser.add_argument("--image", type=Path, help="capture to decode, a synthetic 48 MP JPEG if not given")
+    argParser.add_argument("--repeat", type=int, default=5)
+    argParser.add_argument("--output", type=Path, help="write the results as JSON to this file")
+    args = argParser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fpath = args.image
+        if fpath is None:
+            fpath = Path(tmpdir) / "main_img.jpg"
+            make_capture(fpath, (8000, 6000))
+
+        with Image.open(fpath) as image:
+            print(f"{fpath.name}: {image.width}x{image.height}, {fpath.stat().st_size / (1 << 20):.1f} MiB")
+
+        results = []
+        for view, (size, fit) in VIEWS.items():
+            full = best_of(args.repeat, lambda: decode_full(fpath, size, fit))
+            scaled = best_of(args.repeat, lambda: decode_scaled(fpath, size, fit))
+            results.append({"view": view, "size": size, "full_ms": full * 1000, "scaled_ms": scaled * 1000})
+            print(f"{view:>24} {size[0]:>5}x{size[1]:<4} full {full * 1000:8.1f} ms  scaled {scaled * 1000:8.1f} ms  ({full / scaled:4.1f}x)")
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# Fake encoder process standing in for rpicam-still, for RpicamStillBackend without a camera
+# Takes the rpicam-still arguments the backend passes (-o, --width, --height, --quality, --encoding, --metadata,
+# --immediate, --thumb, the rest is ignored) and writes a synthetic JPEG (or raw YUV420 planes) of that size to the output
+# file, or to stdout for "-o -", paced like the real process: camera start, AE/AWB and autofocus settling (skipped
+# by --immediate), the encoder producing the image chunk by chunk, camera shutdown
+# "--metadata -" prints the image metadata as JSON to stdout, reporting the fixed controls if they were given
+#
+# usage: RpicamStillBackend([sys.executable, "-m", "test.fake_rpicam_still", "--fake-startup", "0.3"])
+#        or by hand: python -m test.fake_rpicam_still -o - --width 2312 --height 1736 > preview.jpg
+
+import io
+import sys
+import json
+import time
+import struct
+import argparse
+import tempfile
+
+from pathlib import Path
+from PIL import Image
+
+from test.display_decode_benchmark import make_capture
+
+CHUNK_SIZE = 64 << 10   # bytes written at a time, about what the encoder flushes
+
+def encoded_image(width: int, height: int, quality: int) -> bytes:
+    """Synthetic JPEG of given size, generated once and cached in the temp directory"""
+    cache = Path(tempfile.gettempdir()) / "fake_rpicam_still" / f"{width}x{height}_q{quality}.jpg"
+    if not cache.exists():
+        cache.parent.mkdir(parents=True, exist_ok=True)
+        partial = cache.with_suffix(".part")
+        make_capture(partial, (width, height), quality)
+        partial.replace(cache)
+    return cache.read_bytes()
+
+def yuv420_planes(width: int, height: int) -> bytes:
+    """Y plane of the synthetic image followed by neutral U and V planes, packed without padding like rpicam-still writes them"""
+    with Image.open(io.BytesIO(encoded_image(width, height, 93))) as image:
+        luma = image.convert("L").tobytes()
+    return luma + bytes([128]) * (2 * ((width + 1) // 2) * ((height + 1) // 2))
+
+def with_exif_thumbnail(image: bytes, thumb: str) -> bytes:
+    """Inserts an EXIF APP1 segment holding a thumbnail of image ("width:height:quality") after its SOI, like rpicam-still"""
+    width, height, quality = (int(value) for value in thumb.split(":"))
+    with Image.open(io.BytesIO(image)) as decoded:
+        decoded.draft("RGB", (width, height))
+        buffer = io.BytesIO()
+        decoded.convert("RGB").resize((width, height)).save(buffer, "JPEG", quality=quality)
+    thumbnail = buffer.getvalue()
+
+    # big endian TIFF header, an empty IFD0 and an IFD1 pointing at the thumbnail right behind it
+    tiff = b"MM\x00\x2a" + struct.pack(">I", 8) + struct.pack(">HI", 0, 14) + \
+           struct.pack(">H", 2) + struct.pack(">HHII", 0x0201, 4, 1, 44) + struct.pack(">HHII", 0x0202, 4, 1, len(thumbnail)) + \
+           struct.pack(">I", 0) + thumbnail
+    segment = b"Exif\x00\x00" + tiff
+    return image[:2] + b"\xff\xe1" + struct.pack(">H", len(segment) + 2) + segment + image[2:]
+
+def main() -> None:
+    argParser = argparse.ArgumentParser(description="Fake rpicam-still streaming a synthetic JPEG")
+    argParser.add_argument("-o", "--output", required=True, help="output file, - for stdout")
+    argParser.add_argument("--width", type=int, default=8000)
+    argParser.add_argument("--height", type=int, default=6000)
+    argParser.add_argument("--quality", type=int, default=93)
+    argParser.add_argument("--encoding", choices=["jpg", "yuv420"], default="jpg")
+    argParser.add_argument("--metadata", help="- to print the metadata as JSON to stdout")
+    argParser.add_argument("--immediate", action="store_true", help="capture without waiting for AE/AWB and autofocus")
+    argParser.add_argument("--lens-position", type=float, default=2.5)
+    argParser.add_argument("--shutter", type=int, default=20000)
+    argParser.add_argument("--gain", type=float, default=1.5)
+    argParser.add_argument("--awbgains", default="1.8,1.6")
+    argParser.add_argument("--thumb", default="none", help="width:height:quality of the EXIF thumbnail, none for no thumbnail")
+    argParser.add_argument("--fake-startup", type=float, default=0.3, help="seconds before the first byte (camera start)")
+    argParser.add_argument("--fake-settle", type=float, default=0, help="seconds of AE/AWB and autofocus before the first byte, unless --immediate")
+    argParser.add_argument("--fake-rate", type=float, default=40, help="MB/s the encoder produces")
+    argParser.add_argument("--fake-shutdown", type=float, default=0.2, help="seconds between the last byte and exiting")
+    argParser.add_argument("--fake-fail", action="store_true", help="stop halfway through the image and exit with 1")
+    args, _ = argParser.parse_known_args()
+
+    if args.encoding == "yuv420":
+        image = yuv420_planes(args.width, args.height)
+    else:
+        image = encoded_image(args.width, args.height, args.quality)
+        if args.thumb != "none":
+            image = with_exif_thumbnail(image, args.thumb)
+    if args.fake_fail:
+        image = image[:len(image) // 2]
+
+    time.sleep(args.fake_startup + (0 if args.immediate else args.fake_settle))
+
+    output = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    for offset in range(0, len(image), CHUNK_SIZE):
+        chunk = image[offset:offset + CHUNK_SIZE]
+        time.sleep(len(chunk) / (args.fake_rate * 1e6))
+        output.write(chunk)
+        output.flush()
+    output.close()
+
+    if args.metadata == "-":
+        metadata = {"LensPosition": args.lens_position, "ExposureTime": args.shutter, "AnalogueGain": args.gain,
+                    "ColourGains": [float(gain) for gain in args.awbgains.split(",")]}
+        sys.stdout.write(json.dumps(metadata, indent=1))
+        sys.stdout.flush()
+
+    time.sleep(args.fake_shutdown)
+    sys.exit(1 if args.fake_fail else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# Starts several imager servers with fake cameras on consecutive local ports
+# Used for trying out fleet control without a room full of Pis
+#
+# usage: python -m test.fleet_servers [--count 3] [--port 8888] [--latency 0.5]
+#
+# then add 127.0.0.1:8888, 127.0.0.1:8889, ... in the Fleet tab of the client
+# device i takes (i + 1) * latency seconds per capture, so per-device latencies differ
+
+import asyncio
+import argparse
+import tempfile
+
+from pathlib import Path
+
+from src.Imager.imagerServer import ImagerServer
+from src.Imager.cameraBackends import FakeCameraBackend
+
+async def serve_all(servers: list[ImagerServer], ip: str, port: int) -> None:
+    await asyncio.gather(*[server.serve(ip, port + i) for i, server in enumerate(servers)])
+
+if __name__ == "__main__":
+    argParser = argparse.ArgumentParser(description="Run several fake imagers on localhost")
+    argParser.add_argument("--count", type=int, default=3, help="number of imagers")
+    argParser.add_argument("--port", type=int, default=8888, help="port of the first imager, the others follow")
+    argParser.add_argument("--latency", type=float, default=0.5, help="capture latency of the first imager in seconds")
+    args = argParser.parse_args()
+
+    Path("logs").mkdir(exist_ok=True)
+    servers = [ImagerServer(Path(f"logs/fleet_{args.port + i}.txt"), 50, FakeCameraBackend(latency=(i + 1) * args.latency),
+                            outputDir=Path(tempfile.gettempdir()) / f"imager_{args.port + i}",
+                            spoolDir=Path(tempfile.gettempdir()) / f"imager_spool_{args.port + i}")
+               for i in range(args.count)]
+
+    print(f"serving {args.count} fake imagers on 127.0.0.1:{args.port}-{args.port + args.count - 1}")
+    try:
+        # serve() instead of start(): start() would power the machine off after a POWER_OFF request
+        asyncio.run(serve_all(servers, "127.0.0.1", args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.imagerCtl.close()
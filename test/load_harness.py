@@ -0,0 +1,333 @@
+# Soak/load harness for the imager server
+# Runs an ImagerServer in a child process whose ImagerCtl drives a simulated camera (configurable capture latency,
+# realistically sized synthetic JPEGs from test.fake_rpicam_still) and hammers it with concurrent scripted
+# ImagerClientConnection clients, each repeatedly picking one of:
+#   preview     capture(preview=True), the image in memory
+#   main        capture_to_file(preview=False), chunked transfer into a file
+#   stream      capture_to_file(preview=False, stream=True), the encoder output streamed into a file
+#   disconnect  close the connection and connect a new one (no POWER_OFF)
+#   drop        request a main capture and disconnect without waiting for it
+# weighted by --mix. Every --interval seconds, and once at the end, it prints throughput, p50/p99 latency per
+# action, errors and the thread count, RSS and open file descriptors of the server process, so leaks show up as
+# growth over long runs (--duration 3600 and up).
+#
+# usage: python -m test.load_harness [--clients 8] [--duration 60] [--interval 10]
+#            [--mix preview=4,main=2,stream=2,disconnect=1,drop=1] [--preview-latency 0.05] [--main-latency 0.3]
+#            [--main-size 8000x6000] [--output results.json]
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+
+from pathlib import Path
+from typing import Optional, Callable
+from collections import defaultdict
+
+from src.connections import RequestType
+from src.exceptions import CaptureFailed
+from src.Imager.imagerServer import ImagerServer
+from src.Imager.cameraBackends import CameraBackend, CameraCalibration, CaptureSettings, PhaseTimer, PREVIEW_SETTINGS, STREAM_SETTINGS
+from src.Imager.previewStream import FrameSource, FakeFrameSource, READ_SIZE
+from src.Client.imagerClientConnection import ImagerClientConnection
+from test.transport_benchmark import percentile
+from test.fake_rpicam_still import encoded_image
+
+ACTIONS = ["preview", "main", "stream", "disconnect", "drop"]
+DEFAULT_MIX = "preview=4,main=2,stream=2,disconnect=1,drop=1"
+
+# ---- server ----
+
+class SimulatedCameraBackend(CameraBackend):
+    """
+    Camera for load tests, takes a fixed time per capture and produces textured JPEGs of the requested size
+
+    Unlike FakeCameraBackend it keeps no record of the captures, so memory stays flat over long runs
+    """
+    name = "simulated"
+
+    def __init__(self, preview_latency: float, main_latency: float, main_size: tuple[int, int]) -> None:
+        """
+        preview_latency: seconds a preview capture takes
+        main_latency: seconds a main capture takes
+        main_size: size main captures are generated at, smaller than the sensor for quicker runs
+        """
+        self.preview_latency = preview_latency
+        self.main_latency = main_latency
+        self.main_size = main_size
+
+    def __take(self, settings: CaptureSettings, timer: PhaseTimer) -> bytes:
+        is_preview = settings.width == PREVIEW_SETTINGS.width
+        with timer.phase("capture"):
+            time.sleep(self.preview_latency if is_preview else self.main_latency)
+
+        size = settings.output_size() if is_preview or settings.size is not None else self.main_size
+        with timer.phase("encode"):
+            return encoded_image(*size, settings.quality or 93)
+
+    def capture(self, settings: CaptureSettings, output: Path, timer: PhaseTimer) -> None:
+        if settings.gray:
+            raise CaptureFailed()
+        image = self.__take(settings, timer)
+        with timer.phase("write"):
+            output.write_bytes(image)
+
+    def capture_stream(self, settings: CaptureSettings, on_chunk: Callable[[bytes], None], timer: PhaseTimer) -> None:
+        if settings.gray:
+            raise CaptureFailed()
+        image = self.__take(settings, timer)
+        with timer.phase("stream"):
+            for offset in range(0, len(image), READ_SIZE):
+                on_chunk(image[offset:offset + READ_SIZE])
+
+    def calibrate(self, timer: PhaseTimer) -> CameraCalibration:
+        return CameraCalibration(lens_position=2.5, exposure_time=20000, analogue_gain=1.5, colour_gains=(1.8, 1.6))
+
+    def preview_source(self) -> FrameSource:
+        return FakeFrameSource(size=(STREAM_SETTINGS.width, STREAM_SETTINGS.height))
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def serve(args: argparse.Namespace) -> None:
+    """Server role: serves on args.port until killed"""
+    backend = SimulatedCameraBackend(args.preview_latency, args.main_latency, args.main_size)
+    # generate the images before clients arrive, the first main would otherwise take seconds
+    encoded_image(*PREVIEW_SETTINGS.output_size(), 93)
+    encoded_image(*args.main_size, 93)
+
+    directory = Path(tempfile.mkdtemp(prefix="load_harness_"))
+    server = ImagerServer(directory / "imager_logs.txt", 50, backend, outputDir=directory / "imager", advertise=False)
+    # serve() instead of start(): start() would power the machine off after a POWER_OFF request
+    asyncio.run(server.serve("127.0.0.1", args.port))
+
+def start_server(args: argparse.Namespace) -> tuple[subprocess.Popen, int]:
+    """Server role in a child process (so its threads and memory are its own), returns it once it accepts connections"""
+    port = free_port()
+    # the server logs to stdout, which nobody reads during a long run
+    server = subprocess.Popen([sys.executable, "-m", "test.load_harness", "--role", "server", "--port", str(port),
+                               "--preview-latency", str(args.preview_latency), "--main-latency", str(args.main_latency),
+                               "--main-size", "x".join(map(str, args.main_size))], stdout=subprocess.DEVNULL)
+    while server.poll() is None:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return server, port
+        except ConnectionRefusedError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server exited with {server.returncode}")
+
+def process_stats(pid: int) -> dict:
+    """Threads, resident memory and open file descriptors of a process (Linux /proc, empty elsewhere)"""
+    stats = {}
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("Threads:"):
+                    stats["threads"] = int(line.split()[1])
+                elif line.startswith("VmRSS:"):
+                    stats["rss_kib"] = int(line.split()[1])
+        stats["fds"] = len(os.listdir(f"/proc/{pid}/fd"))
+    except OSError:
+        pass
+    return stats
+
+# ---- clients ----
+
+class Results:
+    def __init__(self) -> None:
+        """Latencies, bytes and errors per action, shared by all clients"""
+        self.lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.bytes = 0
+
+    def add(self, action: str, latency: float, received: Optional[int]) -> None:
+        with self.lock:
+            if received is None:
+                self.errors[action] += 1
+            else:
+                self.latencies[action].append(latency)
+                self.bytes += received
+
+    def take(self) -> tuple[dict[str, list[float]], dict[str, int], int]:
+        """Results since the last call"""
+        with self.lock:
+            taken = (self.latencies, self.errors, self.bytes)
+            self.latencies, self.errors, self.bytes = defaultdict(list), defaultdict(int), 0
+        return taken
+
+class ScriptedClient:
+    def __init__(self, index: int, port: int, mix: dict[str, int], directory: Path, results: Results) -> None:
+        """Client picking actions by weight until stopped"""
+        self.port = port
+        self.mix = mix
+        self.fpath = directory / f"client_{index}.jpg"
+        self.results = results
+        self.random = random.Random(index)
+        self.client: Optional[ImagerClientConnection] = None
+
+    def __connect(self) -> Optional[int]:
+        if self.client is not None:
+            self.client.close()
+        self.client = ImagerClientConnection(lambda type, msg: None)
+        return 0 if self.client.connect("127.0.0.1", self.port) is not None else None
+
+    def __file_capture(self, stream: bool) -> Optional[int]:
+        self.fpath.unlink(missing_ok=True)
+        if self.client.capture_to_file(self.fpath, preview=False, stream=stream) is None:
+            return
+        return self.fpath.stat().st_size
+
+    def __drop(self) -> Optional[int]:
+        """Leaves a main capture behind in the server's queue, the server has to clean it up"""
+        self.client.request(RequestType.CAPTURE_MAIN, json.dumps({}).encode())
+        return self.__connect()
+
+    def __run_action(self, action: str) -> Optional[int]:
+        """Runs action, returns the bytes received or None on failure"""
+        if action == "preview":
+            image = self.client.capture(preview=True)
+            return None if image is None else len(image)
+        if action == "main":
+            return self.__file_capture(stream=False)
+        if action == "stream":
+            return self.__file_capture(stream=True)
+        if action == "disconnect":
+            return self.__connect()
+        return self.__drop()
+
+    def run(self, stop: threading.Event) -> None:
+        self.__connect()
+        actions, weights = list(self.mix), list(self.mix.values())
+        while not stop.is_set():
+            action = self.random.choices(actions, weights)[0]
+            start = time.perf_counter()
+            try:
+                received = self.__run_action(action)
+            except Exception:
+                received = None
+            self.results.add(action, time.perf_counter() - start, received)
+        self.client.close()
+
+def summarize(latencies: dict[str, list[float]], errors: dict[str, int], received: int, elapsed: float) -> dict:
+    """Throughput and latency percentiles per action over elapsed seconds"""
+    summary = {"ops_per_s": sum(map(len, latencies.values())) / elapsed, "mib_per_s": received / elapsed / (1 << 20), "actions": {}}
+    for action in ACTIONS:
+        if latencies.get(action) or errors.get(action):
+            values = latencies.get(action, [])
+            summary["actions"][action] = {
+                "count": len(values),
+                "errors": errors.get(action, 0),
+                "p50_ms": percentile(values, 50) * 1000 if values else None,
+                "p99_ms": percentile(values, 99) * 1000 if values else None,
+            }
+    return summary
+
+def print_line(elapsed: float, summary: dict, stats: dict) -> None:
+    actions = "  ".join(f"{action} {result['count']}/{result['errors']}err "
+                        f"p50 {result['p50_ms'] or 0:.0f} p99 {result['p99_ms'] or 0:.0f} ms"
+                        for action, result in summary["actions"].items())
+    print(f"[{elapsed:7.1f}s] {summary['ops_per_s']:6.1f} ops/s {summary['mib_per_s']:6.1f} MiB/s  "
+          f"server threads {stats.get('threads', '?')} rss {stats.get('rss_kib', 0) / 1024:.1f} MiB fds {stats.get('fds', '?')}  "
+          f"{actions}", flush=True)
+
+def parse_mix(mix: str) -> dict[str, int]:
+    weights = {}
+    for entry in mix.split(","):
+        action, weight = entry.split("=")
+        if action not in ACTIONS:
+            raise argparse.ArgumentTypeError(f"unknown action {action}, expected one of {ACTIONS}")
+        weights[action] = int(weight)
+    return weights
+
+def parse_size(size: str) -> tuple[int, int]:
+    width, height = size.split("x")
+    return int(width), int(height)
+
+def main() -> None:
+    argParser = argparse.ArgumentParser(description="Soak/load test of the imager server with a simulated camera")
+    argParser.add_argument("--role", choices=["load", "server"], default="load")
+    argParser.add_argument("--port", type=int, help="port of the server role")
+    argParser.add_argument("--clients", type=int, default=8)
+    argParser.add_argument("--duration", type=float, default=60, help="seconds to run")
+    argParser.add_argument("--interval", type=float, default=10, help="seconds between reports")
+    argParser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="action=weight,... of " + ",".join(ACTIONS))
+    argParser.add_argument("--preview-latency", type=float, default=0.05, help="seconds a preview capture takes")
+    argParser.add_argument("--main-latency", type=float, default=0.3, help="seconds a main capture takes")
+    argParser.add_argument("--main-size", type=parse_size, default=(8000, 6000), help="WIDTHxHEIGHT of main captures")
+    argParser.add_argument("--output", type=Path, help="write the reports as JSON to this file")
+    args = argParser.parse_args()
+
+    if args.role == "server":
+        serve(args)
+        return
+
+    server, port = start_server(args)
+
+    results = Results()
+    stop = threading.Event()
+    reports = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        clients = [ScriptedClient(i, port, args.mix, Path(tmpdir), results) for i in range(args.clients)]
+        threads = [threading.Thread(target=client.run, args=(stop,), daemon=True) for client in clients]
+
+        start = last = time.perf_counter()
+        before = process_stats(server.pid)
+        print(f"{args.clients} clients against server pid {server.pid} on port {port}, "
+              f"threads {before.get('threads', '?')} rss {before.get('rss_kib', 0) / 1024:.1f} MiB")
+        for thread in threads:
+            thread.start()
+
+        totals: dict[str, list[float]] = defaultdict(list)
+        total_errors: dict[str, int] = defaultdict(int)
+        total_bytes = 0
+        try:
+            while time.perf_counter() - start < args.duration:
+                time.sleep(min(args.interval, args.duration - (time.perf_counter() - start)))
+                now = time.perf_counter()
+                latencies, errors, received = results.take()
+                for action in latencies:
+                    totals[action] += latencies[action]
+                for action in errors:
+                    total_errors[action] += errors[action]
+                total_bytes += received
+
+                summary, stats = summarize(latencies, errors, received, now - last), process_stats(server.pid)
+                reports.append({"elapsed_s": now - start, **summary, "server": stats})
+                print_line(now - start, summary, stats)
+                last = now
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join(timeout=30)
+            after = process_stats(server.pid)
+            server.kill()
+            server.wait()
+
+    elapsed = time.perf_counter() - start
+    summary = summarize(totals, total_errors, total_bytes, elapsed)
+    print("total")
+    print_line(elapsed, summary, after)
+    # growth after warm-up (first report) is what points at leaks, the first captures allocate for good
+    baseline = reports[0]["server"] if reports else before
+    growth = {key: after[key] - baseline[key] for key in after if key in baseline}
+    print(f"server growth since the first report: threads {growth.get('threads', '?')} "
+          f"rss {growth.get('rss_kib', 0) / 1024:+.1f} MiB fds {growth.get('fds', '?')}")
+
+    if args.output is not None:
+        args.output.write_text(json.dumps({"reports": reports, "total": summary, "server_before": before,
+                                           "server_after": after}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,16 @@
 # Small mDNS server that can be used for testing/debugging
-# Advertises test.local to localhost@8888
+# Advertises test.local to localhost@8888 as an imager service
 
 import socket
 import threading
 from zeroconf import ServiceInfo, Zeroconf
 
+from src.connections import SERVICE_TYPE
+
 IP = "127.0.0.1"
 PORT = 8888
 
 SERVICE_NAME = "test"
-SERVICE_TYPE = "_http._tcp.local."
 FULL_NAME = f"{SERVICE_NAME}.{SERVICE_TYPE}"
 
 class MDNSTestServer:
@@ -0,0 +1,98 @@
+# Benchmark for parallel range transfers of main captures against a single chunked transfer
+# Runs an ImagerServer with the simulated camera of test.load_harness (textured JPEGs of realistic size), behind
+# the shaping proxy of test.transport_benchmark, and times capture_to_file from request to the last byte for each
+# number of parallel connections in --streams (1 is the plain chunked transfer over the main connection)
+#
+# The proxy limits bandwidth per connection by default, like a link where one TCP stream cannot reach the link
+# rate; with --shared-bandwidth the limit applies to all connections together, like a saturated link
+#
+# usage: python -m test.parallel_transfer_benchmark [--streams 1 2 4] [--repeat 3] [--latency-ms 1]
+#            [--bandwidth-mbit 100] [--shared-bandwidth] [--main-size 8000x6000] [--output results.json]
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import statistics
+
+from pathlib import Path
+
+from src.Imager.imagerServer import ImagerServer
+from src.Client.imagerClientConnection import ImagerClientConnection
+from test.transport_benchmark import spawn
+from test.fake_rpicam_still import encoded_image
+from test.load_harness import SimulatedCameraBackend, free_port, parse_size
+
+def start_server(directory: Path, main_size: tuple[int, int]) -> tuple[ImagerServer, int]:
+    """ImagerServer on a free loopback port, capturing instantly with the simulated camera"""
+    server = ImagerServer(directory / "imager_logs.txt", 50, SimulatedCameraBackend(0, 0, main_size),
+                          outputDir=directory / "imager", advertise=False, spoolDir=None)
+    port = free_port()
+    # serve() instead of start(): start() would power the machine off after a POWER_OFF request
+    threading.Thread(target=asyncio.run, args=(server.serve("127.0.0.1", port),), daemon=True).start()
+
+    while not server.isRunning():
+        time.sleep(0.05)
+    return server, port
+
+def time_capture(client: ImagerClientConnection, fpath: Path, parallel: int) -> float:
+    fpath.unlink(missing_ok=True)
+    start = time.perf_counter()
+    if client.capture_to_file(fpath, preview=False, parallel=parallel) is None:
+        raise RuntimeError(f"capture to {fpath} failed")
+    return time.perf_counter() - start
+
+def main() -> None:
+    argParser = argparse.ArgumentParser(description="Benchmark for parallel range transfers")
+    argParser.add_argument("--streams", type=int, nargs="+", default=[1, 2, 4], help="numbers of parallel connections to compare")
+    argParser.add_argument("--repeat", type=int, default=3)
+    argParser.add_argument("--latency-ms", type=float, default=1, help="one-way latency added by the shaping proxy")
+    argParser.add_argument("--bandwidth-mbit", type=float, default=100, help="bandwidth limit of the shaping proxy, 0 for none")
+    argParser.add_argument("--shared-bandwidth", action="store_true", help="the limit applies to all connections together")
+    argParser.add_argument("--main-size", type=parse_size, default=(8000, 6000), help="WIDTHxHEIGHT of main captures")
+    argParser.add_argument("--output", type=Path, help="write the results as JSON to this file")
+    args = argParser.parse_args()
+
+    expected = encoded_image(*args.main_size, 93)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        directory = Path(tmpdir)
+        server, port = start_server(directory, args.main_size)
+
+        proxy_args = ["--role", "proxy", "--port", str(port), "--latency-ms", str(args.latency_ms), "--bandwidth-mbit", str(args.bandwidth_mbit)]
+        proxy, port = spawn(proxy_args + (["--shared-bandwidth"] if args.shared_bandwidth else []))
+
+        client = ImagerClientConnection(lambda type, msg: print(type, msg, file=sys.stderr) if type != "INFO" else None)
+        results = []
+        try:
+            client.connect("127.0.0.1", port)
+            link = "shared" if args.shared_bandwidth else "per connection"
+            print(f"main capture {len(expected) / (1 << 20):.1f} MiB, {args.bandwidth_mbit} Mbit/s {link}, {args.latency_ms} ms latency")
+
+            for streams in args.streams:
+                fpath = directory / f"main_{streams}.jpg"
+                timings = [time_capture(client, fpath, streams) for _ in range(args.repeat)]
+                if fpath.read_bytes() != expected:
+                    raise RuntimeError(f"capture over {streams} connection(s) differs from the camera output")
+
+                result = {"streams": streams, "size": len(expected), "median_s": statistics.median(timings),
+                          "mbit_per_s": len(expected) * 8 / 1e6 / statistics.median(timings)}
+                results.append(result)
+                print(f"{streams:>3} connection(s)  {result['median_s'] * 1000:8.1f} ms  {result['mbit_per_s']:7.1f} Mbit/s  "
+                      f"({results[0]['median_s'] / result['median_s']:4.2f}x)", flush=True)
+        finally:
+            client.close()
+            server.stop()
+            server.imagerCtl.close()
+            proxy.kill()
+            proxy.wait()
+
+    if args.output is not None:
+        args.output.write_text(json.dumps({"config": {"latency_ms": args.latency_ms, "bandwidth_mbit": args.bandwidth_mbit,
+                                                      "shared_bandwidth": args.shared_bandwidth}, "results": results}, indent=2))
+
+if __name__ == "__main__":
+    main()
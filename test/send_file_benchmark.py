@@ -0,0 +1,120 @@
+# Loopback benchmark for Connection.send_file
+# Compares the buffered (read whole file) and streamed (sendfile) modes
+#
+# usage: python -m test.send_file_benchmark [--size-mb 30] [--repeat 3]
+#
+# Every run spawns a fresh sender process, so its peak RSS only reflects that mode
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import resource
+import subprocess
+import tempfile
+
+from pathlib import Path
+
+from src.connections import Connection, HEADER_SIZE
+
+RECV_BUFFER_SIZE = 1 << 20
+
+def peak_rss_kib() -> int:
+    """
+    Peak resident set size of this process in KiB
+
+    VmHWM is used where available since ru_maxrss survives exec and would report the parent's peak
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_sender(port: int, fpath: Path, mode: str) -> None:
+    """Child process: connect to the receiver and send the file once"""
+    rss_before = peak_rss_kib()
+
+    sock = socket.create_connection(("127.0.0.1", port))
+    connection = Connection(sock)
+    connection.tune_for_bulk()
+
+    ok = connection.send_file(fpath, stream=(mode == "stream"))
+    connection.close()
+
+    print(json.dumps({"ok": ok, "rss_before_kib": rss_before, "rss_peak_kib": peak_rss_kib()}))
+
+def receive_all(sock: socket.socket) -> int:
+    """Receives and discards everything sent on sock, returns byte count"""
+    buffer = bytearray(RECV_BUFFER_SIZE)
+    total = 0
+    while True:
+        n = sock.recv_into(buffer)
+        if not n:
+            return total
+        total += n
+
+def run_once(fpath: Path, mode: str) -> dict:
+    """Runs one sender process against a loopback receiver"""
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    port = server.getsockname()[1]
+
+    sender = subprocess.Popen([sys.executable, "-m", "test.send_file_benchmark",
+                               "--role", "sender", "--port", str(port),
+                               "--file", str(fpath), "--mode", mode],
+                              stdout=subprocess.PIPE)
+
+    client_socket, _ = server.accept()
+    start = time.perf_counter()
+    received = receive_all(client_socket)
+    elapsed = time.perf_counter() - start
+
+    client_socket.close()
+    server.close()
+
+    out, _ = sender.communicate()
+    result = json.loads(out)
+    result.update({
+        "mode": mode,
+        "bytes": received - HEADER_SIZE,
+        "seconds": elapsed,
+        "throughput_mib_s": (received / (1 << 20)) / elapsed if elapsed else 0.0,
+        "rss_growth_kib": result["rss_peak_kib"] - result["rss_before_kib"],
+    })
+    return result
+
+def main() -> None:
+    argParser = argparse.ArgumentParser(description="Loopback benchmark for Connection.send_file")
+    argParser.add_argument("--role", choices=["bench", "sender"], default="bench")
+    argParser.add_argument("--port", type=int)
+    argParser.add_argument("--file", type=Path)
+    argParser.add_argument("--mode", choices=["buffered", "stream"], default="stream")
+    argParser.add_argument("--size-mb", type=int, default=30, help="size of the simulated capture")
+    argParser.add_argument("--repeat", type=int, default=3)
+    args = argParser.parse_args()
+
+    if args.role == "sender":
+        run_sender(args.port, args.file, args.mode)
+        return
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        fpath = Path(tmpdir) / "main_img.jpg"
+        with fpath.open("wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1 << 20))
+
+        for mode in ["buffered", "stream"]:
+            for _ in range(args.repeat):
+                result = run_once(fpath, mode)
+                print(f"{mode:>8}: {result['throughput_mib_s']:8.1f} MiB/s, "
+                      f"peak RSS {result['rss_peak_kib']} KiB (+{result['rss_growth_kib']} KiB while sending)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+# Benchmark for streamed captures against captures written to a file on the imager first
+# Runs an ImagerServer with RpicamStillBackend driving test.fake_rpicam_still instead of rpicam-still,
+# optionally behind the shaping proxy of test.transport_benchmark, and times captures from request to
+# the last byte received, for:
+#   file    capture_to_file, the encoder writes a file on the imager which is sent once the process exited
+#   stream  capture_to_file(stream=True), the encoder's stdout is sent while it is produced
+# plus a failing encoder, whose streamed capture has to fail without leaving a file behind
+#
+# usage: python -m test.stream_capture_benchmark [--repeat 5] [--latency-ms 1] [--bandwidth-mbit 80]
+#            [--fake-startup 0.3] [--fake-rate 40] [--fake-shutdown 0.2] [--output results.json]
+
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import statistics
+
+from pathlib import Path
+
+from src.Imager.imagerServer import ImagerServer
+from src.Imager.cameraBackends import RpicamStillBackend
+from src.Client.imagerClientConnection import ImagerClientConnection
+from test.transport_benchmark import spawn
+from test.fake_rpicam_still import encoded_image
+
+MODES = {"file": False, "stream": True}
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(directory: Path, encoder: list[str]) -> tuple[ImagerServer, int]:
+    """ImagerServer on a free loopback port, capturing with the fake encoder"""
+    server = ImagerServer(directory / "imager_logs.txt", 50, RpicamStillBackend(encoder), outputDir=directory / "imager", advertise=False)
+    port = free_port()
+    # serve() instead of start(): start() would power the machine off after a POWER_OFF request
+    threading.Thread(target=asyncio.run, args=(server.serve("127.0.0.1", port),), daemon=True).start()
+
+    while not server.isRunning():
+        time.sleep(0.05)
+    return server, port
+
+def time_capture(client: ImagerClientConnection, fpath: Path, preview: bool, stream: bool) -> float:
+    start = time.perf_counter()
+    if client.capture_to_file(fpath, preview=preview, stream=stream) is None:
+        raise RuntimeError(f"capture to {fpath} failed")
+    return time.perf_counter() - start
+
+def main() -> None:
+    argParser = argparse.ArgumentParser(description="Benchmark for streamed captures")
+    argParser.add_argument("--repeat", type=int, default=5)
+    argParser.add_argument("--latency-ms", type=float, default=0, help="one-way latency added by the shaping proxy")
+    argParser.add_argument("--bandwidth-mbit", type=float, default=0, help="bandwidth limit of the shaping proxy, 0 for none")
+    argParser.add_argument("--fake-startup", type=float, default=0.3)
+    argParser.add_argument("--fake-rate", type=float, default=40)
+    argParser.add_argument("--fake-shutdown", type=float, default=0.2)
+    argParser.add_argument("--output", type=Path, help="write the results as JSON to this file")
+    args = argParser.parse_args()
+
+    encoder = [sys.executable, "-m", "test.fake_rpicam_still", "--fake-startup", str(args.fake_startup),
+               "--fake-rate", str(args.fake_rate), "--fake-shutdown", str(args.fake_shutdown)]
+    expected = {True: encoded_image(2312, 1736, 93), False: encoded_image(8000, 6000, 93)}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        directory = Path(tmpdir)
+        server, port = start_server(directory, encoder)
+
+        proxy = None
+        if args.latency_ms or args.bandwidth_mbit:
+            proxy, port = spawn(["--role", "proxy", "--port", str(port),
+                                 "--latency-ms", str(args.latency_ms), "--bandwidth-mbit", str(args.bandwidth_mbit)])
+
+        client = ImagerClientConnection(lambda type, msg: None)
+        try:
+            client.connect("127.0.0.1", port)
+
+            results = []
+            for preview in [True, False]:
+                kind = "preview" if preview else "main"
+                result = {"capture": kind, "size": len(expected[preview])}
+                for mode, stream in MODES.items():
+                    fpath = directory / f"{kind}_{mode}.jpg"
+                    timings = [time_capture(client, fpath, preview, stream) for _ in range(args.repeat)]
+                    if fpath.read_bytes() != expected[preview]:
+                        raise RuntimeError(f"{mode} {kind} capture differs from the encoder output")
+                    result[f"{mode}_s"] = statistics.median(timings)
+
+                results.append(result)
+                print(f"{kind:>8} {result['size'] / (1 << 20):5.1f} MiB  file {result['file_s'] * 1000:7.1f} ms  "
+                      f"stream {result['stream_s'] * 1000:7.1f} ms  ({result['file_s'] / result['stream_s']:4.2f}x)")
+
+            # an encoder failing halfway through must fail the capture, not leave half an image
+            server.imagerCtl.backend.command = encoder + ["--fake-fail"]
+            failed = directory / "failed.jpg"
+            kept = client.capture_to_file(failed, preview=True, stream=True) is not None or failed.exists()
+            print(f"failing encoder: {'left a file behind' if kept else 'capture failed cleanly'}")
+        finally:
+            client.close()
+            server.stop()
+            server.imagerCtl.close()
+            if proxy is not None:
+                proxy.kill()
+                proxy.wait()
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+from src.Imager.cameraBackends import FakeCameraBackend
+
+def capture_all_kinds(client, tmp_path) -> None:
+    """Preview, main, streamed and chunked captures, each of which could run an autofocus sweep"""
+    assert client.capture(preview=True, stream=False) is not None
+    assert client.capture(preview=False, stream=True) is not None
+    assert client.capture_to_file(tmp_path / "main.jpg") is not None
+
+def test_calibrated_captures_skip_autofocus(imager_server, imager_client, tmp_path):
+    backend = FakeCameraBackend()
+    server, port = imager_server(backend)
+    client = imager_client(port)
+
+    assert client.capture(preview=True, stream=False) is not None
+    assert backend.af_sweeps == 1
+
+    assert client.calibrate() is not None
+    sweeps = backend.af_sweeps
+    capture_all_kinds(client, tmp_path)
+    assert backend.af_sweeps == sweeps     # calibrated captures do not focus again
+    assert all(settings.calibration == FakeCameraBackend.calibration for settings in backend.captures[1:])
+
+    assert client.invalidate_calibration()
+    capture_all_kinds(client, tmp_path)
+    assert backend.af_sweeps == sweeps + 3
+    assert all(settings.calibration is None for settings in backend.captures[-3:])
+
+def test_session_calibrates_on_first_capture(imager_server, imager_client, tmp_path):
+    backend = FakeCameraBackend()
+    server, port = imager_server(backend, calibrationSession=True)
+    client = imager_client(port)
+
+    capture_all_kinds(client, tmp_path)
+    assert (backend.calibrations, backend.af_sweeps) == (1, 1)
+
+    assert client.invalidate_calibration()
+    capture_all_kinds(client, tmp_path)
+    assert (backend.calibrations, backend.af_sweeps) == (2, 2)
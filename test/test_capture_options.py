@@ -0,0 +1,33 @@
+from PIL import Image
+
+from src.connections import RequestType, Status, encode_json
+from src.Imager.cameraBackends import FakeCameraBackend, PREVIEW_SETTINGS
+
+def test_roi_size_and_quality_shape_the_image(imager_server, imager_client, tmp_path):
+    server, port = imager_server(FakeCameraBackend())
+    client = imager_client(port)
+
+    cropped = client.capture_to_file(tmp_path / "cropped.jpg", options={"roi": [100, 200, 500, 500]})
+    scaled = client.capture_to_file(tmp_path / "scaled.jpg", options={"roi": [100, 200, 500, 500], "size": [160, 120]})
+    coarse = client.capture_to_file(tmp_path / "coarse.jpg", preview=True, options={"quality": 10})
+    fine = client.capture_to_file(tmp_path / "fine.jpg", preview=True, options={"quality": 95})
+
+    assert Image.open(cropped).size == (400, 300)
+    assert Image.open(scaled).size == (160, 120)
+    assert Image.open(fine).size == (PREVIEW_SETTINGS.width, PREVIEW_SETTINGS.height)
+    # coarser quantization at the lower quality
+    assert Image.open(coarse).quantization[0][0] > Image.open(fine).quantization[0][0]
+
+def test_invalid_options_are_bad_requests(imager_server, imager_client):
+    server, port = imager_server(FakeCameraBackend())
+    client = imager_client(port)
+
+    for request_type, params in [
+        (RequestType.CAPTURE_PREVIEW, {"roi": [0, 0, PREVIEW_SETTINGS.width + 1, 100]}),   # inside a main frame only
+        (RequestType.CAPTURE_MAIN, {"roi": [0, 0, 100, 100], "gray": "false"}),
+        (RequestType.CAPTURE_MAIN, {"gray": 1}),
+    ]:
+        response = client.wait_reply(client.request(request_type, encode_json(params)))
+        assert response.status == Status.BAD_REQUEST, params
+
+    assert client.wait_reply(client.request(RequestType.CAPTURE_PREVIEW, encode_json({"gray": False}))).status == Status.OK
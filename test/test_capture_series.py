@@ -0,0 +1,135 @@
+import time
+import threading
+
+from pathlib import Path
+
+from src.connections import RequestType, Status, encode_json, decode_json
+from src.Client import imagerClientConnection
+from src.Client.imagerClient import ImagerClient
+from src.Client.imagerClientConnection import SeriesDownload
+from test.conftest import NoiseCameraBackend
+
+def wait_for(condition, timeout: float = 20) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+def test_reattach_after_half_open_drop(imager_server, link_proxy, tmp_path):
+    backend = NoiseCameraBackend(4 << 20)   # large enough to block the stale sender on the dead link
+    server, port = imager_server(backend, spoolDir=tmp_path / "spool")
+    proxy = link_proxy(port)
+    proxy.half_open = True
+
+    logs = []
+    client = ImagerClient(lambda type, msg: logs.append(msg))
+    try:
+        assert client.imagerConnection.connect("127.0.0.1", proxy.port) is not None
+
+        saved = []
+        assert client.capture_series(tmp_path, 0.5, 6, False, saved.append)
+        assert wait_for(lambda: len(saved) >= 2)
+
+        proxy.cut(*proxy.links[0])      # the server does not notice, its request stays attached
+        assert wait_for(lambda: not client.is_series_running(), 40), logs
+        assert not any("no longer holds" in msg for msg in logs), logs
+        assert any("complete" in msg for msg in logs), logs
+        assert proxy.connections >= 2
+
+        # frames the stale sender wrote into the dead link stayed spooled
+        (tmp_path / "pulled").mkdir()
+        assert client.sync_spool(tmp_path / "pulled") is not None
+        received = {path.read_bytes() for path in tmp_path.glob("series_*")} | \
+                   {path.read_bytes() for path in (tmp_path / "pulled").glob("spooled_*")}
+        assert received == set(backend.written)
+    finally:
+        client.close()
+
+def test_unspooled_frames_survive_a_dropped_link(imager_server, link_proxy, tmp_path, monkeypatch):
+    # the link swallows frames the imager already handed to the kernel until the heartbeat gives up on it
+    monkeypatch.setattr(imagerClientConnection, "HEARTBEAT_INTERVAL", 0.2)
+    monkeypatch.setattr(imagerClientConnection, "HEARTBEAT_TIMEOUT", 0.8)
+
+    backend = NoiseCameraBackend(64 << 10)
+    server, port = imager_server(backend)
+    proxy = link_proxy(port)
+
+    logs = []
+    client = ImagerClient(lambda type, msg: logs.append(msg))
+    try:
+        assert client.imagerConnection.connect("127.0.0.1", proxy.port) is not None
+
+        saved = []
+        assert client.capture_series(tmp_path, 0.3, 8, False, saved.append)
+        assert wait_for(lambda: len(saved) >= 2)
+
+        proxy.blackhole(*proxy.links[0])
+        assert wait_for(lambda: not client.is_series_running(), 40), logs
+        assert proxy.connections >= 2
+
+        assert len(saved) == len(set(saved)) == 8    # frames sent again after the re-attach are not passed on twice
+        assert sorted(path.name[-9:] for path in saved) == [f"_{index:04d}.jpg" for index in range(1, 9)]
+        assert [path.read_bytes() for path in sorted(saved)] == backend.written
+        assert wait_for(lambda: not server.series, 5)
+        assert not any(server.scheduler.output_dir.glob("series_*"))
+    finally:
+        client.close()
+
+def test_gray_frames_keep_their_suffix(imager_server, imager_client, tmp_path):
+    server, port = imager_server()
+    connection = imager_client(port)
+
+    saved = []
+    download = SeriesDownload(tmp_path, "gray", saved.append)
+    future = connection.capture_series(download, 0.5, 2, True, {"gray": True, "size": [64, 48]})
+    assert future.result(20).status == Status.OK
+
+    assert [path.name for path in saved] == ["gray_0001.png", "gray_0002.png"]
+    assert all(path.read_bytes().startswith(b"\x89PNG") for path in saved)
+
+def test_uncollected_series_is_evicted(imager_server, imager_client, tmp_path):
+    server, port = imager_server(seriesTtl=0.5, spoolDir=None)
+    connection = imager_client(port)
+
+    started = threading.Event()
+    future = connection.request(RequestType.CAPTURE_SERIES, encode_json({"interval": 0.5, "count": 2, "resolution": "preview"}),
+                                on_meta=lambda meta: started.set())
+    assert started.wait(5)
+    connection.close()      # nobody collects the frames
+
+    assert wait_for(lambda: not server.series, 10)
+    assert not any((server.scheduler.output_dir).glob("series_*"))
+
+    reattach = imager_client(port)
+    response = reattach.request(RequestType.CAPTURE_SERIES, encode_json({"series_id": 1})).result(5)
+    assert response.code == Status.FAILED.value
+    assert decode_json(response.body) == {"reason": "unknown"}
+
+def test_series_skips_a_frame_evicted_from_the_spool(imager_server, tmp_path, monkeypatch):
+    backend = NoiseCameraBackend(64 << 10)
+    server, port = imager_server(backend, spoolDir=tmp_path / "spool")
+
+    checkout = server.spool.checkout
+    evicted = []
+    def evicting_checkout(entry):
+        if not evicted:         # the first frame is dropped between lookup and checkout
+            evicted.append(entry.spool_id)
+            raise FileNotFoundError(entry.name)
+        return checkout(entry)
+    monkeypatch.setattr(server.spool, "checkout", evicting_checkout)
+
+    logs = []
+    client = ImagerClient(lambda type, msg: logs.append(msg))
+    try:
+        assert client.imagerConnection.connect("127.0.0.1", port) is not None
+
+        saved = []
+        assert client.capture_series(tmp_path, 0.5, 3, False, saved.append)
+        assert wait_for(lambda: not client.is_series_running()), logs
+    finally:
+        client.close()
+
+    assert evicted and len(saved) == 2
+    assert {path.read_bytes() for path in saved} == set(backend.written[1:])
@@ -0,0 +1,58 @@
+import os
+import threading
+
+from src.Imager.captureSpool import CaptureSpool
+
+SIZE = 1 << 20
+
+def make_capture(directory, name: str):
+    path = directory / name
+    path.write_bytes(os.urandom(SIZE))
+    return path
+
+def test_restart_keeps_foreign_files(tmp_path):
+    spool_dir = tmp_path / "spool"
+    spool = CaptureSpool(spool_dir, min_free=0)
+    kept = spool.add(make_capture(tmp_path, "frame.jpg"))
+    acked = spool.add(make_capture(tmp_path, "frame.jpg"))
+    spool.ack([acked.spool_id])
+
+    leftovers = [f"{acked.spool_id:08d}.jpg", f"checkout_{kept.spool_id:08d}_123.jpg", "manifest.part"]
+    foreign = ["notes.txt", "12345.jpg", "checkout.jpg"]
+    for name in leftovers + foreign:
+        (spool_dir / name).write_bytes(b"x")
+
+    restarted = CaptureSpool(spool_dir, min_free=0)
+    assert [entry.spool_id for entry in restarted.list_entries()] == [kept.spool_id]
+    assert sorted(path.name for path in spool_dir.iterdir()) == sorted([kept.name, "manifest.json"] + foreign)
+
+def test_concurrent_adds_stay_within_quota(tmp_path):
+    spool = CaptureSpool(tmp_path / "spool", max_bytes=3 * SIZE, min_free=0, policy="refuse-new")
+    captures = [make_capture(tmp_path, f"frame_{i}.jpg") for i in range(8)]
+
+    barrier = threading.Barrier(len(captures))
+    results = []
+    def add(path) -> None:
+        barrier.wait()
+        results.append(spool.add(path))
+
+    threads = [threading.Thread(target=add, args=(path,)) for path in captures]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len([entry for entry in results if entry is not None]) == 3
+    assert spool.bytes() == 3 * SIZE
+    assert spool.reserved == 0
+
+def test_fetch_of_a_vanished_capture_fails_cleanly(imager_server, imager_client, tmp_path):
+    server, port = imager_server(spoolDir=tmp_path / "spool")
+    gone = server.spool.add(make_capture(tmp_path, "gone.jpg"))
+    kept = server.spool.add(make_capture(tmp_path, "kept.jpg"))
+    server.spool.path(gone).unlink()    # evicted between lookup and checkout
+    client = imager_client(port)
+
+    assert client.fetch_spooled(gone.spool_id, tmp_path / "gone_fetched.jpg") is None
+    assert client.fetch_spooled(kept.spool_id, tmp_path / "kept_fetched.jpg") is not None
+    assert (tmp_path / "kept_fetched.jpg").read_bytes() == server.spool.path(kept).read_bytes()
@@ -0,0 +1,24 @@
+from src.Client.imagerClientConnection import ImagerClientConnection
+from src.Imager.cameraBackends import FakeCameraBackend
+
+def test_timing_breaks_down_every_capture(imager_server, tmp_path):
+    server, port = imager_server(FakeCameraBackend(latency=0.2, autofocus=0.1, encode=0.1))
+
+    timings = []
+    connection = ImagerClientConnection(lambda type, msg: None, on_timing=timings.append)
+    try:
+        assert connection.connect("127.0.0.1", port) is not None
+        assert connection.capture_to_file(tmp_path / "main.jpg") is not None
+        assert connection.capture(preview=True, stream=False) is not None
+    finally:
+        connection.close()
+
+    assert len(timings) == 2
+    for timing in timings:
+        report = timing.report()
+        assert list(report["phases"]) == ["pause_preview", "autofocus", "capture", "encode", "write"]
+        assert report["phases"]["capture"] >= 0.2
+        assert {"capture_id", "total_s", "queue_s", "capture_s", "receive_s"} <= set(report)
+        assert all(seconds >= 0 for seconds in report["phases"].values())
+        assert all(report[name] >= 0 for name in ["total_s", "queue_s", "capture_s", "receive_s"])
+        assert report["total_s"] >= report["capture_s"] >= sum(report["phases"].values()) - 0.01
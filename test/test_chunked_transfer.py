@@ -0,0 +1,56 @@
+import re
+
+from src.connections import TRANSFER_CHUNK_SIZE, partial_path
+from src.Client.imagerClientConnection import ImagerClientConnection
+from test.conftest import NoiseCameraBackend
+
+SIZE = 5 * TRANSFER_CHUNK_SIZE + 12345
+
+def capture_through(proxy, path, logs: list) -> bool:
+    connection = ImagerClientConnection(lambda type, msg: logs.append(msg))
+    try:
+        assert connection.connect("127.0.0.1", proxy.port) is not None
+        return connection.capture_to_file(path) is not None
+    finally:
+        connection.close()
+
+def resumed_offsets(logs: list) -> list[int]:
+    return [int(match.group(1)) for msg in logs if (match := re.match(r"resuming transfer \d+ at (\d+)/", msg))]
+
+def assert_transfer_done(server, backend, path) -> None:
+    assert path.read_bytes() == backend.written[0]
+    assert not partial_path(path).exists()
+    assert not server.transfers.transfers   # acknowledged, the imager's copy is gone
+    assert not [child for child in server.scheduler.output_dir.iterdir() if child.is_file()]
+
+def test_resumes_after_connection_cut(imager_server, link_proxy, tmp_path):
+    backend = NoiseCameraBackend(SIZE)
+    server, port = imager_server(backend)
+    proxy = link_proxy(port)
+    proxy.cut_at = 2 * TRANSFER_CHUNK_SIZE + TRANSFER_CHUNK_SIZE // 2
+
+    logs = []
+    path = tmp_path / "main.jpg"
+    assert capture_through(proxy, path, logs), logs
+
+    offsets = resumed_offsets(logs)
+    assert len(offsets) == 1, logs
+    assert offsets[0] == 2 * TRANSFER_CHUNK_SIZE   # the last intact offset, not the start of the file
+    assert proxy.connections == 2
+    assert proxy.downstream < proxy.cut_at + (SIZE - offsets[0]) + TRANSFER_CHUNK_SIZE // 8
+    assert_transfer_done(server, backend, path)
+
+def test_resumes_after_corrupt_chunk(imager_server, link_proxy, tmp_path):
+    backend = NoiseCameraBackend(SIZE)
+    server, port = imager_server(backend)
+    proxy = link_proxy(port)
+    proxy.corrupt_at = TRANSFER_CHUNK_SIZE + TRANSFER_CHUNK_SIZE // 2     # inside the second chunk
+
+    logs = []
+    path = tmp_path / "main.jpg"
+    assert capture_through(proxy, path, logs), logs
+
+    assert any("failed its checksum" in msg for msg in logs), logs
+    assert resumed_offsets(logs) == [TRANSFER_CHUNK_SIZE]
+    assert proxy.connections == 1   # resumed on the same connection
+    assert_transfer_done(server, backend, path)
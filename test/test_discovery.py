@@ -0,0 +1,48 @@
+import time
+
+from src.Client import imagerBrowser, imagerClientConnection
+from src.Client.imagerBrowser import ImagerBrowser
+from src.Client.imagerClientConnection import ImagerClientConnection, PROTOCOL_PORT
+
+class SlowBrowser:
+    def __init__(self) -> None:
+        """Service browser that knows no imager, waits count the lookups that would block"""
+        self.waits = 0
+
+    def lookup(self, hostname: str, timeout: float = 0):
+        if timeout > 0:
+            self.waits += 1
+            time.sleep(timeout)
+
+def test_failed_browser_is_retried_after_a_backoff(monkeypatch):
+    starts = []
+
+    def start(self) -> None:
+        starts.append(self)
+        raise OSError("no multicast")
+
+    monkeypatch.setattr(ImagerBrowser, "start", start)
+    monkeypatch.setattr(imagerBrowser, "shared_browser", None)
+    monkeypatch.setattr(imagerBrowser, "browser_retry_at", 0.0)
+    monkeypatch.setattr(imagerBrowser, "browser_retry_delay", 60)
+
+    assert imagerBrowser.get_browser() is None
+    assert imagerBrowser.get_browser() is None
+    assert len(starts) == 1
+
+    monkeypatch.setattr(imagerBrowser, "browser_retry_at", 0.0)    # the backoff is over
+    assert imagerBrowser.get_browser() is None
+    assert len(starts) == 2
+    assert imagerBrowser.browser_retry_delay == 240
+
+def test_addresses_and_resolvable_names_skip_the_browser_wait(monkeypatch):
+    browser = SlowBrowser()
+    monkeypatch.setattr(imagerClientConnection, "get_browser", lambda: browser)
+
+    connection = ImagerClientConnection(lambda type, msg: None)
+    assert connection.discover("127.0.0.1") == ("127.0.0.1", PROTOCOL_PORT)
+    assert connection.discover("localhost") == ("127.0.0.1", PROTOCOL_PORT)
+    assert browser.waits == 0
+
+    assert connection.discover("no-such-imager.invalid") is None
+    assert browser.waits == 1
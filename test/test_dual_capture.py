@@ -0,0 +1,70 @@
+import io
+import sys
+import time
+import threading
+
+from PIL import Image
+
+from src.connections import RequestType, Status, encode_json
+from src.Imager.cameraBackends import FakeCameraBackend, RpicamStillBackend, DUAL_PREVIEW_SIZE, EXIF_THUMBNAIL_SIZE
+from src.Client.imagerClient import ImagerClient
+from test.fake_rpicam_still import encoded_image, with_exif_thumbnail
+
+def capture_with_preview(port: int, path, options=None) -> tuple[bytes, float, float]:
+    """Dual capture through ImagerClient, returns the preview and the seconds until each future resolved"""
+    logs = []
+    client = ImagerClient(lambda type, msg: logs.append(msg))
+    try:
+        assert client.imagerConnection.connect("127.0.0.1", port) is not None
+
+        started = time.monotonic()
+        resolved = {}
+        done = threading.Event()
+        preview, main = client.capture_main_with_preview(path, options)
+        preview.add_done_callback(lambda future: resolved.setdefault("preview", time.monotonic() - started))
+        main.add_done_callback(lambda future: (resolved.setdefault("main", time.monotonic() - started), done.set()))
+
+        assert done.wait(30)
+        assert main.result() == path, logs
+        assert preview.result() is not None, logs
+        return preview.result(), resolved["preview"], resolved["main"]
+    finally:
+        client.close()
+
+def test_preview_resolves_before_main(imager_server, tmp_path):
+    server, port = imager_server(FakeCameraBackend(encode=1.0))
+
+    preview, preview_s, main_s = capture_with_preview(port, tmp_path / "main.jpg")
+
+    assert preview_s + 0.8 < main_s     # the preview does not wait for the main image's encode
+    with Image.open(io.BytesIO(preview)) as image:
+        assert image.width <= DUAL_PREVIEW_SIZE[0] and image.height <= DUAL_PREVIEW_SIZE[1]
+
+def test_preview_is_sent_ahead_of_the_capture_report(imager_server, imager_client):
+    server, port = imager_server(FakeCameraBackend(encode=0.3))
+    connection = imager_client(port)
+
+    events = []
+    future = connection.request(RequestType.CAPTURE_MAIN, encode_json({"preview": True}),
+                                on_meta=lambda meta: events.append(("meta", set(meta))),
+                                on_data=lambda data: events.append(("data", bytes(data[:2]))))
+    response = future.result(10)
+    assert response.status == Status.OK and response.body
+
+    kinds = [kind if kind == "data" else next(key for key in ["preview", "wait_s", "queue_position"] if key in keys)
+             for kind, keys in events]
+    assert kinds == ["queue_position", "preview", "data", "wait_s"]
+    assert events[2][1] == b"\xff\xd8"
+
+def test_rpicam_preview_comes_from_the_exif_thumbnail(imager_server, tmp_path):
+    encoder = [sys.executable, "-m", "test.fake_rpicam_still", "--fake-startup", "0", "--fake-shutdown", "0", "--fake-rate", "0.5"]
+    server, port = imager_server(RpicamStillBackend(encoder))
+
+    path = tmp_path / "main.jpg"
+    preview, preview_s, main_s = capture_with_preview(port, path, {"size": [2312, 1736], "quality": 80})
+
+    assert preview_s + 0.2 < main_s     # read from the start of the output, while the rest is still written
+    with Image.open(io.BytesIO(preview)) as image:
+        assert image.width <= EXIF_THUMBNAIL_SIZE[0] and image.height <= EXIF_THUMBNAIL_SIZE[1]
+        thumb = f"{image.width}:{image.height}:80"
+    assert path.read_bytes() == with_exif_thumbnail(encoded_image(2312, 1736, 80), thumb)
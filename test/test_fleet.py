@@ -0,0 +1,94 @@
+import time
+import threading
+
+from src.Client.imagerFleet import ImagerFleet
+from test.conftest import NoiseCameraBackend
+
+class BarrierCameraBackend(NoiseCameraBackend):
+    def __init__(self, barrier: threading.Barrier, size: int) -> None:
+        """Fake camera that only captures once every device of the fleet is capturing"""
+        super().__init__(size)
+        self.barrier = barrier
+
+    def capture(self, settings, output, timer) -> None:
+        self.barrier.wait()     # breaks (failing the capture) unless all captures run at once
+        super().capture(settings, output, timer)
+
+def test_parallel_capture_writes_one_folder_per_device(imager_server, tmp_path):
+    barrier = threading.Barrier(3, timeout=10)
+    backends = [BarrierCameraBackend(barrier, 1 << 16) for _ in range(3)]
+    ports = [imager_server(backend)[1] for backend in backends]
+
+    logs = []
+    fleet = ImagerFleet(lambda type, msg: logs.append(msg))
+    try:
+        for port in ports:
+            assert fleet.add(f"127.0.0.1:{port}") is not None, logs
+
+        saved = fleet.capture(tmp_path / "fleet")
+    finally:
+        for device in fleet.select():
+            fleet.remove(device.name)
+
+    assert not barrier.broken
+    assert len(saved) == 3 and all(path is not None for path in saved.values()), logs
+
+    for backend, port in zip(backends, ports):
+        folder = tmp_path / "fleet" / f"127.0.0.1_{port}"
+        images = list(folder.iterdir())
+        assert len(images) == 1 and images[0].name.endswith("_main.jpg")
+        assert images[0].read_bytes() == backend.written[0]
+    assert len(list((tmp_path / "fleet").iterdir())) == 3
+
+def test_concurrent_adds_share_one_client(imager_server, tmp_path):
+    server, port = imager_server()
+
+    fleet = ImagerFleet(lambda type, msg: None)
+    added = []
+    try:
+        threads = [threading.Thread(target=lambda: added.append(fleet.add(f"127.0.0.1:{port}"))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+
+        assert len(added) == 4 and added[0] is not None
+        assert all(device is added[0] for device in added)
+        assert len(fleet.select()) == 1
+        assert len(server.clients) == 1
+    finally:
+        for device in fleet.select():
+            fleet.remove(device.name)
+
+def test_back_to_back_captures_keep_every_image(imager_server, tmp_path):
+    server, port = imager_server()
+
+    fleet = ImagerFleet(lambda type, msg: None)
+    try:
+        assert fleet.add(f"127.0.0.1:{port}") is not None
+        saved = [fleet.capture(tmp_path / "fleet", preview=True) for _ in range(3)]
+    finally:
+        for device in fleet.select():
+            fleet.remove(device.name)
+
+    paths = {path for capture in saved for path in capture.values()}
+    assert len(paths) == 3 and all(path.exists() for path in paths)
+
+def test_series_status_ends_with_the_series(imager_server, tmp_path):
+    server, port = imager_server()
+
+    fleet = ImagerFleet(lambda type, msg: None)
+    try:
+        device = fleet.add(f"127.0.0.1:{port}")
+        assert fleet.capture_series(tmp_path / "fleet", 0.5, 2, True, lambda path: None) == {device.name: True}
+        assert device.status == "series"
+
+        deadline = time.monotonic() + 10
+        while device.status == "series":
+            assert time.monotonic() < deadline, "series did not end"
+            time.sleep(0.05)
+        assert device.status == "connected"
+        assert len(list(device.folder(tmp_path / "fleet").iterdir())) == 2
+    finally:
+        for device in fleet.select():
+            fleet.remove(device.name)
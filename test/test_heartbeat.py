@@ -0,0 +1,69 @@
+from src.connections import TRANSFER_CHUNK_SIZE
+from src.Client import imagerClientConnection
+from src.Client.imagerClientConnection import ImagerClientConnection
+from src.Imager.cameraBackends import FakeCameraBackend
+from test.conftest import NoiseCameraBackend
+
+def test_slow_body_keeps_connection_alive(imager_server, link_proxy, tmp_path, monkeypatch):
+    # a chunk takes a second to arrive, the heartbeat queued behind it would time out several times over
+    monkeypatch.setattr(imagerClientConnection, "HEARTBEAT_INTERVAL", 0.2)
+    monkeypatch.setattr(imagerClientConnection, "HEARTBEAT_TIMEOUT", 0.4)
+
+    backend = NoiseCameraBackend(TRANSFER_CHUNK_SIZE + TRANSFER_CHUNK_SIZE // 2)
+    server, port = imager_server(backend)
+    proxy = link_proxy(port)
+    proxy.rate = TRANSFER_CHUNK_SIZE
+
+    logs = []
+    path = tmp_path / "main.jpg"
+    connection = ImagerClientConnection(lambda type, msg: logs.append(msg))
+    try:
+        assert connection.connect("127.0.0.1", proxy.port) is not None
+        assert connection.capture_to_file(path) is not None, logs
+    finally:
+        connection.close()
+
+    assert path.read_bytes() == backend.written[0]
+    assert proxy.connections == 1, logs
+    assert not any("lost connection" in msg for msg in logs), logs
+
+def test_slow_capture_outlives_reply_timeout(imager_server, tmp_path, monkeypatch):
+    # the capture takes longer than the reply timeout, the heartbeat shows the connection is alive meanwhile
+    monkeypatch.setattr(imagerClientConnection, "REPLY_TIMEOUT", 0.5)
+    monkeypatch.setattr(imagerClientConnection, "HEARTBEAT_INTERVAL", 0.1)
+    monkeypatch.setattr(imagerClientConnection, "HEARTBEAT_TIMEOUT", 0.4)
+
+    server, port = imager_server(FakeCameraBackend(latency=1.5))
+
+    logs = []
+    path = tmp_path / "main.jpg"
+    connection = ImagerClientConnection(lambda type, msg: logs.append(msg))
+    try:
+        assert connection.connect("127.0.0.1", port) is not None
+        assert connection.capture_to_file(path) is not None, logs
+    finally:
+        connection.close()
+
+    assert path.stat().st_size > 0
+
+def test_reply_timeout_keeps_connection(imager_server, tmp_path, monkeypatch):
+    # no heartbeat within the reply timeout, the capture is given up but the connection stays up
+    monkeypatch.setattr(imagerClientConnection, "REPLY_TIMEOUT", 0.5)
+
+    server, port = imager_server(FakeCameraBackend(latency=1.5))
+
+    logs = []
+    connection = ImagerClientConnection(lambda type, msg: logs.append(msg))
+    try:
+        assert connection.connect("127.0.0.1", port) is not None
+        before = connection.connection
+
+        assert connection.capture_to_file(tmp_path / "main.jpg") is None
+        assert not (tmp_path / "main.jpg").exists()
+        assert connection.check_connection() is before, logs
+        assert connection.list_captures() is not None
+    finally:
+        connection.close()
+
+    assert any("no reply to CAPTURE_MAIN" in msg for msg in logs), logs
+    assert not any("lost connection" in msg for msg in logs), logs
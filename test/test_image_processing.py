@@ -0,0 +1,28 @@
+import pytest
+
+from PIL import Image
+
+pytest.importorskip("cv2")
+pytest.importorskip("skimage")
+image_processing = pytest.importorskip("src.Client.pyCOLONY.image_processing")
+
+DISH_SIZE = image_processing.DISH_SIZE
+
+@pytest.mark.parametrize("mode", ["RGB", "L"])
+def test_full_frames_are_cropped_to_the_dish(tmp_path, mode):
+    path = tmp_path / "full.png"
+    Image.new(mode, (8000, 6000), color=80 if mode == "L" else (30, 60, 90)).save(path)
+
+    properties, images = image_processing.process1(path)
+
+    assert images["original"].shape[:2] == (DISH_SIZE[1], DISH_SIZE[0])
+
+@pytest.mark.parametrize("mode", ["RGB", "L"])
+def test_captures_cropped_on_the_imager_are_kept_whole(tmp_path, mode):
+    path = tmp_path / "dish.png"
+    Image.new(mode, DISH_SIZE, color=80 if mode == "L" else (30, 60, 90)).save(path)
+
+    properties, images = image_processing.process1(path)
+
+    assert images["original"].shape[:2] == (DISH_SIZE[1], DISH_SIZE[0])
+    assert images["original"].ndim == (2 if mode == "L" else 3)
@@ -0,0 +1,33 @@
+from src.Client import imagerClientConnection
+from test.conftest import NoiseCameraBackend
+
+def test_ranges_reassemble_the_image_over_pooled_connections(imager_server, imager_client, link_proxy, tmp_path, monkeypatch):
+    monkeypatch.setattr(imagerClientConnection, "RANGE_SIZE", 64 << 10)
+
+    backend = NoiseCameraBackend((1 << 20) + 12345)
+    server, port = imager_server(backend)
+    proxy = link_proxy(port)
+    client = imager_client(proxy.port)
+
+    first = client.capture_to_file(tmp_path / "first.jpg", parallel=3)
+    pool = client.range_pool
+    second = client.capture_to_file(tmp_path / "second.jpg", parallel=3)
+
+    assert first.read_bytes() == backend.written[0]
+    assert second.read_bytes() == backend.written[1]
+    assert client.range_pool is pool    # threads and connections kept for the next transfer
+    assert proxy.connections <= 1 + 3
+
+def test_parallel_is_capped_by_the_imagers_connection_limit(imager_server, imager_client, link_proxy, tmp_path, monkeypatch):
+    monkeypatch.setattr(imagerClientConnection, "RANGE_SIZE", 64 << 10)
+
+    backend = NoiseCameraBackend(1 << 20)
+    server, port = imager_server(backend, maxConnections=3)
+    proxy = link_proxy(port)
+    client = imager_client(proxy.port)
+
+    path = client.capture_to_file(tmp_path / "main.jpg", parallel=4)
+
+    assert path.read_bytes() == backend.written[0]
+    assert client.range_pool.size == 2
+    assert proxy.connections <= 3   # none refused
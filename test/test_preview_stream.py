@@ -0,0 +1,84 @@
+import time
+import threading
+
+from src.Imager.previewStream import PreviewStream, FakeFrameSource
+from src.Imager.cameraBackends import FakeCameraBackend
+
+def test_slow_reader_skips_to_newest_frame():
+    source = FakeFrameSource(framerate=100)
+    stream = PreviewStream(source)
+    stream.subscribe()
+    try:
+        sequences = []
+        sequence = 0
+        for _ in range(5):
+            latest = stream.wait_frame(sequence)
+            assert latest is not None
+            sequence = latest[0]
+            sequences.append(sequence)
+            time.sleep(0.1)     # a slow subscriber, about 10 frames are produced meanwhile
+    finally:
+        stream.unsubscribe()
+
+    gaps = [later - earlier for earlier, later in zip(sequences, sequences[1:])]
+    assert all(gap > 1 for gap in gaps), gaps
+    assert source.produced >= sequences[-1]
+
+def test_source_runs_only_while_subscribed():
+    source = FakeFrameSource(framerate=100)
+    stream = PreviewStream(source)
+
+    stream.subscribe()
+    assert stream.wait_frame(0) is not None
+    stream.unsubscribe()
+
+    produced = source.produced
+    time.sleep(0.1)
+    assert source.produced == produced
+    assert stream.wait_frame(0, timeout=0.1) is None
+
+def test_server_caps_stream_at_requested_fps(imager_server, imager_client):
+    backend = FakeCameraBackend()   # preview source runs at 15 fps
+    server, port = imager_server(backend)
+    client = imager_client(port)
+
+    frames = []
+    received = threading.Event()
+    def on_frame(frame: bytearray) -> None:
+        frames.append(frame)
+        received.set()
+
+    assert client.start_preview_stream(on_frame, fps=2) is not None
+    assert received.wait(5)
+    started = time.monotonic()
+    count = len(frames)
+    time.sleep(2)
+    sent = len(frames) - count
+    elapsed = time.monotonic() - started
+    client.stop_preview_stream()
+
+    produced = server.preview_stream.source.produced
+    assert sent <= 2 * elapsed + 1, sent
+    assert sent >= 2
+    assert produced > 3 * sent  # the source kept running at its own rate, frames were dropped rather than queued
+    assert all(frame[:2] == b"\xff\xd8" for frame in frames)
+
+class ThreadRecordingBackend(FakeCameraBackend):
+    def capture(self, settings, output, timer) -> None:
+        self.thread_name = threading.current_thread().name
+        super().capture(settings, output, timer)
+
+def test_streams_leave_camera_worker_free(imager_server, imager_client, tmp_path):
+    backend = ThreadRecordingBackend()
+    server, port = imager_server(backend)
+    client = imager_client(port)
+
+    for _ in range(12):     # more streams than a Pi's default executor has threads
+        assert client.start_preview_stream(lambda frame: None, fps=15) is not None
+    time.sleep(0.5)
+
+    started = time.monotonic()
+    assert client.capture_to_file(tmp_path / "main.jpg", options={"size": [320, 240]}) is not None
+    assert time.monotonic() - started < 3
+    assert backend.thread_name.startswith("camera")
+    client.stop_preview_stream()
@@ -0,0 +1,25 @@
+from PIL import Image
+
+from src.Imager.cameraBackends import FakeCameraBackend
+
+def test_oldest_capture_is_evicted_and_variants_are_scaled(imager_server, imager_client, tmp_path):
+    limit = 3
+    server, port = imager_server(FakeCameraBackend(), recentCount=limit)
+    client = imager_client(port)
+
+    for i in range(limit + 1):
+        assert client.capture_to_file(tmp_path / f"capture_{i}.jpg", preview=True, options={"roi": [0, 0, 800, 600]})
+
+    captures = client.list_captures()
+    assert len(captures) == limit
+    ids = [capture["capture_id"] for capture in captures]
+    assert ids == sorted(ids)   # oldest first
+
+    first = ids[0] - 1          # the first capture, evicted by the last
+    assert client.fetch_capture(first, tmp_path / "evicted.jpg") is None
+
+    full = client.fetch_capture(ids[-1], tmp_path / "full.jpg")
+    assert full.read_bytes() == (tmp_path / f"capture_{limit}.jpg").read_bytes()
+
+    variant = client.fetch_capture(ids[0], tmp_path / "variant.jpg", size=(200, 150))
+    assert Image.open(variant).size == (200, 150)
@@ -0,0 +1,186 @@
+import os
+import time
+import socket
+import struct
+import threading
+
+import pytest
+
+from src.connections import Connection, MAX_REQUEST_SIZE, MessageKind, RequestType, Status, \
+                            pack_frame_header, rtob, encode_json, decode_json, PROTOCOL_VERSIONS, HEADER_FRMT
+from src.exceptions import SocketReceivedBytesEmpty, MessageTooLarge
+from src.Imager.imagerServer import ImagerServer
+from src.Imager.cameraBackends import FakeCameraBackend
+from src.Client import imagerClientConnection
+from src.Client.imagerClientConnection import ImagerClientConnection
+from test.load_harness import free_port
+
+def open_connection(port: int) -> Connection:
+    sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+    return Connection(sock)
+
+def test_empty_v1_body_is_check_connected(imager_server):
+    server, port = imager_server()
+    connection = open_connection(port)
+    try:
+        assert connection.send_fmsg(b"")
+        assert connection.recv_fmsg() == b""    # answered like CHECK_CONNECTED, connection stays up
+        assert connection.send_fmsg(rtob(RequestType.CHECK_CONNECTED))
+        assert connection.recv_fmsg() == b""
+    finally:
+        connection.close()
+
+def test_oversized_frame_is_refused(imager_server):
+    server, port = imager_server()
+    connection = open_connection(port)
+    try:
+        connection.send_fmsg(rtob(RequestType.HELLO) + encode_json({"versions": PROTOCOL_VERSIONS}))
+        assert decode_json(connection.recv_fmsg())["version"] == 2
+
+        connection.sock.sendall(pack_frame_header(MessageKind.REQUEST, RequestType.CHECK_CONNECTED, 1, MAX_REQUEST_SIZE + 1))
+        assert connection.sock.recv(1) == b""   # dropped without reading (or allocating) the body
+    finally:
+        connection.close()
+
+def test_oversized_body_is_refused_by_the_client():
+    imager, client = socket.socketpair()
+    connection = Connection(client, max_body_size=1 << 16)
+    try:
+        imager.sendall(pack_frame_header(MessageKind.RESPONSE, Status.OK, 1, 1 << 40))
+        with pytest.raises(MessageTooLarge):
+            connection.recv_frame()     # refused before anything is allocated
+
+        imager.sendall(struct.pack(HEADER_FRMT, 1 << 40))
+        with pytest.raises(MessageTooLarge):
+            connection.recv_fmsg()
+
+        with pytest.raises(MessageTooLarge):
+            connection.chunk_buffer(1 << 40, bytearray(16))
+    finally:
+        connection.close()
+        imager.close()
+
+def test_replies_are_matched_by_request_id(imager_server, imager_client):
+    server, port = imager_server(FakeCameraBackend(latency=1.0))
+    connection = imager_client(port)
+
+    capture = connection.request(RequestType.CAPTURE_MAIN)
+    ping = connection.request(RequestType.CHECK_CONNECTED)
+    assert ping.request_id != capture.request_id
+
+    # the fast request sent second is answered while the slow one is still on the camera
+    assert ping.result(0.8).request_id == ping.request_id
+    assert not capture.done()
+
+    response = capture.result(10)
+    assert response.request_id == capture.request_id
+    assert response.status == Status.OK and response.body.startswith(b"\xff\xd8")
+
+class V1Stub:
+    def __init__(self, image: bytes) -> None:
+        """Imager predating version negotiation: ignores HELLO, answers CHECK_CONNECTED and captures lock-step"""
+        self.image = image
+        self.requests: list[int] = []
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self.__accept, daemon=True).start()
+
+    def __accept(self) -> None:
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.__serve, args=(Connection(sock),), daemon=True).start()
+
+    def __serve(self, connection: Connection) -> None:
+        try:
+            while True:
+                request = connection.recv_fmsg()
+                self.requests.append(request[0])
+                if request[0] == RequestType.CHECK_CONNECTED.value:
+                    connection.send_fmsg(b"")
+                elif request[0] in [RequestType.CAPTURE_MAIN.value, RequestType.CAPTURE_PREVIEW.value]:
+                    connection.send_fmsg(self.image)
+        except (OSError, SocketReceivedBytesEmpty):
+            connection.close()
+
+    def close(self) -> None:
+        self.listener.close()
+
+def test_client_falls_back_to_v1(tmp_path, monkeypatch):
+    monkeypatch.setattr(imagerClientConnection, "HELLO_TIMEOUT", 0.5)
+    stub = V1Stub(b"\xff\xd8" + os.urandom(100_000) + b"\xff\xd9")
+    connection = ImagerClientConnection(lambda type, msg: None)
+    try:
+        assert connection.connect("127.0.0.1", stub.port) is not None
+        assert connection.version == 1
+        assert not connection.supports(RequestType.CAPTURE_SERIES)
+
+        path = tmp_path / "main.jpg"
+        assert connection.capture_to_file(path) == path
+        assert path.read_bytes() == stub.image
+        assert connection.capture(preview=True) == stub.image
+        assert stub.requests[0] == RequestType.HELLO.value
+    finally:
+        connection.close()
+        stub.close()
+
+def test_v2_requests_before_negotiation_get_an_empty_answer(imager_server):
+    server, port = imager_server()
+    connection = open_connection(port)
+    try:
+        for request_type in [RequestType.FETCH_CAPTURE, RequestType.LIST_SPOOL]:
+            assert connection.send_fmsg(rtob(request_type))
+            assert connection.recv_fmsg() == b""
+    finally:
+        connection.close()
+
+def test_unknown_v1_request_closes_the_connection(imager_server):
+    server, port = imager_server()
+    connection = open_connection(port)
+    try:
+        assert connection.send_fmsg(bytes([250]))
+        assert connection.sock.recv(1) == b""
+        assert server.isRunning()
+    finally:
+        connection.close()
+
+def start_in_thread(server, port: int) -> threading.Thread:
+    thread = threading.Thread(target=server.start, args=("127.0.0.1", port), daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 5
+    while not server.isRunning():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return thread
+
+def test_only_power_off_request_powers_off(tmp_path, monkeypatch):
+    for power_off in [False, True]:
+        server = ImagerServer(tmp_path / "log.txt", 50, FakeCameraBackend(), outputDir=tmp_path / "out", advertise=False)
+        powered_off = []
+        monkeypatch.setattr(server.imagerCtl, "power_off", lambda: powered_off.append(True))
+        port = free_port()
+        thread = start_in_thread(server, port)
+
+        if power_off:
+            connection = open_connection(port)
+            connection.send_fmsg(rtob(RequestType.POWER_OFF))
+        else:
+            server.stop()
+
+        thread.join(10)
+        assert not thread.is_alive()
+        assert powered_off == ([True] if power_off else [])
+
+def test_scheduler_leaves_the_rest_of_output_dir_alone(imager_server, imager_client, tmp_path):
+    output_dir = tmp_path / "shared"
+    output_dir.mkdir()
+    (output_dir / "notes.txt").write_text("not the imager's")
+
+    server, port = imager_server(outputDir=output_dir)
+    client = imager_client(port)
+
+    assert client.capture_to_file(tmp_path / "main.jpg") is not None
+    assert (output_dir / "notes.txt").read_text() == "not the imager's"
+    assert server.scheduler.output_dir.parent == output_dir
@@ -0,0 +1,30 @@
+import sys
+
+from src.connections import partial_path
+from src.Imager.cameraBackends import RpicamStillBackend, PREVIEW_SETTINGS
+from test.fake_rpicam_still import encoded_image
+
+ENCODER = [sys.executable, "-m", "test.fake_rpicam_still", "--fake-startup", "0", "--fake-shutdown", "0"]
+QUALITY = 80
+
+def test_streamed_capture_matches_encoder_output(imager_server, imager_client, tmp_path):
+    server, port = imager_server(RpicamStillBackend(ENCODER))
+    client = imager_client(port)
+
+    path = tmp_path / "preview.jpg"
+    assert client.capture_to_file(path, preview=True, options={"quality": QUALITY}, stream=True) == path
+
+    assert path.read_bytes() == encoded_image(PREVIEW_SETTINGS.width, PREVIEW_SETTINGS.height, QUALITY)
+    assert not partial_path(path).exists()
+    assert not [child for child in server.scheduler.output_dir.iterdir() if child.is_file()]   # never written on the imager
+
+def test_failed_stream_leaves_no_file(imager_server, imager_client, tmp_path):
+    server, port = imager_server(RpicamStillBackend(ENCODER + ["--fake-fail"]))   # stops halfway through the image
+    client = imager_client(port)
+
+    path = tmp_path / "preview.jpg"
+    assert client.capture_to_file(path, preview=True, options={"quality": QUALITY}, stream=True) is None
+
+    assert not path.exists()
+    assert not partial_path(path).exists()
+    assert client.check_connection() is not None     # the failure is reported, the connection stays usable
@@ -0,0 +1,403 @@
+# Transport microbenchmark for the framed socket protocol in src/connections.py
+# Runs a benchmark server and client over loopback, optionally through a proxy that adds
+# latency and limits bandwidth like the USB gadget link between client and Pi
+#
+# usage: python -m test.transport_benchmark [--sizes 0 1048576 31457280] [--repeat 20]
+#            [--server sync|async] [--latency-ms 1] [--bandwidth-mbit 280] [--output results.json]
+#
+# Cases, each run for every payload size (echo only once):
+#   echo   CHECK_CONNECTED-like round trip with an empty request and a one byte reply
+#   fmsg   send_fmsg of an in-memory payload, received with recv_fmsg
+#   file   send_file (sendfile) of a payload file, received with recv_fmsg_to_file like the client does
+#   frame  v2 send_frame_file, received with recv_frame
+#
+# Socket calls are counted per request by wrapping the sockets (the async server only reports
+# sendfile calls, its reads and writes happen inside asyncio). Results are printed as a table
+# and written as JSON with --output, so runs before and after a change can be diffed.
+
+import os
+import sys
+import json
+import time
+import queue
+import struct
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+
+from pathlib import Path
+from collections import Counter
+from typing import Callable
+
+from src.connections import Connection, AsyncConnection, MessageKind, Status
+from src.exceptions import SocketReceivedBytesEmpty
+from test.send_file_benchmark import peak_rss_kib
+
+DEFAULT_SIZES = [0, 4 << 10, 64 << 10, 1 << 20, 8 << 20, 30 << 20]
+
+REQUEST_FRMT = "!BQ"    # case, payload size
+ECHO, FMSG, FILE, FRAME, STATS = range(5)
+CASES = {"echo": ECHO, "fmsg": FMSG, "file": FILE, "frame": FRAME}
+
+CASE_BYTES = 256 << 20  # large payloads are repeated only until about this many bytes moved
+MIN_REPEAT = 3
+PROXY_CHUNK_SIZE = 64 << 10
+
+calls = Counter()       # socket calls of this process since the last STATS request
+
+def count_sendfile() -> None:
+    """Counts os.sendfile calls, which socket.sendfile and asyncio's sendfile loop over"""
+    sendfile = os.sendfile
+
+    def counted(*args, **kwargs):
+        calls["sendfile"] += 1
+        return sendfile(*args, **kwargs)
+
+    os.sendfile = counted
+
+class CountingSocket:
+    def __init__(self, sock: socket.socket) -> None:
+        """Socket wrapper counting the calls Connection makes, everything else is passed through"""
+        self.sock = sock
+
+    def recv_into(self, *args) -> int:
+        calls["recv"] += 1
+        return self.sock.recv_into(*args)
+
+    def sendall(self, *args) -> None:
+        calls["send"] += 1
+        return self.sock.sendall(*args)
+
+    def sendfile(self, *args) -> int:
+        # os.sendfile calls are counted by count_sendfile
+        return socket.socket.sendfile(self.sock, *args)
+
+    def __getattr__(self, name: str):
+        return getattr(self.sock, name)
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile of values"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+def stats_body(counts: Counter) -> bytes:
+    """Socket calls since the last report and peak memory of this process"""
+    return json.dumps({"calls": dict(counts), "rss_peak_kib": peak_rss_kib()}).encode()
+
+# ---- server ----
+
+def make_payloads(sizes: list[int], directory: Path) -> tuple[dict[int, bytes], dict[int, Path]]:
+    """Random payloads in memory and on disk for every size"""
+    data = os.urandom(max(sizes, default=0))
+    payloads, files = {}, {}
+    for size in sizes:
+        payloads[size] = data[:size]
+        files[size] = directory / f"payload_{size}.bin"
+        files[size].write_bytes(payloads[size])
+    return payloads, files
+
+def serve_sync(server: socket.socket, payloads: dict[int, bytes], files: dict[int, Path]) -> None:
+    """Answers benchmark requests of a single client with Connection"""
+    sock, _ = server.accept()
+    connection = Connection(CountingSocket(sock))
+    connection.tune_for_bulk()
+
+    while True:
+        before = Counter(calls)    # the STATS request itself is not counted
+        try:
+            case, size = struct.unpack(REQUEST_FRMT, connection.recv_fmsg())
+        except SocketReceivedBytesEmpty:
+            break
+
+        if case == ECHO:
+            connection.send_fmsg(b"\x01")
+        elif case == FMSG:
+            connection.send_fmsg(payloads[size])
+        elif case == FILE:
+            connection.send_file(files[size])
+        elif case == FRAME:
+            connection.send_frame_file(MessageKind.RESPONSE, Status.OK, 0, files[size])
+        elif case == STATS:
+            connection.send_fmsg(stats_body(before))
+            calls.clear()
+
+    connection.close()
+
+async def serve_async(server: socket.socket, payloads: dict[int, bytes], files: dict[int, Path]) -> None:
+    """Answers benchmark requests of a single client with AsyncConnection, like the imager server"""
+    done = asyncio.Event()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        connection = AsyncConnection(reader, writer)
+        connection.tune_for_bulk()
+
+        while True:
+            before = Counter(calls)    # the STATS request itself is not counted
+            try:
+                case, size = struct.unpack(REQUEST_FRMT, await connection.recv_fmsg())
+            except SocketReceivedBytesEmpty:
+                break
+
+            if case == ECHO:
+                await connection.send_fmsg(b"\x01")
+            elif case == FMSG:
+                await connection.send_fmsg(payloads[size])
+            elif case == FILE:
+                await connection.send_file(files[size])
+            elif case == FRAME:
+                await connection.send_frame_file(MessageKind.RESPONSE, Status.OK, 0, files[size])
+            elif case == STATS:
+                await connection.send_fmsg(stats_body(before))
+                calls.clear()
+
+        await connection.close()
+        done.set()
+
+    async with await asyncio.start_server(handle, sock=server):
+        await done.wait()
+
+def run_server(mode: str, sizes: list[int]) -> None:
+    """Child process: serves benchmark requests, prints its port once listening"""
+    count_sendfile()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        payloads, files = make_payloads(sizes, Path(tmpdir))
+
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        print(server.getsockname()[1], flush=True)
+
+        if mode == "async":
+            asyncio.run(serve_async(server, payloads, files))
+        else:
+            serve_sync(server, payloads, files)
+        server.close()
+
+# ---- shaping proxy ----
+
+class Pacer:
+    def __init__(self, bandwidth: float) -> None:
+        """Paces chunks to bandwidth bytes/s, shared by the connections of a link or one per connection"""
+        self.bandwidth = bandwidth
+        self.next_free = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self, due: float, size: int) -> float:
+        """Time a chunk of size bytes due at due may be sent at"""
+        with self.lock:
+            start = max(due, self.next_free)
+            self.next_free = start + size / self.bandwidth if self.bandwidth else 0.0
+            return start
+
+def shape(src: socket.socket, dst: socket.socket, latency: float, pacer: Pacer) -> None:
+    """
+    Forwards src to dst, delaying every chunk by latency seconds and pacing them with pacer
+
+    Chunks are queued as soon as they arrive, so the delay does not throttle the sender
+    """
+    chunks = queue.Queue()
+
+    def deliver() -> None:
+        while True:
+            due, data = chunks.get()
+            if data is None:
+                try:
+                    dst.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+                return
+
+            delay = pacer.reserve(due, len(data)) - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            try:
+                dst.sendall(data)
+            except OSError:
+                return
+
+    threading.Thread(target=deliver, daemon=True).start()
+    while True:
+        try:
+            data = src.recv(PROXY_CHUNK_SIZE)
+        except OSError:
+            data = b""
+        chunks.put((time.monotonic() + latency, data or None))
+        if not data:
+            return
+
+def run_proxy(target: int, latency_ms: float, bandwidth_mbit: float, shared: bool = False) -> None:
+    """
+    Child process: shaping proxy in front of 127.0.0.1:target, prints its port once listening
+
+    shared: bandwidth is the limit of all connections together (one link), instead of the limit of each
+    """
+    latency = latency_ms / 1000
+    bandwidth = bandwidth_mbit * 1e6 / 8
+    links = (Pacer(bandwidth), Pacer(bandwidth))
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(16)
+    print(server.getsockname()[1], flush=True)
+
+    while True:
+        client, _ = server.accept()
+        upstream = socket.create_connection(("127.0.0.1", target))
+        for sock in [client, upstream]:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        up, down = links if shared else (Pacer(bandwidth), Pacer(bandwidth))
+        threading.Thread(target=shape, args=(client, upstream, latency, up), daemon=True).start()
+        threading.Thread(target=shape, args=(upstream, client, latency, down), daemon=True).start()
+
+# ---- client ----
+
+def spawn(role_args: list[str]) -> tuple[subprocess.Popen, int]:
+    """Starts a child process of this script, returns it with the port it listens on"""
+    process = subprocess.Popen([sys.executable, "-m", "test.transport_benchmark"] + role_args, stdout=subprocess.PIPE, text=True)
+    return process, int(process.stdout.readline())
+
+class BenchmarkClient:
+    def __init__(self, port: int, directory: Path) -> None:
+        """Sends benchmark requests and receives the replies the way the imager client does"""
+        self.connection = Connection(CountingSocket(socket.create_connection(("127.0.0.1", port))))
+        self.connection.tune_for_bulk()
+        self.fpath = directory / "received.bin"
+
+    def request(self, case: int, size: int) -> int:
+        """Sends one request and receives its reply, returns the size of the reply body"""
+        self.connection.send_fmsg(struct.pack(REQUEST_FRMT, case, size))
+
+        if case == FILE:
+            return self.connection.recv_fmsg_to_file(self.fpath)
+        if case == FRAME:
+            return len(self.connection.recv_frame().body)
+        return len(self.connection.recv_fmsg())
+
+    def server_stats(self) -> dict:
+        """Socket calls of the server since the last call and its peak memory"""
+        self.connection.send_fmsg(struct.pack(REQUEST_FRMT, STATS, 0))
+        return json.loads(self.connection.recv_fmsg())
+
+    def close(self) -> None:
+        self.connection.close()
+
+def per_request(counts: dict, repeats: int) -> dict:
+    return {name: count / repeats for name, count in sorted(counts.items())}
+
+def run_case(client: BenchmarkClient, name: str, size: int, repeats: int) -> dict:
+    """Times repeats requests of one case, then measures the client's peak allocation on one more"""
+    case = CASES[name]
+    client.request(case, size)  # warm up
+    client.server_stats()
+    calls.clear()
+
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        received = client.request(case, size)
+        timings.append(time.perf_counter() - start)
+
+        if received != size and case != ECHO:
+            raise RuntimeError(f"{name} {size}: received {received} bytes")
+
+    client_calls = per_request(calls, repeats)
+    server = client.server_stats()
+
+    # tracemalloc slows the request down, so peak allocation is measured outside the timed runs
+    tracemalloc.start()
+    client.request(case, size)
+    _, peak_alloc = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    client.server_stats()
+
+    median = percentile(timings, 50)
+    return {
+        "case": name,
+        "size": size,
+        "repeats": repeats,
+        "throughput_mib_s": (size / (1 << 20)) / median if median else 0.0,
+        "latency_ms": {label: percentile(timings, p) * 1000 for label, p in
+                       [("min", 0), ("p50", 50), ("p90", 90), ("p99", 99), ("max", 100)]},
+        "client_calls_per_request": client_calls,
+        "server_calls_per_request": per_request(server["calls"], repeats),
+        "client_peak_alloc_kib": peak_alloc // 1024,
+        "client_rss_peak_kib": peak_rss_kib(),
+        "server_rss_peak_kib": server["rss_peak_kib"],
+    }
+
+def format_result(result: dict) -> str:
+    latency = result["latency_ms"]
+    client_calls = " ".join(f"{name}={count:g}" for name, count in result["client_calls_per_request"].items())
+    server_calls = " ".join(f"{name}={count:g}" for name, count in result["server_calls_per_request"].items())
+    return (f"{result['case']:>5} {result['size']:>10} B x{result['repeats']:<4} "
+            f"{result['throughput_mib_s']:9.1f} MiB/s  "
+            f"p50 {latency['p50']:8.2f} ms  p99 {latency['p99']:8.2f} ms  "
+            f"alloc {result['client_peak_alloc_kib']:>7} KiB  "
+            f"client [{client_calls}]  server [{server_calls}]")
+
+def run_benchmark(args: argparse.Namespace, report: Callable[[dict], None]) -> dict:
+    server, port = spawn(["--role", "server", "--server", args.server, "--sizes"] + [str(size) for size in args.sizes])
+    proxy = None
+    if args.latency_ms or args.bandwidth_mbit:
+        proxy, port = spawn(["--role", "proxy", "--port", str(port),
+                             "--latency-ms", str(args.latency_ms), "--bandwidth-mbit", str(args.bandwidth_mbit)])
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            client = BenchmarkClient(port, Path(tmpdir))
+
+            cases = [("echo", 0)] + [(name, size) for size in args.sizes for name in ["fmsg", "file", "frame"]]
+            for name, size in cases:
+                repeats = max(MIN_REPEAT, min(args.repeat, CASE_BYTES // max(size, 1)))
+                results.append(run_case(client, name, size, repeats))
+                report(results[-1])
+
+            client.close()
+    finally:
+        server.wait(timeout=10)
+        if proxy is not None:
+            proxy.kill()
+            proxy.wait()
+
+    return {
+        "config": {"server": args.server, "latency_ms": args.latency_ms, "bandwidth_mbit": args.bandwidth_mbit,
+                   "python": sys.version.split()[0], "platform": sys.platform},
+        "results": results,
+    }
+
+def main() -> None:
+    argParser = argparse.ArgumentParser(description="Loopback microbenchmark for the framed socket protocol")
+    argParser.add_argument("--role", choices=["bench", "server", "proxy"], default="bench")
+    argParser.add_argument("--port", type=int, help="proxy only: port of the server")
+    argParser.add_argument("--server", choices=["sync", "async"], default="async",
+                           help="server side uses Connection (sync) or AsyncConnection like the imager (async)")
+    argParser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="payload sizes in bytes")
+    argParser.add_argument("--repeat", type=int, default=50, help="requests per case (fewer for large payloads)")
+    argParser.add_argument("--latency-ms", type=float, default=0, help="one-way latency added by the shaping proxy")
+    argParser.add_argument("--bandwidth-mbit", type=float, default=0, help="bandwidth limit of the shaping proxy, 0 for none")
+    argParser.add_argument("--shared-bandwidth", action="store_true", help="proxy only: the limit applies to all connections together")
+    argParser.add_argument("--output", type=Path, help="write the results as JSON to this file")
+    args = argParser.parse_args()
+
+    if args.role == "server":
+        run_server(args.server, args.sizes)
+        return
+    if args.role == "proxy":
+        run_proxy(args.port, args.latency_ms, args.bandwidth_mbit, args.shared_bandwidth)
+        return
+
+    results = run_benchmark(args, lambda result: print(format_result(result), flush=True))
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()